@@ -0,0 +1,253 @@
+"""Micro-benchmarks for the FILE TOOLKIT BOT processing paths.
+
+Usage:
+    python bench.py dedupe [--files 8] [--lines 200000] [--workers N] [--no-parallel]
+    python bench.py sort [--files 8] [--lines 200000]
+    python bench.py filter [--lines 500000] [--patterns 300]
+    python bench.py startup [--runs 5]
+    python bench.py render [--users 1000] [--calls 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import main
+
+
+def make_contents(files: int, lines: int, dupe_ratio: float = 0.3) -> list:
+    """Build synthetic file contents with a share of repeated lines."""
+    rng = random.Random(42)
+    pool_size = max(1, int(files * lines * (1 - dupe_ratio)))
+    contents = []
+    for _ in range(files):
+        rows = [f"user{rng.randrange(pool_size)}@example.com:pass{rng.randrange(1000)}"
+                for _ in range(lines)]
+        contents.append("\n".join(rows) + "\n")
+    return contents
+
+
+def sequential_loop(contents: list) -> tuple:
+    """Original single-threaded set-and-append dedupe."""
+    all_lines = []
+    for content in contents:
+        all_lines.extend(content.splitlines())
+    seen = set()
+    unique_lines = []
+    for line in all_lines:
+        if line not in seen:
+            seen.add(line)
+            unique_lines.append(line)
+    return unique_lines, len(all_lines)
+
+
+def sequential_fast(contents: list) -> tuple:
+    """Single-threaded dict.fromkeys() over all contents."""
+    all_lines = []
+    for content in contents:
+        all_lines.extend(content.splitlines())
+    return list(dict.fromkeys(all_lines)), len(all_lines)
+
+
+def vectorized(contents: list) -> tuple:
+    """NumPy hash-and-sort first-occurrence dedupe over all contents."""
+    all_lines = []
+    for content in contents:
+        all_lines.extend(content.splitlines())
+    firsts = main.first_occurrence_indices(all_lines)
+    return list(map(all_lines.__getitem__, firsts.tolist())), len(all_lines)
+
+
+def timed(label: str, func, *args) -> tuple:
+    """Run func once and print its wall time."""
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<24} {elapsed * 1000:9.1f} ms")
+    return result
+
+
+def bench_dedupe(args) -> None:
+    """Compare the sequential loop against the parallel dedupe."""
+    contents = make_contents(args.files, args.lines)
+    size_mb = sum(len(c) for c in contents) / (1024 * 1024)
+    print(f"dedupe: {args.files} files x {args.lines} lines ({size_mb:.1f} MB)")
+
+    expected = timed("sequential loop", sequential_loop, contents)
+    fast = timed("dict.fromkeys", sequential_fast, contents)
+    assert fast == expected, "dict.fromkeys output differs from sequential"
+    vector = timed("numpy vectorized", vectorized, contents)
+    assert vector == expected, "vectorized output differs from sequential"
+    print(f"  (combine picks numpy from {main.VECTORIZED_DEDUPE_MIN_LINES} lines)")
+
+    if args.no_parallel:
+        return
+    main.get_process_pool()  # exclude pool start-up from the timing
+    for workers in sorted({1, 2, args.workers}):
+        result = timed(f"parallel ({workers} workers)", main.parallel_dedupe, contents, workers)
+        assert result == expected, "parallel output differs from sequential"
+
+
+def bench_sort(args) -> None:
+    """Compare ordered dedupe, in-memory sorted dedupe and the external merge sort."""
+    contents = make_contents(args.files, args.lines)
+    size_mb = sum(len(c) for c in contents) / (1024 * 1024)
+    print(f"sort: {args.files} files x {args.lines} lines ({size_mb:.1f} MB)")
+    main.get_process_pool()  # exclude pool start-up from the timing
+    timed("ordered dedupe", main.combine_dedupe, contents)
+    expected = timed("in-memory sort", lambda: sorted(sequential_fast(contents)[0]))
+
+    def external_sort() -> list:
+        with tempfile.TemporaryDirectory(prefix="sort_") as workdir:
+            range_paths, _, _ = main.external_sort_unique(contents, workdir)
+            return [line for path in range_paths for line in main.read_range(path)]
+
+    result = timed("external merge sort", external_sort)
+    assert result == expected, "external sort output differs from sorted(set())"
+
+
+def bench_filter(args) -> None:
+    """Compare a plain alternation with the trie-factored filter and the read-only pass."""
+    contents = make_contents(1, args.lines)
+    lines = contents[0].splitlines()
+    rng = random.Random(7)
+    patterns = [line.split(":")[0] for line in rng.sample(lines, args.patterns)]
+    spec = main.parse_filter_patterns(patterns)
+    print(f"filter: {args.lines} lines ({len(contents[0]) / (1024 * 1024):.1f} MB), {args.patterns} patterns")
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(contents[0])
+    try:
+        timed("read only", lambda: sum(map(len, main.iter_upload_lines(path, "bench.txt"))))
+        plain = re.compile("|".join(map(re.escape, patterns)))
+        expected = timed("plain alternation", lambda: list(filter(plain.search, lines)))
+        result = timed("trie alternation", main.filter_lines, lines, spec)
+        assert result == expected, "trie filter output differs from plain alternation"
+        timed("filter_upload", main.filter_upload, path, "bench.txt", spec)
+    finally:
+        os.unlink(path)
+
+
+def import_seconds() -> float:
+    """Time `import main` in a fresh interpreter."""
+    code = "import time; start = time.perf_counter(); import main; print(time.perf_counter() - start)"
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True)
+    return float(result.stdout)
+
+
+async def startup_run(timeout: float) -> tuple:
+    """Launch the bot against the fake API; return seconds to first getUpdates and to the first reply."""
+    import loadtest
+    api = loadtest.FakeBotAPI()
+    port = await api.start()
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    start = time.perf_counter()
+    bot = loadtest.start_bot(port, workdir)
+    try:
+        await asyncio.wait_for(api.polled.wait(), timeout)
+        polled = time.perf_counter() - start
+        user = loadtest.SimUser(api, loadtest.Stats(), 1, 0, timeout)
+        await user.step("start", lambda: user.send_text("/start"), ("sendMessage",))
+        replied = time.perf_counter() - start
+        return polled, replied
+    finally:
+        bot.terminate()
+        await asyncio.to_thread(bot.wait, 10)
+        await api.stop()
+
+
+def bench_startup(args) -> None:
+    """Measure import time, time to first getUpdates and time to the first /start reply."""
+    imports = [import_seconds() for _ in range(args.runs)]
+    runs = [asyncio.run(startup_run(args.timeout)) for _ in range(args.runs)]
+    print(f"startup: median of {args.runs} runs")
+    print(f"  {'import main':<24} {statistics.median(imports) * 1000:9.1f} ms")
+    print(f"  {'first getUpdates':<24} {statistics.median(r[0] for r in runs) * 1000:9.1f} ms")
+    print(f"  {'first /start reply':<24} {statistics.median(r[1] for r in runs) * 1000:9.1f} ms")
+
+
+class RenderQuery:
+    """Callback query stand-in that accepts edits without any network call."""
+
+    def __init__(self, data: str):
+        self.data = data
+
+    async def answer(self, *args, **kwargs) -> None:
+        pass
+
+    async def edit_message_text(self, text: str, reply_markup=None) -> None:
+        pass
+
+
+async def render_callbacks(datas: list, calls: int) -> None:
+    """Time button_callback for each callback data with no network I/O."""
+    user = SimpleNamespace(id=1, first_name="Bench", last_name="", username="")
+    for data in datas:
+        update = SimpleNamespace(callback_query=RenderQuery(data), effective_user=user,
+                                 effective_chat=SimpleNamespace(id=1))
+        context = SimpleNamespace(user_data={}, bot=None)
+        start = time.perf_counter()
+        for _ in range(calls):
+            await main.button_callback(update, context)
+        print(f"  {data:<24} {(time.perf_counter() - start) / calls * 1e6:9.1f} us")
+
+
+def bench_render(args) -> None:
+    """Per-callback cost of button_callback for static screens, with a populated users file."""
+    os.chdir(tempfile.mkdtemp(prefix="bench_render_"))
+    now = main.datetime.now().isoformat()
+    users = {str(uid): {"id": uid, "first_name": f"user{uid}", "last_name": "", "username": "",
+                        "last_active": now} for uid in range(2, args.users + 2)}
+    with open(main.DATA_FILE, "w", encoding="utf-8") as f:
+        json.dump(users, f, indent=2)
+    print(f"render: button_callback, {args.users} registered users, {args.calls} calls each")
+    datas = ["menu", "help", "settings", "combine", "split", "maketxt", "csvtotxt", "sample", "filter"]
+    asyncio.run(render_callbacks(datas, args.calls))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    dedupe = sub.add_parser("dedupe", help="combine dedupe paths")
+    dedupe.add_argument("--files", type=int, default=8)
+    dedupe.add_argument("--lines", type=int, default=200_000)
+    dedupe.add_argument("--workers", type=int, default=main.DEDUPE_WORKERS)
+    dedupe.add_argument("--no-parallel", action="store_true", help="skip the process-pool runs")
+    dedupe.set_defaults(func=bench_dedupe)
+
+    sort = sub.add_parser("sort", help="sorted-unique paths")
+    sort.add_argument("--files", type=int, default=8)
+    sort.add_argument("--lines", type=int, default=200_000)
+    sort.set_defaults(func=bench_sort)
+
+    filter_ = sub.add_parser("filter", help="pattern filter paths")
+    filter_.add_argument("--lines", type=int, default=500_000)
+    filter_.add_argument("--patterns", type=int, default=300)
+    filter_.set_defaults(func=bench_filter)
+
+    startup = sub.add_parser("startup", help="bot start-up latency against the fake Bot API")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--timeout", type=float, default=30.0)
+    startup.set_defaults(func=bench_startup)
+
+    render = sub.add_parser("render", help="button_callback cost per screen")
+    render.add_argument("--users", type=int, default=1000)
+    render.add_argument("--calls", type=int, default=200)
+    render.set_defaults(func=bench_render)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main_cli()
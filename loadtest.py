@@ -0,0 +1,580 @@
+"""End-to-end load test for the FILE TOOLKIT BOT against a fake Bot API.
+
+Starts a local fake Telegram Bot API server, launches main.py pointed at
+it, and simulates users running the combine, split, MAKE TXT, CSV->TXT,
+SUBTRACT, SAMPLE and FILTER flows with generated files, plus a split
+cancelled mid-delivery.
+Runs entirely offline.
+
+With --workers N the bot runs as a dispatcher routing users to N worker
+processes, and memory is summed over the whole process tree.
+
+Usage:
+    python loadtest.py [--users 10] [--rounds 2] [--lines 20000] [--workers 1]
+                       [--flows combine,split,maketxt,csvtotxt,subtract,sample,filter,cancel]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from email.parser import BytesParser
+from email.policy import HTTP
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Toolkit", "username": "toolkit_bot"}
+FLOWS = ("combine", "split", "maketxt", "csvtotxt", "subtract", "sample", "filter", "cancel")
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              FAKE BOT API
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class FakeBotAPI:
+    """Minimal Bot API server: long-polled updates, files and outgoing calls.
+
+    Calls the bot makes are recorded per chat as (method, params, result)
+    events so simulated users can wait for the reply they expect.
+    """
+
+    def __init__(self, token: str = TOKEN):
+        self.token = token
+        self.updates: List[Dict] = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1000)
+        self.new_update = asyncio.Event()
+        self.polled = asyncio.Event()
+        self.files: Dict[str, bytes] = {}
+        self.events: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self.calls = Counter()
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start listening and return the bound port."""
+        self.server = await asyncio.start_server(self._serve, host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def stop(self) -> None:
+        """Stop listening."""
+        if self.server:
+            self.server.close()
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Test-side API
+    # ─────────────────────────────────────────────────────────────────────────
+
+    def push_update(self, payload: Dict) -> None:
+        """Queue an update for the next getUpdates call."""
+        self.updates.append({"update_id": next(self.update_ids), **payload})
+        self.new_update.set()
+
+    def add_file(self, content: bytes) -> Dict:
+        """Store file content and return its Document-style ids."""
+        file_id = f"file{len(self.files) + 1}"
+        self.files[file_id] = content
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}", "file_size": len(content)}
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # HTTP
+    # ─────────────────────────────────────────────────────────────────────────
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                verb, target, _ = request_line.decode().split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await self._read_body(reader, headers)
+                status, content_type, payload = await self._dispatch(verb, target, headers, body)
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\nConnection: keep-alive\r\n\r\n".encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader: asyncio.StreamReader, headers: Dict[str, str]) -> bytes:
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                if size == 0:
+                    await reader.readline()
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        return b""
+
+    async def _dispatch(self, verb: str, target: str, headers: Dict[str, str], body: bytes):
+        path = unquote(urlsplit(target).path)
+        file_prefix = f"/file/bot{self.token}/"
+        if verb == "GET" and path.startswith(file_prefix):
+            self.calls["download"] += 1
+            content = self.files.get(path[len(file_prefix):])
+            if content is None:
+                return 404, "text/plain", b"not found"
+            return 200, "application/octet-stream", content
+        method = path.rsplit("/", 1)[-1]
+        params = self._parse_params(headers.get("content-type", ""), body)
+        self.calls[method] += 1
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        chat_id = params.get("chat_id")
+        if chat_id is not None:
+            self.events[int(chat_id)].put_nowait((method, params, result, time.perf_counter()))
+        return 200, "application/json", json.dumps({"ok": True, "result": result}).encode()
+
+    @staticmethod
+    def _parse_params(content_type: str, body: bytes) -> Dict:
+        params = {}
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+            )
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename():
+                    params[name] = {"filename": part.get_filename(), "size": len(part.get_payload(decode=True))}
+                else:
+                    params[name] = part.get_payload(decode=True).decode()
+        elif body:
+            params = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        return params
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Bot API methods
+    # ─────────────────────────────────────────────────────────────────────────
+
+    def _message(self, params: Dict, **fields) -> Dict:
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    async def api_getMe(self, params: Dict) -> Dict:
+        return BOT_USER
+
+    async def api_getUpdates(self, params: Dict) -> List[Dict]:
+        self.polled.set()
+        offset = int(params.get("offset", 0) or 0)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    async def api_getFile(self, params: Dict) -> Dict:
+        file_id = params["file_id"]
+        return {"file_id": file_id, "file_unique_id": f"u{file_id}",
+                "file_size": len(self.files.get(file_id, b"")), "file_path": file_id}
+
+    async def api_sendMessage(self, params: Dict) -> Dict:
+        return self._message(params, text=params.get("text", ""))
+
+    async def api_editMessageText(self, params: Dict) -> Dict:
+        message = self._message(params, text=params.get("text", ""))
+        message["message_id"] = int(params["message_id"])
+        return message
+
+    async def api_sendDocument(self, params: Dict) -> Dict:
+        document = params.get("document", {})
+        return self._message(
+            params,
+            caption=params.get("caption", ""),
+            document={"file_id": f"out{next(self.message_ids)}", "file_unique_id": "out",
+                      "file_name": document.get("filename", ""), "file_size": document.get("size", 0)},
+        )
+
+    async def api_sendMediaGroup(self, params: Dict) -> List[Dict]:
+        messages = []
+        for item in json.loads(params["media"]):
+            document = params.get(item["media"].replace("attach://", ""), {})
+            messages.append(await self.api_sendDocument(
+                {"chat_id": params["chat_id"], "caption": item.get("caption", ""), "document": document}
+            ))
+        return messages
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SIMULATED USERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class StepFailed(Exception):
+    """A simulated user did not get the reply it waited for."""
+
+
+class Stats:
+    """Latency samples and error counts per step and flow."""
+
+    def __init__(self):
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.step_errors = Counter()
+        self.flows_ok = Counter()
+        self.flows_failed = Counter()
+        self.updates_sent = 0
+
+
+def captions(params: Dict) -> List[str]:
+    """Return the captions of a sendDocument or sendMediaGroup call."""
+    if "media" in params:
+        return [item.get("caption", "") for item in json.loads(params["media"])]
+    return [params.get("caption", "")]
+
+
+def make_lines(rng: random.Random, count: int, dupe_ratio: float = 0.2) -> List[str]:
+    """Generate credential-style lines with a share of duplicates."""
+    pool = max(1, int(count * (1 - dupe_ratio)))
+    return [f"user{rng.randrange(pool)}@example.com:pw{rng.randrange(10000)}" for _ in range(count)]
+
+
+class SimUser:
+    """One simulated Telegram user driving the bot through a flow."""
+
+    def __init__(self, api: FakeBotAPI, stats: Stats, user_id: int, lines: int, timeout: float):
+        self.api = api
+        self.stats = stats
+        self.user_id = user_id
+        self.lines = lines
+        self.timeout = timeout
+        self.rng = random.Random(user_id)
+        self.message_ids = itertools.count(1)
+        self.bot_message_id = None
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Update builders
+    # ─────────────────────────────────────────────────────────────────────────
+
+    def _send(self, payload: Dict) -> None:
+        self.stats.updates_sent += 1
+        self.api.push_update(payload)
+
+    def _base_message(self) -> Dict:
+        return {"message_id": next(self.message_ids), "date": int(time.time()),
+                "chat": self.chat, "from": self.user}
+
+    def send_text(self, text: str) -> None:
+        message = {**self._base_message(), "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self._send({"message": message})
+
+    def send_document(self, name: str, content: bytes) -> None:
+        document = {**self.api.add_file(content), "file_name": name, "mime_type": "text/plain"}
+        self._send({"message": {**self._base_message(), "document": document}})
+
+    def press(self, data: str) -> None:
+        message = {"message_id": self.bot_message_id, "date": int(time.time()),
+                   "chat": self.chat, "from": BOT_USER, "text": "menu"}
+        self._send({"callback_query": {"id": str(self.rng.random()), "from": self.user,
+                                       "chat_instance": str(self.user_id), "data": data,
+                                       "message": message}})
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Expectations
+    # ─────────────────────────────────────────────────────────────────────────
+
+    async def expect(self, methods: tuple, predicate: Callable[[Dict], bool] = lambda p: True) -> Dict:
+        """Wait for a bot call to this chat matching methods and predicate."""
+        queue = self.api.events[self.user_id]
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise StepFailed(f"timed out waiting for {methods}")
+            try:
+                method, params, result, _ = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                raise StepFailed(f"timed out waiting for {methods}")
+            if method in methods and predicate(params):
+                if method in ("sendMessage", "editMessageText"):
+                    self.bot_message_id = result["message_id"]
+                return params
+
+    async def step(self, name: str, action: Callable[[], None], methods: tuple,
+                   predicate: Callable[[Dict], bool] = lambda p: True) -> Dict:
+        """Perform an action and time it until the expected reply arrives."""
+        start = time.perf_counter()
+        action()
+        try:
+            params = await self.expect(methods, predicate)
+        except StepFailed:
+            self.stats.step_errors[name] += 1
+            raise
+        self.stats.latency[name].append(time.perf_counter() - start)
+        return params
+
+    # ─────────────────────────────────────────────────────────────────────────
+    # Flows
+    # ─────────────────────────────────────────────────────────────────────────
+
+    def _file(self, lines: int) -> bytes:
+        return ("\n".join(make_lines(self.rng, lines)) + "\n").encode()
+
+    async def flow_combine(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:combine", lambda: self.press("combine"), ("editMessageText",))
+        for i in range(3):
+            content = self._file(self.lines // 3)
+            await self.step("combine:upload", lambda: self.send_document(f"part{i}.txt", content), ("sendMessage",),
+                            lambda p: "COMBINER" in p.get("text", ""))
+        await self.step("combine:run", lambda: self.press("do_combine"), ("sendDocument",))
+
+    async def flow_split(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:split", lambda: self.press("split"), ("editMessageText",))
+        content = self._file(self.lines)
+        await self.step("split:upload", lambda: self.send_document("big.txt", content), ("sendMessage",),
+                        lambda p: "SPLITTER" in p.get("text", ""))
+        await self.step("split:method", lambda: self.press("split_count"), ("editMessageText",))
+
+        def last_part(params: Dict) -> bool:
+            match = re.search(r"Part (\d+) of (\d+)", captions(params)[-1])
+            return bool(match) and match.group(1) == match.group(2)
+
+        await self.step("split:run", lambda: self.send_text("3"), ("sendDocument", "sendMediaGroup"), last_part)
+
+    async def flow_maketxt(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:maketxt", lambda: self.press("maketxt"), ("editMessageText",))
+        for _ in range(5):
+            text = "\n".join(make_lines(self.rng, 50))
+            await self.step("maketxt:text", lambda: self.send_text(text), ("sendMessage",))
+        await self.step("maketxt:run", lambda: self.press("do_maketxt"), ("sendDocument",))
+
+    async def flow_csvtotxt(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:csvtotxt", lambda: self.press("csvtotxt"), ("editMessageText",))
+        content = self._file(self.lines)
+        await self.step("csvtotxt:run", lambda: self.send_document("data.csv", content), ("sendDocument",))
+
+    async def flow_subtract(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:subtract", lambda: self.press("setop_subtract"), ("editMessageText",))
+        lines = make_lines(self.rng, self.lines)
+        for i, part in enumerate((lines, lines[::3])):
+            content = ("\n".join(part) + "\n").encode()
+            await self.step("subtract:upload", lambda: self.send_document(f"list{i}.txt", content), ("sendMessage",),
+                            lambda p: "SUBTRACT" in p.get("text", ""))
+        await self.step("subtract:run", lambda: self.press("do_setop"), ("sendDocument",))
+
+    async def flow_sample(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:sample", lambda: self.press("sample"), ("editMessageText",))
+        content = self._file(self.lines)
+        await self.step("sample:upload", lambda: self.send_document("big.txt", content), ("sendMessage",),
+                        lambda p: "SAMPLE" in p.get("text", ""))
+        await self.step("sample:method", lambda: self.press("sample_random"), ("editMessageText",))
+        await self.step("sample:run", lambda: self.send_text("100"), ("sendDocument",))
+
+    async def flow_filter(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:filter", lambda: self.press("filter"), ("editMessageText",))
+        content = self._file(self.lines)
+        await self.step("filter:upload", lambda: self.send_document("big.txt", content), ("sendMessage",),
+                        lambda p: "FILTER" in p.get("text", ""))
+        patterns = "/(\\d)\\1@/\n" + "\n".join(f"{self.rng.randrange(100)}@" for _ in range(50)) + "\n-/:pw1\\d+$/"
+        await self.step("filter:patterns", lambda: self.send_text(patterns), ("sendMessage",),
+                        lambda p: "Patterns:" in p.get("text", ""))
+        await self.step("filter:run", lambda: self.press("do_filter"), ("sendDocument",))
+
+    async def flow_cancel(self) -> None:
+        await self.step("start", lambda: self.send_text("/start"), ("sendMessage",))
+        await self.step("menu:split", lambda: self.press("split"), ("editMessageText",))
+        content = self._file(self.lines)
+        await self.step("split:upload", lambda: self.send_document("big.txt", content), ("sendMessage",),
+                        lambda p: "SPLITTER" in p.get("text", ""))
+        await self.step("split:method", lambda: self.press("split_count"), ("editMessageText",))
+        status = await self.step("cancel:status", lambda: self.send_text("200"), ("sendMessage", "editMessageText"),
+                                 lambda p: "cancel_job_" in p.get("reply_markup", ""))
+        job_button = re.search(r"cancel_job_\w+", status["reply_markup"]).group(0)
+        await self.expect(("sendDocument", "sendMediaGroup"), lambda p: captions(p)[0].startswith("► Part 1 of"))
+        await self.step("cancel:press", lambda: self.press(job_button), ("editMessageText",),
+                        lambda p: "CANCELLED" in p.get("text", ""))
+        # The job has unwound before CANCELLED is shown, so no part may follow it
+        try:
+            await asyncio.wait_for(self.expect(("sendDocument", "sendMediaGroup")), 1.0)
+        except (asyncio.TimeoutError, StepFailed):
+            return
+        self.stats.step_errors["cancel:press"] += 1
+        raise StepFailed("part sent after cancel")
+
+    async def run(self, flows: List[str], rounds: int) -> None:
+        """Run each flow `rounds` times, recording successes and failures."""
+        for _ in range(rounds):
+            for flow in flows:
+                try:
+                    await getattr(self, f"flow_{flow}")()
+                    self.stats.flows_ok[flow] += 1
+                except StepFailed:
+                    self.stats.flows_failed[flow] += 1
+                    # Drop stale replies before the next flow starts over
+                    await asyncio.sleep(1)
+                    queue = self.api.events[self.user_id]
+                    while not queue.empty():
+                        queue.get_nowait()
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              BOT PROCESS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def read_memory_kb(pid: int) -> Dict[str, int]:
+    """Return current and peak RSS of a process in KB (Linux /proc)."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def read_tree_memory_kb(pid: int) -> Dict[str, int]:
+    """Sum current and peak RSS over a process and its descendants in KB (Linux /proc)."""
+    totals = Counter(read_memory_kb(pid))
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as children:
+            for child in children.read().split():
+                totals.update(read_tree_memory_kb(int(child)))
+    except OSError:
+        pass
+    return dict(totals)
+
+
+def start_bot(port: int, workdir: str, extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """Launch main.py in workdir, pointed at the fake API on port."""
+    env = {
+        **os.environ,
+        "BOT_TOKEN": TOKEN,
+        "BOT_API_URL": f"http://127.0.0.1:{port}/bot",
+        "BOT_API_FILE_URL": f"http://127.0.0.1:{port}/file/bot",
+        **(extra_env or {}),
+    }
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    log = open(os.path.join(workdir, "bot.log"), "ab")
+    return subprocess.Popen([sys.executable, script], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of samples."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def print_report(stats: Stats, api: FakeBotAPI, elapsed: float, memory: Dict[str, int]) -> None:
+    """Print latency percentiles, throughput, memory and error rates."""
+    print()
+    print(f"{'step':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name in sorted(set(stats.latency) | set(stats.step_errors)):
+        samples = stats.latency.get(name, [])
+        if samples:
+            p50, p95, p99 = (percentile(samples, p) * 1000 for p in (50, 95, 99))
+            print(f"{name:<18}{len(samples):>7}{p50:>10.1f}{p95:>10.1f}{p99:>10.1f}{stats.step_errors[name]:>8}")
+        else:
+            print(f"{name:<18}{0:>7}{'-':>10}{'-':>10}{'-':>10}{stats.step_errors[name]:>8}")
+    print()
+    total_flows = sum(stats.flows_ok.values()) + sum(stats.flows_failed.values())
+    failed = sum(stats.flows_failed.values())
+    print(f"updates/sec:   {stats.updates_sent / elapsed:.1f} ({stats.updates_sent} updates in {elapsed:.1f}s)")
+    print(f"api calls:     {sum(api.calls.values())} " + ", ".join(f"{k}={v}" for k, v in api.calls.most_common()))
+    print(f"flow errors:   {failed}/{total_flows} ({100 * failed / max(1, total_flows):.1f}%) "
+          + ", ".join(f"{flow}={stats.flows_failed[flow]}" for flow in stats.flows_failed))
+    if memory:
+        print(f"bot memory:    rss={memory.get('VmRSS', 0) / 1024:.1f} MB  peak={memory.get('VmHWM', 0) / 1024:.1f} MB")
+
+
+async def run_loadtest(args) -> int:
+    """Start the fake API and bot, run all users and print the report."""
+    api = FakeBotAPI()
+    port = await api.start()
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    bot = start_bot(port, workdir, {"BOT_WORKERS": str(args.workers)})
+    try:
+        try:
+            await asyncio.wait_for(api.polled.wait(), args.startup_timeout)
+        except asyncio.TimeoutError:
+            print(f"bot did not start polling; see {workdir}/bot.log")
+            return 1
+        stats = Stats()
+        users = [SimUser(api, stats, 10_000 + i, args.lines, args.timeout) for i in range(args.users)]
+        flows = args.flows.split(",")
+        peak = {}
+        read_memory = read_tree_memory_kb if args.workers > 1 else read_memory_kb
+
+        async def sample_memory():
+            while True:
+                peak.update(read_memory(bot.pid))
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_memory())
+        start = time.perf_counter()
+        await asyncio.gather(*(user.run(flows, args.rounds) for user in users))
+        elapsed = time.perf_counter() - start
+        sampler.cancel()
+        peak.update(read_memory(bot.pid))
+        print_report(stats, api, elapsed, peak)
+        return 1 if sum(stats.flows_failed.values()) else 0
+    finally:
+        bot.terminate()
+        try:
+            # Keep serving while the bot shuts down; it makes a final getUpdates call
+            await asyncio.to_thread(bot.wait, 10)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await api.stop()
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10, help="concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=2, help="times each user runs every flow")
+    parser.add_argument("--lines", type=int, default=20_000, help="lines per generated upload")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="comma-separated flows to run")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for each reply")
+    parser.add_argument("--startup-timeout", type=float, default=30.0)
+    parser.add_argument("--workers", type=int, default=1, help="bot worker processes behind a dispatcher")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run_loadtest(args)))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,1261 +1,4897 @@
-import os
-import logging
-import json
-import tempfile
-import asyncio
-from datetime import datetime
-from typing import Dict, List
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Document
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    CallbackQueryHandler,
-    ContextTypes,
-    ConversationHandler,
-    filters,
-)
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              CONFIGURATION
-# ═══════════════════════════════════════════════════════════════════════════════
-
-BOT_TOKEN = "8372967401:AAHXy4nGkL7TI3nwSDRFM3ovOpMKrFzmqPg"
-DATA_FILE = "users_data.json"
-
-# Conversation states
-COMBINE_WAITING = 1
-SPLIT_WAITING = 2
-SPLIT_METHOD = 3
-SPLIT_VALUE = 4
-MAKETXT_WAITING = 5
-CSVTOTXT_WAITING = 6
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              LOGGING SETUP
-# ═══════════════════════════════════════════════════════════════════════════════
-
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.WARNING
-)
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("telegram").setLevel(logging.WARNING)
-logger = logging.getLogger(__name__)
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              DATA MANAGEMENT
-# ═══════════════════════════════════════════════════════════════════════════════
-
-def load_users() -> Dict:
-    """Load users data from JSON file."""
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
-
-def save_users(users: Dict) -> None:
-    """Save users data to JSON file."""
-    with open(DATA_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2, ensure_ascii=False)
-
-def register_user(user) -> None:
-    """Register or update user in database."""
-    users = load_users()
-    user_id = str(user.id)
-    users[user_id] = {
-        "id": user.id,
-        "first_name": user.first_name or "",
-        "last_name": user.last_name or "",
-        "username": user.username or "",
-        "last_active": datetime.now().isoformat()
-    }
-    save_users(users)
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              UI COMPONENTS
-# ═══════════════════════════════════════════════════════════════════════════════
-
-HEADER = """
-╔══════════════════════════════════════╗
-║       FILE TOOLKIT BOT               ║
-║          Dev: Levetche               ║
-╚══════════════════════════════════════╝"""
-
-DIVIDER = "━" * 40
-
-def main_menu_keyboard() -> InlineKeyboardMarkup:
-    """Create main menu keyboard."""
-    keyboard = [
-        [
-            InlineKeyboardButton("◈ COMBINER ◈", callback_data="combine"),
-            InlineKeyboardButton("◈ SPLITTER ◈", callback_data="split"),
-        ],
-        [
-            InlineKeyboardButton("◈ MAKE TXT ◈", callback_data="maketxt"),
-            InlineKeyboardButton("◈ CSV→TXT ◈", callback_data="csvtotxt"),
-        ],
-        [
-            InlineKeyboardButton("▣ STATS", callback_data="stats"),
-            InlineKeyboardButton("▣ HELP", callback_data="help"),
-        ],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def back_keyboard() -> InlineKeyboardMarkup:
-    """Create back button keyboard."""
-    keyboard = [[InlineKeyboardButton("◄ BACK TO MENU", callback_data="menu")]]
-    return InlineKeyboardMarkup(keyboard)
-
-def combine_keyboard() -> InlineKeyboardMarkup:
-    """Create combiner action keyboard."""
-    keyboard = [
-        [InlineKeyboardButton("▶ COMBINE NOW", callback_data="do_combine")],
-        [InlineKeyboardButton("✕ CLEAR FILES", callback_data="clear_combine")],
-        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_combine")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def split_method_keyboard() -> InlineKeyboardMarkup:
-    """Create split method selection keyboard."""
-    keyboard = [
-        [InlineKeyboardButton("◈ BY MAX SIZE (KB)", callback_data="split_size")],
-        [InlineKeyboardButton("◈ BY NUMBER OF FILES", callback_data="split_count")],
-        [InlineKeyboardButton("◈ BY MAX LINES", callback_data="split_lines")],
-        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-def cancel_keyboard() -> InlineKeyboardMarkup:
-    """Create cancel keyboard."""
-    keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="menu")]]
-    return InlineKeyboardMarkup(keyboard)
-
-def maketxt_keyboard() -> InlineKeyboardMarkup:
-    """Create make txt action keyboard."""
-    keyboard = [
-        [InlineKeyboardButton("▶ CREATE TXT", callback_data="do_maketxt")],
-        [InlineKeyboardButton("✕ CLEAR LINES", callback_data="clear_maketxt")],
-        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_maketxt")],
-    ]
-    return InlineKeyboardMarkup(keyboard)
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              COMMAND HANDLERS
-# ═══════════════════════════════════════════════════════════════════════════════
-
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle /start command."""
-    user = update.effective_user
-    register_user(user)
-    
-    welcome_text = f"""
-{HEADER}
-
-  Welcome, {user.first_name}!
-
-{DIVIDER}
-
-  ◈ COMBINER
-    Merge multiple TXT/CSV files
-    into a single TXT file
-
-  ◈ SPLITTER
-    Split large TXT/CSV files
-    by size, count, or lines
-
-  ◈ MAKE TXT
-    Convert text messages to TXT
-
-  ◈ CSV→TXT
-    Convert CSV file to TXT
-
-{DIVIDER}
-      Select an option below
-{DIVIDER}"""
-    
-    # Clear any previous session data
-    context.user_data.clear()
-    
-    await update.message.reply_text(
-        welcome_text,
-        reply_markup=main_menu_keyboard(),
-        parse_mode=None
-    )
-    return ConversationHandler.END
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /help command."""
-    register_user(update.effective_user)
-    
-    help_text = f"""
-{HEADER}
-
-           HELP GUIDE
-
-{DIVIDER}
-
-  ► COMBINER
-    1. Select COMBINER
-    2. Send multiple TXT/CSV files
-    3. Click COMBINE NOW
-    4. Receive merged TXT file
-
-  ► SPLITTER
-    1. Select SPLITTER
-    2. Send a TXT/CSV file
-    3. Choose split method
-    4. Enter the value
-    5. Receive split TXT files
-
-  ► MAKE TXT
-    1. Select MAKE TXT
-    2. Send text messages
-    3. Click CREATE TXT
-    4. Receive TXT file
-
-  ► CSV→TXT
-    1. Select CSV→TXT
-    2. Send a CSV file
-    3. Receive TXT file
-
-  ► COMMANDS
-    /start  - Main menu
-    /help   - This guide
-    /stats  - User statistics
-
-  ► NOTE
-    Duplicates removed automatically
-
-{DIVIDER}"""
-    
-    await update.message.reply_text(help_text, reply_markup=back_keyboard())
-
-async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /stats command."""
-    register_user(update.effective_user)
-    await show_stats(update, context)
-
-async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Display user statistics."""
-    users = load_users()
-    total_users = len(users)
-    
-    if total_users == 0:
-        stats_text = f"""
-{HEADER}
-
-         USER STATISTICS
-
-{DIVIDER}
-
-    No users registered yet
-
-{DIVIDER}"""
-    else:
-        user_list = ""
-        for idx, (uid, data) in enumerate(users.items(), 1):
-            name = f"{data.get('first_name', '')} {data.get('last_name', '')}".strip()
-            username = data.get('username', '')
-            username_display = f"@{username}" if username else "[no username]"
-            user_list += f"  {idx:03d}. {name[:15]:<15} {username_display}\n"
-        
-        stats_text = f"""
-{HEADER}
-
-         USER STATISTICS
-
-{DIVIDER}
-  Total Users: {total_users}
-{DIVIDER}
-
-{user_list}
-{DIVIDER}"""
-    
-    if update.callback_query:
-        await update.callback_query.edit_message_text(
-            stats_text,
-            reply_markup=back_keyboard()
-        )
-    else:
-        await update.message.reply_text(stats_text, reply_markup=back_keyboard())
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              CALLBACK HANDLERS
-# ═══════════════════════════════════════════════════════════════════════════════
-
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle button callbacks."""
-    query = update.callback_query
-    await query.answer()
-    
-    register_user(update.effective_user)
-    data = query.data
-    
-    # ─────────────────────────────────────────────────────────────────────────
-    # MENU NAVIGATION
-    # ─────────────────────────────────────────────────────────────────────────
-    
-    if data == "menu":
-        context.user_data.clear()
-        menu_text = f"""
-{HEADER}
-
-            MAIN MENU
-
-{DIVIDER}
-
-  ◈ COMBINER - Merge files
-  ◈ SPLITTER - Split files
-  ◈ MAKE TXT - Text to file
-  ◈ CSV→TXT  - Convert CSV
-
-{DIVIDER}
-      Select an option below
-{DIVIDER}"""
-        await query.edit_message_text(menu_text, reply_markup=main_menu_keyboard())
-        return ConversationHandler.END
-    
-    elif data == "help":
-        help_text = f"""
-{HEADER}
-
-           HELP GUIDE
-
-{DIVIDER}
-
-  ► COMBINER
-    1. Select COMBINER
-    2. Send multiple TXT/CSV files
-    3. Click COMBINE NOW
-    4. Receive merged TXT file
-
-  ► SPLITTER
-    1. Select SPLITTER
-    2. Send a TXT/CSV file
-    3. Choose split method
-    4. Enter the value
-    5. Receive split TXT files
-
-  ► MAKE TXT
-    1. Select MAKE TXT
-    2. Send text messages
-    3. Click CREATE TXT
-    4. Receive TXT file
-
-  ► NOTE
-    Duplicates removed automatically
-
-{DIVIDER}"""
-        await query.edit_message_text(help_text, reply_markup=back_keyboard())
-        return ConversationHandler.END
-    
-    elif data == "stats":
-        await show_stats(update, context)
-        return ConversationHandler.END
-    
-    # ─────────────────────────────────────────────────────────────────────────
-    # COMBINER
-    # ─────────────────────────────────────────────────────────────────────────
-    
-    elif data == "combine":
-        context.user_data["combine_files"] = []
-        context.user_data["mode"] = "combine"
-        
-        combine_text = f"""
-{HEADER}
-
-            COMBINER
-
-{DIVIDER}
-
-  ► Send TXT or CSV files
-  ► Files will be merged by lines
-  ► Output: single TXT file
-
-  Files received: 0
-
-{DIVIDER}
-      Send your files below
-{DIVIDER}"""
-        
-        await query.edit_message_text(combine_text, reply_markup=combine_keyboard())
-        return COMBINE_WAITING
-    
-    elif data == "do_combine":
-        files = context.user_data.get("combine_files", [])
-        if len(files) < 2:
-            await query.answer("Please send at least 2 files to combine!", show_alert=True)
-            return COMBINE_WAITING
-        
-        await do_combine_files(update, context)
-        return ConversationHandler.END
-    
-    elif data == "clear_combine":
-        context.user_data["combine_files"] = []
-        combine_text = f"""
-{HEADER}
-
-            COMBINER
-
-{DIVIDER}
-
-  ► Files cleared!
-  ► Send new TXT or CSV files
-
-  Files received: 0
-
-{DIVIDER}
-      Send your files below
-{DIVIDER}"""
-        await query.edit_message_text(combine_text, reply_markup=combine_keyboard())
-        return COMBINE_WAITING
-    
-    elif data == "cancel_combine":
-        context.user_data.clear()
-        return await button_callback_menu(update, context)
-    
-    # ─────────────────────────────────────────────────────────────────────────
-    # SPLITTER
-    # ─────────────────────────────────────────────────────────────────────────
-    
-    elif data == "split":
-        context.user_data["mode"] = "split"
-        context.user_data["split_file"] = None
-        
-        split_text = f"""
-{HEADER}
-
-            SPLITTER
-
-{DIVIDER}
-
-  ► Send a TXT or CSV file
-  ► Choose split method
-  ► Output: multiple TXT files
-
-  Waiting for file...
-
-{DIVIDER}
-       Send your file below
-{DIVIDER}"""
-        
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
-        await query.edit_message_text(split_text, reply_markup=InlineKeyboardMarkup(keyboard))
-        return SPLIT_WAITING
-    
-    elif data == "cancel_split":
-        context.user_data.clear()
-        return await button_callback_menu(update, context)
-    
-    elif data.startswith("split_"):
-        method = data.replace("split_", "")
-        context.user_data["split_method"] = method
-        
-        method_names = {
-            "size": "MAX SIZE (KB)",
-            "count": "NUMBER OF FILES",
-            "lines": "MAX LINES PER FILE"
-        }
-        
-        prompts = {
-            "size": "Enter maximum size per file in KB:",
-            "count": "Enter number of files to split into:",
-            "lines": "Enter maximum lines per file:"
-        }
-        
-        value_text = f"""
-{HEADER}
-
-            SPLITTER
-
-{DIVIDER}
-
-  Method: {method_names[method]}
-
-  {prompts[method]}
-
-{DIVIDER}
-       Type a number below
-{DIVIDER}"""
-        
-        keyboard = [[InlineKeyboardButton("◄ BACK", callback_data="split_method_back")]]
-        await query.edit_message_text(value_text, reply_markup=InlineKeyboardMarkup(keyboard))
-        return SPLIT_VALUE
-    
-    elif data == "split_method_back":
-        split_text = f"""
-{HEADER}
-
-            SPLITTER
-
-{DIVIDER}
-
-  ► File received!
-  ► Choose split method below
-
-{DIVIDER}
-      Select split method
-{DIVIDER}"""
-        await query.edit_message_text(split_text, reply_markup=split_method_keyboard())
-        return SPLIT_METHOD
-    
-    # ─────────────────────────────────────────────────────────────────────────
-    # MAKE TXT
-    # ─────────────────────────────────────────────────────────────────────────
-    
-    elif data == "maketxt":
-        context.user_data["maketxt_lines"] = []
-        context.user_data["mode"] = "maketxt"
-        
-        maketxt_text = f"""
-{HEADER}
-
-            MAKE TXT
-
-{DIVIDER}
-
-  ► Send text messages
-  ► Each message = one line
-  ► Duplicates auto-removed
-
-  Lines received: 0
-
-{DIVIDER}
-       Send your text below
-{DIVIDER}"""
-        
-        await query.edit_message_text(maketxt_text, reply_markup=maketxt_keyboard())
-        return MAKETXT_WAITING
-    
-    elif data == "do_maketxt":
-        lines = context.user_data.get("maketxt_lines", [])
-        if len(lines) < 1:
-            await query.answer("Please send at least 1 line of text!", show_alert=True)
-            return MAKETXT_WAITING
-        
-        await do_maketxt(update, context)
-        return ConversationHandler.END
-    
-    elif data == "clear_maketxt":
-        context.user_data["maketxt_lines"] = []
-        maketxt_text = f"""
-{HEADER}
-
-            MAKE TXT
-
-{DIVIDER}
-
-  ► Lines cleared!
-  ► Send new text messages
-
-  Lines received: 0
-
-{DIVIDER}
-       Send your text below
-{DIVIDER}"""
-        await query.edit_message_text(maketxt_text, reply_markup=maketxt_keyboard())
-        return MAKETXT_WAITING
-    
-    elif data == "cancel_maketxt":
-        context.user_data.clear()
-        return await button_callback_menu(update, context)
-    
-    # ─────────────────────────────────────────────────────────────────────────
-    # CSV TO TXT
-    # ─────────────────────────────────────────────────────────────────────────
-    
-    elif data == "csvtotxt":
-        context.user_data["mode"] = "csvtotxt"
-        
-        csvtotxt_text = f"""
-{HEADER}
-
-           CSV → TXT
-
-{DIVIDER}
-
-  ► Send a CSV file
-  ► Converts to TXT format
-  ► Duplicates auto-removed
-
-  Waiting for file...
-
-{DIVIDER}
-     Send your CSV file below
-{DIVIDER}"""
-        
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
-        await query.edit_message_text(csvtotxt_text, reply_markup=InlineKeyboardMarkup(keyboard))
-        return CSVTOTXT_WAITING
-    
-    elif data == "cancel_csvtotxt":
-        context.user_data.clear()
-        return await button_callback_menu(update, context)
-    
-    return ConversationHandler.END
-
-async def button_callback_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Return to main menu."""
-    query = update.callback_query
-    context.user_data.clear()
-    
-    menu_text = f"""
-{HEADER}
-
-            MAIN MENU
-
-{DIVIDER}
-
-  ◈ COMBINER - Merge files
-  ◈ SPLITTER - Split files
-  ◈ MAKE TXT - Text to file
-  ◈ CSV→TXT  - Convert CSV
-
-{DIVIDER}
-      Select an option below
-{DIVIDER}"""
-    
-    await query.edit_message_text(menu_text, reply_markup=main_menu_keyboard())
-    return ConversationHandler.END
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              FILE HANDLERS
-# ═══════════════════════════════════════════════════════════════════════════════
-
-async def handle_combine_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle file upload for combining."""
-    document = update.message.document
-    
-    if not document:
-        await update.message.reply_text("Please send a valid file.")
-        return COMBINE_WAITING
-    
-    file_name = document.file_name.lower()
-    if not (file_name.endswith('.txt') or file_name.endswith('.csv')):
-        await update.message.reply_text(
-            "⚠ Only TXT and CSV files are supported!",
-            reply_markup=combine_keyboard()
-        )
-        return COMBINE_WAITING
-    
-    # Check file size (Telegram bot API limit is 20MB)
-    if document.file_size > 20 * 1024 * 1024:
-        await update.message.reply_text(
-            "⚠ File too large! Maximum size is 20MB.",
-            reply_markup=combine_keyboard()
-        )
-        return COMBINE_WAITING
-    
-    # Delete previous status message if exists
-    if "combine_status_msg" in context.user_data:
-        try:
-            await context.user_data["combine_status_msg"].delete()
-        except Exception:
-            pass
-    
-    # Download file
-    try:
-        file = await document.get_file()
-        file_content = await file.download_as_bytearray()
-    except Exception as e:
-        await update.message.reply_text(
-            "⚠ Failed to download file. Try a smaller file.",
-            reply_markup=combine_keyboard()
-        )
-        return COMBINE_WAITING
-    
-    if "combine_files" not in context.user_data:
-        context.user_data["combine_files"] = []
-    
-    context.user_data["combine_files"].append({
-        "name": document.file_name,
-        "content": file_content.decode("utf-8", errors="ignore")
-    })
-    
-    count = len(context.user_data["combine_files"])
-    file_list = "\n".join([f"  {i+1}. {f['name'][:30]}" 
-                           for i, f in enumerate(context.user_data["combine_files"])])
-    
-    status_text = f"""
-{HEADER}
-
-            COMBINER
-
-{DIVIDER}
-  Files received: {count}
-{DIVIDER}
-
-{file_list}
-
-{DIVIDER}
-   Send more files or click COMBINE
-{DIVIDER}"""
-    
-    # Send new status and store reference
-    status_msg = await update.message.reply_text(status_text, reply_markup=combine_keyboard())
-    context.user_data["combine_status_msg"] = status_msg
-    return COMBINE_WAITING
-
-async def do_combine_files(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Combine all uploaded files."""
-    query = update.callback_query
-    files = context.user_data.get("combine_files", [])
-    
-    processing_text = f"""
-{HEADER}
-
-          PROCESSING
-
-{DIVIDER}
-
-      ▓▓▓▓▓▓░░░░ 50%
-
-   Combining {len(files)} files...
-
-{DIVIDER}"""
-    
-    await query.edit_message_text(processing_text)
-    
-    # Combine files and remove duplicates
-    all_lines = []
-    for f in files:
-        content = f["content"]
-        lines = content.splitlines()
-        all_lines.extend(lines)
-    
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_lines = []
-    for line in all_lines:
-        if line not in seen:
-            seen.add(line)
-            unique_lines.append(line)
-    
-    combined_content = "\n".join(unique_lines)
-    if combined_content and not combined_content.endswith("\n"):
-        combined_content += "\n"
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as tmp:
-        tmp.write(combined_content)
-        tmp_path = tmp.name
-    
-    # Send file
-    total_lines = len(unique_lines)
-    dupes_removed = len(all_lines) - len(unique_lines)
-    
-    result_text = f"""
-{HEADER}
-
-           COMPLETED
-
-{DIVIDER}
-
-  ► Files combined: {len(files)}
-  ► Total lines: {total_lines}
-  ► Duplicates removed: {dupes_removed}
-  ► Output format: TXT
-
-{DIVIDER}"""
-    
-    await query.edit_message_text(result_text, reply_markup=back_keyboard())
-    
-    with open(tmp_path, 'rb') as f:
-        await query.message.reply_document(
-            document=f,
-            filename="combined_output.txt",
-            caption="► Combined file ready!"
-        )
-    
-    # Cleanup
-    os.unlink(tmp_path)
-    context.user_data.clear()
-
-async def handle_split_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle file upload for splitting."""
-    document = update.message.document
-    
-    if not document:
-        await update.message.reply_text("Please send a valid file.")
-        return SPLIT_WAITING
-    
-    file_name = document.file_name.lower()
-    if not (file_name.endswith('.txt') or file_name.endswith('.csv')):
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
-        await update.message.reply_text(
-            "⚠ Only TXT and CSV files are supported!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return SPLIT_WAITING
-    
-    # Check file size (Telegram bot API limit is 20MB)
-    if document.file_size > 20 * 1024 * 1024:
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
-        await update.message.reply_text(
-            "⚠ File too large! Maximum size is 20MB.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return SPLIT_WAITING
-    
-    # Download file
-    try:
-        file = await document.get_file()
-        file_content = await file.download_as_bytearray()
-    except Exception as e:
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
-        await update.message.reply_text(
-            "⚠ Failed to download file. Try a smaller file.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return SPLIT_WAITING
-    
-    context.user_data["split_file"] = {
-        "name": document.file_name,
-        "content": file_content.decode("utf-8", errors="ignore")
-    }
-    
-    lines = context.user_data["split_file"]["content"].count('\n') + 1
-    size_kb = len(file_content) / 1024
-    
-    split_text = f"""
-{HEADER}
-
-            SPLITTER
-
-{DIVIDER}
-
-  ► File: {document.file_name[:28]}
-  ► Size: {size_kb:.1f} KB
-  ► Lines: {lines}
-
-  Choose split method:
-
-{DIVIDER}
-       Select method below
-{DIVIDER}"""
-    
-    await update.message.reply_text(split_text, reply_markup=split_method_keyboard())
-    return SPLIT_METHOD
-
-async def handle_split_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle split value input."""
-    try:
-        value = int(update.message.text.strip())
-        if value <= 0:
-            raise ValueError("Value must be positive")
-    except ValueError:
-        await update.message.reply_text("⚠ Please enter a valid positive number!")
-        return SPLIT_VALUE
-    
-    method = context.user_data.get("split_method")
-    file_data = context.user_data.get("split_file")
-    
-    if not file_data:
-        await update.message.reply_text("⚠ No file found. Please start over.", reply_markup=back_keyboard())
-        return ConversationHandler.END
-    
-    content = file_data["content"]
-    
-    # Remove duplicates while preserving order
-    raw_lines = content.splitlines()
-    seen = set()
-    unique_lines = []
-    for line in raw_lines:
-        if line not in seen:
-            seen.add(line)
-            unique_lines.append(line)
-    
-    dupes_removed = len(raw_lines) - len(unique_lines)
-    lines = [line + "\n" for line in unique_lines]
-    
-    processing_text = f"""
-{HEADER}
-
-          PROCESSING
-
-{DIVIDER}
-
-      ▓▓▓▓▓▓░░░░ 50%
-
-    Splitting file...
-
-{DIVIDER}"""
-    
-    status_msg = await update.message.reply_text(processing_text)
-    
-    # Split logic
-    chunks = []
-    
-    if method == "lines":
-        # Split by max lines per file
-        for i in range(0, len(lines), value):
-            chunk = lines[i:i + value]
-            chunks.append("".join(chunk))
-    
-    elif method == "count":
-        # Split into N files
-        if value > len(lines):
-            value = len(lines)
-        chunk_size = len(lines) // value
-        remainder = len(lines) % value
-        
-        start = 0
-        for i in range(value):
-            extra = 1 if i < remainder else 0
-            end = start + chunk_size + extra
-            chunk = lines[start:end]
-            if chunk:
-                chunks.append("".join(chunk))
-            start = end
-    
-    elif method == "size":
-        # Split by max size in KB
-        max_bytes = value * 1024
-        current_chunk = ""
-        
-        for line in lines:
-            if len((current_chunk + line).encode('utf-8')) > max_bytes and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = line
-            else:
-                current_chunk += line
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-    
-    if not chunks:
-        chunks = [content]
-    
-    # Send files
-    result_text = f"""
-{HEADER}
-
-           COMPLETED
-
-{DIVIDER}
-
-  ► Files created: {len(chunks)}
-  ► Duplicates removed: {dupes_removed}
-  ► Output format: TXT
-
-{DIVIDER}"""
-    
-    await status_msg.edit_text(result_text, reply_markup=back_keyboard())
-    
-    base_name = os.path.splitext(file_data["name"])[0]
-    
-    for i, chunk in enumerate(chunks, 1):
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as tmp:
-            tmp.write(chunk)
-            tmp_path = tmp.name
-        
-        with open(tmp_path, 'rb') as f:
-            await update.message.reply_document(
-                document=f,
-                filename=f"{base_name}_part{i:03d}.txt",
-                caption=f"► Part {i} of {len(chunks)}"
-            )
-        
-        os.unlink(tmp_path)
-        await asyncio.sleep(0.3)  # Prevent rate limiting
-    
-    context.user_data.clear()
-    return ConversationHandler.END
-
-async def handle_maketxt_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle text message for Make TXT."""
-    text = update.message.text.strip()
-    
-    if not text:
-        await update.message.reply_text("Please send some text.")
-        return MAKETXT_WAITING
-    
-    if "maketxt_lines" not in context.user_data:
-        context.user_data["maketxt_lines"] = []
-    
-    # Add each line from the message
-    new_lines = text.splitlines()
-    context.user_data["maketxt_lines"].extend(new_lines)
-    
-    count = len(context.user_data["maketxt_lines"])
-    preview_lines = context.user_data["maketxt_lines"][-5:]  # Show last 5 lines
-    preview = "\n".join([f"  {line[:34]}" for line in preview_lines])
-    
-    status_text = f"""
-{HEADER}
-
-            MAKE TXT
-
-{DIVIDER}
-  Lines received: {count}
-{DIVIDER}
-  Last lines:
-{preview}
-{DIVIDER}
-   Send more or click CREATE TXT
-{DIVIDER}"""
-    
-    await update.message.reply_text(status_text, reply_markup=maketxt_keyboard())
-    return MAKETXT_WAITING
-
-async def do_maketxt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Create TXT file from collected lines."""
-    query = update.callback_query
-    lines = context.user_data.get("maketxt_lines", [])
-    
-    processing_text = f"""
-{HEADER}
-
-          PROCESSING
-
-{DIVIDER}
-
-      ▓▓▓▓▓▓░░░░ 50%
-
-    Creating TXT file...
-
-{DIVIDER}"""
-    
-    await query.edit_message_text(processing_text)
-    
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_lines = []
-    for line in lines:
-        if line not in seen:
-            seen.add(line)
-            unique_lines.append(line)
-    
-    dupes_removed = len(lines) - len(unique_lines)
-    content = "\n".join(unique_lines)
-    if content and not content.endswith("\n"):
-        content += "\n"
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as tmp:
-        tmp.write(content)
-        tmp_path = tmp.name
-    
-    result_text = f"""
-{HEADER}
-
-           COMPLETED
-
-{DIVIDER}
-
-  ► Total lines: {len(unique_lines)}
-  ► Duplicates removed: {dupes_removed}
-  ► Output format: TXT
-
-{DIVIDER}"""
-    
-    await query.edit_message_text(result_text, reply_markup=back_keyboard())
-    
-    with open(tmp_path, 'rb') as f:
-        await query.message.reply_document(
-            document=f,
-            filename="output.txt",
-            caption="► TXT file ready!"
-        )
-    
-    # Cleanup
-    os.unlink(tmp_path)
-    context.user_data.clear()
-
-async def handle_csvtotxt_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Handle CSV file upload for conversion to TXT."""
-    document = update.message.document
-    
-    if not document:
-        await update.message.reply_text("Please send a valid file.")
-        return CSVTOTXT_WAITING
-    
-    file_name = document.file_name.lower()
-    if not file_name.endswith('.csv'):
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
-        await update.message.reply_text(
-            "⚠ Only CSV files are supported!",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return CSVTOTXT_WAITING
-    
-    # Check file size (Telegram bot API limit is 20MB)
-    if document.file_size > 20 * 1024 * 1024:
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
-        await update.message.reply_text(
-            "⚠ File too large! Maximum size is 20MB.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return CSVTOTXT_WAITING
-    
-    # Download file
-    try:
-        file = await document.get_file()
-        file_content = await file.download_as_bytearray()
-    except Exception as e:
-        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
-        await update.message.reply_text(
-            "⚠ Failed to download file. Try a smaller file.",
-            reply_markup=InlineKeyboardMarkup(keyboard)
-        )
-        return CSVTOTXT_WAITING
-    content = file_content.decode("utf-8", errors="ignore")
-    
-    processing_text = f"""
-{HEADER}
-
-          PROCESSING
-
-{DIVIDER}
-
-      ▓▓▓▓▓▓░░░░ 50%
-
-   Converting CSV to TXT...
-
-{DIVIDER}"""
-    
-    status_msg = await update.message.reply_text(processing_text)
-    
-    # Remove duplicates while preserving order
-    raw_lines = content.splitlines()
-    seen = set()
-    unique_lines = []
-    for line in raw_lines:
-        if line not in seen:
-            seen.add(line)
-            unique_lines.append(line)
-    
-    dupes_removed = len(raw_lines) - len(unique_lines)
-    output_content = "\n".join(unique_lines)
-    if output_content and not output_content.endswith("\n"):
-        output_content += "\n"
-    
-    # Create temporary file
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, encoding='utf-8') as tmp:
-        tmp.write(output_content)
-        tmp_path = tmp.name
-    
-    base_name = os.path.splitext(document.file_name)[0]
-    
-    result_text = f"""
-{HEADER}
-
-           COMPLETED
-
-{DIVIDER}
-
-  ► Total lines: {len(unique_lines)}
-  ► Duplicates removed: {dupes_removed}
-  ► Output format: TXT
-
-{DIVIDER}"""
-    
-    await status_msg.edit_text(result_text, reply_markup=back_keyboard())
-    
-    with open(tmp_path, 'rb') as f:
-        await update.message.reply_document(
-            document=f,
-            filename=f"{base_name}.txt",
-            caption="► TXT file ready!"
-        )
-    
-    # Cleanup
-    os.unlink(tmp_path)
-    context.user_data.clear()
-    return ConversationHandler.END
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              FALLBACK HANDLERS
-# ═══════════════════════════════════════════════════════════════════════════════
-
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Cancel current operation."""
-    context.user_data.clear()
-    await update.message.reply_text(
-        "Operation cancelled. Use /start to begin again.",
-        reply_markup=back_keyboard()
-    )
-    return ConversationHandler.END
-
-async def unknown_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle unexpected files."""
-    register_user(update.effective_user)
-    await update.message.reply_text(
-        "Use /start to access the menu and select COMBINER or SPLITTER first.",
-        reply_markup=back_keyboard()
-    )
-
-# ═══════════════════════════════════════════════════════════════════════════════
-#                              MAIN APPLICATION
-# ═══════════════════════════════════════════════════════════════════════════════
-
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle errors gracefully."""
-    logger.error(f"Exception: {context.error}")
-    
-    if update and update.effective_message:
-        await update.effective_message.reply_text(
-            "⚠ An error occurred. Please try again or use /start to restart.",
-            reply_markup=back_keyboard()
-        )
-
-def main() -> None:
-    """Run the bot."""
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Conversation handler for file operations
-    conv_handler = ConversationHandler(
-        entry_points=[
-            CommandHandler("start", start_command),
-            CallbackQueryHandler(button_callback),
-        ],
-        states={
-            COMBINE_WAITING: [
-                MessageHandler(filters.Document.ALL, handle_combine_file),
-                CallbackQueryHandler(button_callback),
-            ],
-            SPLIT_WAITING: [
-                MessageHandler(filters.Document.ALL, handle_split_file),
-                CallbackQueryHandler(button_callback),
-            ],
-            SPLIT_METHOD: [
-                CallbackQueryHandler(button_callback),
-            ],
-            SPLIT_VALUE: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_split_value),
-                CallbackQueryHandler(button_callback),
-            ],
-            MAKETXT_WAITING: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_maketxt_text),
-                CallbackQueryHandler(button_callback),
-            ],
-            CSVTOTXT_WAITING: [
-                MessageHandler(filters.Document.ALL, handle_csvtotxt_file),
-                CallbackQueryHandler(button_callback),
-            ],
-        },
-        fallbacks=[
-            CommandHandler("start", start_command),
-            CommandHandler("cancel", cancel),
-            CallbackQueryHandler(button_callback),
-        ],
-        per_user=True,
-        per_chat=True,
-        per_message=False,
-    )
-    
-    application.add_handler(conv_handler)
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    application.add_handler(MessageHandler(filters.Document.ALL, unknown_file))
-    application.add_error_handler(error_handler)
-    
-    # Start polling
-    print("═" * 50)
-    print("  FILE TOOLKIT BOT - RUNNING")
-    print("═" * 50)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
-
-if __name__ == "__main__":
-    main()
+from __future__ import annotations
+
+import os
+import logging
+import multiprocessing
+import signal
+from logging.handlers import RotatingFileHandler
+import json
+import sqlite3
+import ssl
+import tempfile
+import shutil
+import uuid
+import random
+import re
+import asyncio
+import time
+import sys
+import threading
+import tracemalloc
+from contextlib import ExitStack, asynccontextmanager, contextmanager, nullcontext
+from contextvars import ContextVar
+import zlib
+import gzip
+import bz2
+import lzma
+import codecs
+import zipfile
+import hashlib
+import importlib
+import math
+import heapq
+import unicodedata
+from functools import lru_cache, partial
+from bisect import bisect_left, bisect_right
+import operator
+from operator import methodcaller
+from itertools import chain, compress, filterfalse, repeat
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import httpx
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, Document, InputMediaDocument
+from telegram.error import RetryAfter, TelegramError
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+from telegram.ext import (
+    Application,
+    BasePersistence,
+    PersistenceInput,
+    CommandHandler,
+    MessageHandler,
+    CallbackQueryHandler,
+    ContextTypes,
+    ConversationHandler,
+    Updater,
+    filters,
+)
+
+class LazyModule:
+    """Stand-in for a module that is imported on first attribute access.
+
+    Worker threads may touch it first at the same time, so the import is
+    serialized; importlib's own LazyLoader is not thread-safe here.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+# Only set operations, the seen corpus and large dedupes need numpy; keep it off start-up
+np = LazyModule("numpy")
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              CONFIGURATION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+BOT_TOKEN = os.environ.get("BOT_TOKEN", "8372967401:AAHXy4nGkL7TI3nwSDRFM3ovOpMKrFzmqPg")
+BOT_API_URL = os.environ.get("BOT_API_URL", "https://api.telegram.org/bot")
+BOT_API_FILE_URL = os.environ.get("BOT_API_FILE_URL", "https://api.telegram.org/file/bot")
+USERS_DB = "users.db"                        # User registry and settings, shared by worker processes
+DATA_FILE = "users_data.json"                # Legacy JSON registry, imported into USERS_DB once
+USER_ACTIVE_RESOLUTION = timedelta(seconds=60)  # Repeat visits within this leave last_active as is
+CORPUS_DIR = "corpus"
+
+# Conversation states
+COMBINE_WAITING = 1
+SPLIT_WAITING = 2
+SPLIT_METHOD = 3
+SPLIT_VALUE = 4
+MAKETXT_WAITING = 5
+CSVTOTXT_WAITING = 6
+SETOP_WAITING = 7
+SAMPLE_WAITING = 8
+SAMPLE_METHOD = 9
+SAMPLE_VALUE = 10
+FILTER_WAITING = 11
+FILTER_PATTERNS = 12
+
+# Set operations between uploaded files: title and one-line description
+SET_OPERATIONS = {
+    "intersect": ("INTERSECT", "Lines found in every file"),
+    "subtract": ("SUBTRACT", "First file minus the others"),
+    "xor": ("XOR", "Lines not shared between files"),
+}
+
+# Sampling methods: title and one-line description
+SAMPLE_METHODS = {
+    "head": ("HEAD", "First N lines"),
+    "tail": ("TAIL", "Last N lines"),
+    "random": ("RANDOM", "N lines picked uniformly at random"),
+}
+
+# Filter limits
+MAX_FILTER_PATTERNS = 1000                   # Patterns combined into one filter
+MAX_FILTER_PATTERN_CHARS = 100               # Keeps the factored literal regex shallow
+FILTER_BATCH_SECONDS = 10                    # Match time per batch before a filter is aborted as too slow
+
+# Scale-out: a dispatcher routes updates by user to BOT_WORKERS worker processes
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", "1"))
+WORKER_STOP_TIMEOUT = 60.0                   # Seconds workers get to finish running jobs on shutdown
+
+# Dedupe tuning; each worker process gets its share of the CPUs
+DEDUPE_WORKERS = max(1, (os.cpu_count() or 1) // BOT_WORKERS)
+PARALLEL_DEDUPE_MIN_CHARS = 4 * 1024 * 1024
+PARALLEL_CHUNK_CHARS = 1024 * 1024
+VECTORIZED_DEDUPE_MIN_LINES = 1_000_000      # Break-even measured with bench.py
+
+# Sorted-unique output (parallel external merge sort)
+SORT_CHUNK_CHARS = 8 * 1024 * 1024           # Text sorted into one run file per worker task
+SORT_RANGE_CHARS = 64 * 1024 * 1024          # Target key range merged by one worker task
+SORT_SAMPLES_PER_RANGE = 64                  # Sampled lines per range when picking splitters
+
+# Uploads and outputs
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024          # Telegram bot API download limit
+MAX_DECOMPRESSED_BYTES = 200 * 1024 * 1024   # Streamed uploads (SAMPLE, FILTER); guards against archive bombs
+MAX_TEXT_BYTES = 40 * 1024 * 1024            # Uploads decoded whole and held in the session until the job runs
+IO_CHUNK_BYTES = 1024 * 1024
+MAKETXT_SPOOL_BYTES = 256 * 1024             # Pending MAKE TXT text kept in memory
+MAX_SPLIT_PARTS = 200                        # Files one split may produce; key splits keep each one open
+PART_COUNT_METHODS = ("count", "bytes", "key")  # Split methods whose value is the number of files
+
+# Concurrent downloads
+MAX_GLOBAL_DOWNLOADS = 16
+MAX_USER_DOWNLOADS = 4
+MEDIA_GROUP_WAIT = 1.0                       # Quiet seconds that close an album
+
+# HTTP transport: control calls and file transfers use separate pools
+CONTROL_POOL_SIZE = 16
+CONTROL_TIMEOUT = 10.0
+TRANSFER_POOL_SIZE = 32
+TRANSFER_BASE_TIMEOUT = 30.0
+TRANSFER_MIN_RATE = 128 * 1024               # Worst-case bytes/s used to scale timeouts
+TRANSFER_HTTP_VERSION = os.environ.get("TRANSFER_HTTP_VERSION", "1.1")  # "2" needs httpx[http2]
+KEEPALIVE_EXPIRY = 60.0
+TRANSFER_METHODS = ("sendDocument", "sendMediaGroup")
+TEXT_EXTENSIONS = (".txt", ".csv")
+COMPRESSION_OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+OUTPUT_FORMATS = ("txt", "gz", "bz2", "xz", "zip")
+
+# Duplicate report sketch (fixed memory regardless of input size)
+REPORT_TOP_K = 10
+SKETCH_CAPACITY = 1000                       # Space-Saving counters
+SKETCH_WIDTH = 1 << 16                       # Count-Min columns (power of two)
+SKETCH_DEPTH = 4                             # Count-Min rows
+HISTOGRAM_BOUNDS = (2, 3, 6, 11, 101)        # 2x, 3-5x, 6-10x, 11-100x, 101x+
+
+# Dedupe key normalization
+NORMALIZE_MODES = {
+    "nfc": "UNICODE NFC",
+    "case": "CASE-FOLD",
+    "strip": "STRIP SPACES",
+    "collapse": "COLLAPSE SPACES",
+    "delim": "TRIM DELIMITERS",
+}
+TRAILING_DELIMITERS = ",;:|\t "
+INVISIBLE_SPACE_TABLE = str.maketrans({
+    "\u00a0": " ", "\u2007": " ", "\u202f": " ",
+    "\u200b": None, "\u200c": None, "\u200d": None, "\ufeff": None,
+})
+
+# Seen-line corpus
+CORPUS_BATCH = 1 << 20                       # Hashes looked up per searchsorted call
+
+# Progress reporting
+PROGRESS_INTERVAL = 2.0                      # Minimum seconds between status message edits
+PROGRESS_MIN_BYTES = 2 * 1024 * 1024         # Uploads below this download without a status message
+
+# Job scheduler: smallest job first, with aging and per-user quotas
+MAX_RUNNING_JOBS = max(1, max(2, os.cpu_count() or 1) // BOT_WORKERS)  # Per worker process
+MAX_USER_JOBS = 2
+USER_BYTE_QUOTA = 50 * 1024 * 1024          # Estimated input bytes one user may run at once
+SCHEDULER_AGING_RATE = 1024 * 1024           # Priority bytes forgiven per second waited
+SCHEDULER_REFRESH = 3.0                      # Seconds between queue position updates
+
+# Conversation persistence (state and file references, never contents)
+SESSION_DB = "sessions.db"
+SESSION_FLUSH_INTERVAL = 10.0                # Seconds between persistence writes
+SESSION_KEYS = ("mode", "split_method", "set_op", "sample_method", "sample_dedupe", "filter_patterns")  # Plain user_data values kept as-is
+
+# Checkpointed delivery of split/combine results
+JOBS_DIR = "jobs"
+JOB_MAX_RESUMES = 3                          # Startup resume attempts before a job is dropped
+JOB_MAX_AGE = 24 * 3600                      # Seconds after which unsent jobs are dropped
+PART_SEND_DELAY = 0.3                        # Pause between sends to avoid flood limits
+MEDIA_GROUP_SIZE = 10                        # Parts per sendMediaGroup call (Bot API maximum)
+MEDIA_GROUP_MAX_BYTES = 50 * 1024 * 1024     # Parts read into memory for one group
+
+# Memory profiling (opt-in: tracemalloc slows allocation-heavy work)
+MEMORY_PROFILING = os.environ.get("MEMORY_PROFILING", "") == "1"
+MEMORY_LOG_FILE = "memory_profile.jsonl"
+MEMORY_HISTORY = 50                          # Recent job records kept for /memory
+# Job tracing (opt-in: TRACE_SAMPLE_RATE is the share of jobs traced, 0 to 1)
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+TRACE_LOG_FILE = "traces.jsonl"
+TRACE_MAX_BYTES = 10 * 1024 * 1024           # Trace log size that triggers rotation
+TRACE_BACKUPS = 3                            # Rotated trace logs kept
+TRACE_MAX_SPANS = 1000                       # Spans kept per job; later ones are only counted
+
+ADMIN_IDS = {int(uid) for uid in os.environ.get("ADMIN_IDS", "").split(",") if uid.strip()}
+
+DEFAULT_SETTINGS = {
+    "output_format": "txt",
+    "dup_report": False,
+    "normalize": [],
+    "seen_filter": False,
+    "sort_unique": False,
+}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              LOGGING SETUP
+# ═══════════════════════════════════════════════════════════════════════════════
+
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.WARNING
+)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("telegram").setLevel(logging.WARNING)
+logger = logging.getLogger(__name__)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              DATA MANAGEMENT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_users_db: Optional[sqlite3.Connection] = None
+_users_cache: Optional[Dict] = None
+_users_version: Optional[int] = None
+
+def users_db() -> sqlite3.Connection:
+    """Open the user registry, importing the legacy JSON file into an empty one."""
+    global _users_db
+    if _users_db is None:
+        db = sqlite3.connect(USERS_DB)
+        db.execute("PRAGMA journal_mode=WAL")
+        with db:
+            db.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT)")
+            if os.path.exists(DATA_FILE) and db.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None:
+                with open(DATA_FILE, "r", encoding="utf-8") as f:
+                    legacy = json.load(f)
+                db.executemany("INSERT OR IGNORE INTO users VALUES (?, ?)",
+                               [(int(uid), json.dumps(entry, ensure_ascii=False)) for uid, entry in legacy.items()])
+        _users_db = db
+    return _users_db
+
+def load_users() -> Dict:
+    """Load users data, re-reading the registry only after another connection changed it."""
+    global _users_cache, _users_version
+    db = users_db()
+    # data_version moves on commits by other connections, such as other workers
+    version = db.execute("PRAGMA data_version").fetchone()[0]
+    if _users_cache is None or version != _users_version:
+        _users_cache = {str(uid): json.loads(data) for uid, data in db.execute("SELECT user_id, data FROM users")}
+        _users_version = version
+    return _users_cache
+
+def save_user(entry: Dict) -> None:
+    """Write one user's entry, leaving every other row as it is."""
+    db = users_db()
+    with db:
+        db.execute("INSERT OR REPLACE INTO users VALUES (?, ?)", (entry["id"], json.dumps(entry, ensure_ascii=False)))
+    load_users()[str(entry["id"])] = entry
+
+def register_user(user) -> None:
+    """Register or update user in database.
+
+    Repeat visits within USER_ACTIVE_RESOLUTION are not written, so
+    button taps do not write the registry every time.
+    """
+    users = load_users()
+    user_id = str(user.id)
+    previous = users.get(user_id, {})
+    entry = {
+        **previous,
+        "id": user.id,
+        "first_name": user.first_name or "",
+        "last_name": user.last_name or "",
+        "username": user.username or "",
+    }
+    now = datetime.now()
+    # ISO timestamps of the same format compare in time order
+    if entry == previous and previous.get("last_active", "") > (now - USER_ACTIVE_RESOLUTION).isoformat():
+        return
+    entry["last_active"] = now.isoformat()
+    save_user(entry)
+
+def get_settings(user_id: int) -> Dict:
+    """Return a user's settings merged over the defaults."""
+    stored = load_users().get(str(user_id), {}).get("settings", {})
+    return {**DEFAULT_SETTINGS, **stored}
+
+def update_settings(user_id: int, **changes) -> Dict:
+    """Persist changed settings for a user and return the full settings."""
+    entry = {"id": user_id, **load_users().get(str(user_id), {})}
+    entry["settings"] = {**entry.get("settings", {}), **changes}
+    save_user(entry)
+    return {**DEFAULT_SETTINGS, **entry["settings"]}
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              TEXT PROCESSING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_process_pool = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool used for CPU-bound work."""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=DEDUPE_WORKERS)
+    return _process_pool
+
+class DuplicateSketch:
+    """Bounded-memory duplicate statistics collected during dedupe.
+
+    Top lines come from a Space-Saving summary of SKETCH_CAPACITY counters;
+    the duplicate-count histogram is driven by a conservative-update
+    Count-Min sketch. Both are approximate but never grow with the input.
+    Lines are counted by dedupe key; each tracked key remembers the first
+    original line seen for it, which is what the report shows.
+    """
+
+    def __init__(self, capacity: int = SKETCH_CAPACITY, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH):
+        self.capacity = capacity
+        self.counts = {}
+        self.originals = {}
+        self.heap = []
+        self.mask = width - 1
+        self.rows = [row * width for row in range(depth)]
+        self.table = array("I", bytes(4 * width * depth))
+        self.histogram = [0] * len(HISTOGRAM_BOUNDS)
+        self.total = 0
+
+    def add(self, key: str, is_new: bool, line: Optional[str] = None) -> None:
+        """Record one occurrence of a dedupe key; is_new comes from the dedupe set.
+
+        line is the original line when normalization made the key differ.
+        """
+        self.total += 1
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+            heapq.heappush(self.heap, (1, key))
+            if line is not None and line != key:
+                self.originals[key] = line
+        else:
+            # Evict the smallest counter; heap entries go stale as counts grow
+            while True:
+                count, victim = heapq.heappop(self.heap)
+                if counts[victim] == count:
+                    break
+                heapq.heappush(self.heap, (counts[victim], victim))
+            del counts[victim]
+            self.originals.pop(victim, None)
+            counts[key] = count + 1
+            heapq.heappush(self.heap, (count + 1, key))
+            if line is not None and line != key:
+                self.originals[key] = line
+
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * len(self.rows)).digest()
+        slots = [row + (h & self.mask) for row, h in zip(self.rows, memoryview(digest).cast("I"))]
+        table = self.table
+        before = 0 if is_new else min(table[slot] for slot in slots)
+        after = before + 1
+        for slot in slots:
+            if table[slot] < after:
+                table[slot] = after
+        old_bucket = bisect_right(HISTOGRAM_BOUNDS, before) - 1
+        new_bucket = bisect_right(HISTOGRAM_BOUNDS, after) - 1
+        if old_bucket != new_bucket:
+            if old_bucket >= 0 and self.histogram[old_bucket] > 0:
+                self.histogram[old_bucket] -= 1
+            if new_bucket >= 0:
+                self.histogram[new_bucket] += 1
+
+    def top(self, k: int = REPORT_TOP_K) -> List[Tuple[str, int]]:
+        """Return up to k tracked lines seen more than once, most frequent first."""
+        ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return [(self.originals.get(key, key), count) for key, count in ranked[:k] if count > 1]
+
+def duplicate_report_text(sketch: DuplicateSketch) -> str:
+    """Render the duplicate report block for a COMPLETED screen."""
+    top_lines = "\n".join(f"  {count:>6}x {line[:28]}" for line, count in sketch.top())
+    labels = []
+    for i, low in enumerate(HISTOGRAM_BOUNDS):
+        high = HISTOGRAM_BOUNDS[i + 1] - 1 if i + 1 < len(HISTOGRAM_BOUNDS) else None
+        label = f"{low}x" if high == low else (f"{low}-{high}x" if high else f"{low}x+")
+        labels.append(f"  {label:>9}: {sketch.histogram[i]}")
+    histogram = "\n".join(labels)
+    return f"""
+  ► Top duplicates (approx.):
+{top_lines or "    none"}
+
+  ► Lines repeated (approx.):
+{histogram}
+"""
+
+@lru_cache(maxsize=None)
+def build_normalizer(modes: Tuple[str, ...]) -> Callable[[List[str]], List[str]]:
+    """Compile a batched dedupe-key function for a tuple of normalize modes."""
+    steps = []
+    if "nfc" in modes:
+        steps.append(partial(unicodedata.normalize, "NFC"))
+    if "strip" in modes or "collapse" in modes:
+        steps.append(methodcaller("translate", INVISIBLE_SPACE_TABLE))
+    if "case" in modes:
+        steps.append(str.casefold)
+    if "collapse" in modes:
+        steps.extend((str.split, " ".join))
+    elif "strip" in modes:
+        steps.append(str.strip)
+    if "delim" in modes:
+        steps.append(methodcaller("rstrip", TRAILING_DELIMITERS))
+
+    def normalize(lines: List[str]) -> List[str]:
+        # Each step is one C-level map() over the whole batch
+        keys = lines
+        for step in steps:
+            keys = map(step, keys)
+        return list(keys)
+
+    return normalize
+
+def normalize_modes(settings: Dict) -> Tuple[str, ...]:
+    """Return the enabled normalize modes in canonical order."""
+    enabled = settings.get("normalize", [])
+    return tuple(mode for mode in NORMALIZE_MODES if mode in enabled)
+
+def first_occurrence_indices(keys: List[str]) -> Optional[np.ndarray]:
+    """Return the sorted indices of each key's first occurrence, vectorized.
+
+    Keys are hashed in bulk into an int64 array and grouped with one
+    stable sort. Keys that share a hash are compared exactly; on a real
+    collision None is returned so the caller can fall back to a dict.
+    """
+    hashes = np.fromiter(map(hash, keys), dtype=np.int64, count=len(keys))
+    order = np.argsort(hashes, kind="stable")
+    sorted_hashes = hashes[order]
+    starts = np.empty(len(keys), dtype=bool)
+    starts[:1] = True
+    np.not_equal(sorted_hashes[1:], sorted_hashes[:-1], out=starts[1:])
+    firsts = order[starts]
+    # Every repeat must equal the first key of its hash group
+    group_firsts = firsts[np.cumsum(starts) - 1][~starts]
+    repeats = order[~starts]
+    if not all(map(operator.eq, map(keys.__getitem__, repeats.tolist()), map(keys.__getitem__, group_firsts.tolist()))):
+        return None
+    firsts.sort()
+    return firsts
+
+def dedupe_lines(lines: List[str], sketch: DuplicateSketch = None, modes: Tuple[str, ...] = ()) -> List[str]:
+    """Remove duplicate lines while preserving first-occurrence order.
+
+    With normalize modes the comparison uses the normalized key, but the
+    first original line seen for each key is what gets kept.
+    """
+    keys = build_normalizer(modes)(lines) if modes else lines
+    if sketch is None:
+        if len(keys) >= VECTORIZED_DEDUPE_MIN_LINES:
+            firsts = first_occurrence_indices(keys)
+            if firsts is not None:
+                return list(map(lines.__getitem__, firsts.tolist()))
+        if not modes:
+            return list(dict.fromkeys(lines))
+        first_line = dict(zip(reversed(keys), reversed(lines)))
+        return list(map(first_line.__getitem__, dict.fromkeys(keys)))
+    # Report pass: dedupe and feed the sketch in the same loop
+    seen = set()
+    unique_lines = []
+    for key, line in zip(keys, lines):
+        is_new = key not in seen
+        if is_new:
+            seen.add(key)
+            unique_lines.append(line)
+        sketch.add(key, is_new, line)
+    return unique_lines
+
+def split_text_chunks(contents: List[str], chunk_chars: int) -> List[str]:
+    """Cut each content into chunks that end right after a newline."""
+    chunks = []
+    for content in contents:
+        start = 0
+        while start < len(content):
+            cut = content.find("\n", start + chunk_chars)
+            if cut == -1:
+                chunks.append(content[start:])
+                break
+            chunks.append(content[start:cut + 1])
+            start = cut + 1
+    return chunks
+
+def _shard_chunk(chunk_no: int, text: str, shards: int, modes: Tuple[str, ...] = ()) -> Tuple[int, List[Tuple]]:
+    """Dedupe one chunk and partition its keys into shards by CRC32."""
+    lines = text.splitlines()
+    keys = build_normalizer(modes)(lines) if modes else lines
+    # Positions pack (chunk, line) into one int so they sort in global order;
+    # building the dict from the reversed keys keeps each first position.
+    base = chunk_no << 32
+    first = dict(zip(reversed(keys), range(base + len(keys) - 1, base - 1, -1)))
+    unique_keys = list(dict.fromkeys(keys))
+    positions = list(map(first.__getitem__, unique_keys))
+    originals = None
+    if modes:
+        first_line = dict(zip(reversed(keys), reversed(lines)))
+        originals = list(map(first_line.__getitem__, unique_keys))
+    # Every step below is a C-level map() so no Python loop runs per line
+    shard_ids = list(map(operator.mod, map(zlib.crc32, map(str.encode, unique_keys)), repeat(shards)))
+    buckets = []
+    for shard in range(shards):
+        mask = list(map(operator.eq, shard_ids, repeat(shard)))
+        # Joined strings and a flat array pickle far faster than a dict
+        buckets.append((
+            "\n".join(compress(unique_keys, mask)),
+            "\n".join(compress(originals, mask)) if modes else None,
+            array("Q", compress(positions, mask)),
+        ))
+    return len(lines), buckets
+
+def _merge_shard(buckets: List[Tuple]) -> Tuple[str, array]:
+    """Merge one shard's buckets in chunk order, dropping keys seen earlier.
+
+    Buckets are sorted by position and chunks are in order, so the
+    concatenated survivors are already in first-occurrence order.
+    """
+    seen = set()
+    lines = []
+    positions = array("Q")
+    for joined_keys, joined_lines, bucket_positions in buckets:
+        if not bucket_positions:
+            continue
+        bucket_keys = joined_keys.split("\n")
+        bucket_lines = bucket_keys if joined_lines is None else joined_lines.split("\n")
+        mask = list(map(operator.not_, map(seen.__contains__, bucket_keys)))
+        lines.extend(compress(bucket_lines, mask))
+        positions.extend(compress(bucket_positions, mask))
+        seen.update(bucket_keys)
+    return "\n".join(lines), positions
+
+def pool_results(futures: List, progress: Optional["Progress"] = None) -> List:
+    """Collect process-pool results in order.
+
+    If the job is cancelled, or anything fails, futures not yet picked up
+    by a worker are cancelled so the pool moves on to other jobs.
+    """
+    try:
+        results = []
+        for future in futures:
+            results.append(future.result())
+            check_cancelled(progress)
+        return results
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+
+def parallel_dedupe(contents: List[str], workers: int = DEDUPE_WORKERS, modes: Tuple[str, ...] = (),
+                    progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Dedupe the lines of several contents across processes.
+
+    Returns the unique lines in first-occurrence order, exactly as
+    dedupe_lines() would, and the total number of input lines.
+    """
+    chunks = split_text_chunks(contents, PARALLEL_CHUNK_CHARS)
+    pool = get_process_pool()
+    shards = max(1, workers)
+    results = pool_results([pool.submit(_shard_chunk, n, chunk, shards, modes) for n, chunk in enumerate(chunks)],
+                           progress)
+    total = sum(lines for lines, _ in results)
+    per_shard = [[buckets[s] for _, buckets in results] for s in range(shards)]
+    lines = []
+    positions = array("Q")
+    for joined, shard_positions in pool_results([pool.submit(_merge_shard, b) for b in per_shard], progress):
+        if shard_positions:
+            lines.extend(joined.split("\n"))
+            positions.extend(shard_positions)
+    # Each shard is sorted already; timsort merges those runs in near-linear time
+    order = sorted(range(len(positions)), key=positions.__getitem__)
+    return list(map(lines.__getitem__, order)), total
+
+def combine_dedupe(contents: List[str], sketch: DuplicateSketch = None, modes: Tuple[str, ...] = (),
+                   progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Dedupe the lines of several contents, in parallel when large enough."""
+    if sketch is None and DEDUPE_WORKERS > 1 and sum(len(c) for c in contents) >= PARALLEL_DEDUPE_MIN_CHARS:
+        return parallel_dedupe(contents, modes=modes, progress=progress)
+    all_lines = []
+    for content in contents:
+        all_lines.extend(content.splitlines())
+    return dedupe_lines(all_lines, sketch, modes), len(all_lines)
+
+def sample_splitters(contents: List[str], ranges: int, modes: Tuple[str, ...] = ()) -> List[str]:
+    """Pick ranges - 1 keys that cut the sorted keys into ranges of similar size.
+
+    Lines are sampled at random character offsets, so the ranges come out
+    balanced by text size rather than by line count.
+    """
+    total = sum(map(len, contents))
+    if ranges <= 1 or not total:
+        return []
+    rng = random.Random(total)
+    samples = []
+    for content in contents:
+        for _ in range(SORT_SAMPLES_PER_RANGE * ranges * len(content) // total + 1 if content else 0):
+            pos = rng.randrange(len(content))
+            end = content.find("\n", pos)
+            samples.append(content[content.rfind("\n", 0, pos) + 1:end if end != -1 else len(content)])
+    keys = build_normalizer(modes)(samples) if modes else samples
+    keys.sort()
+    return [keys[len(keys) * i // ranges] for i in range(1, ranges)]
+
+def _sort_run(text: str, splitters: List[str], modes: Tuple[str, ...], path: str) -> Tuple[int, List[int]]:
+    """Write one chunk's unique keys, sorted, to a run file cut at the splitters.
+
+    With normalize modes each key is followed by the first line that
+    produced it. Returns the chunk's line count and the byte offsets at
+    which each key range starts, plus the end of the file.
+    """
+    lines = text.splitlines()
+    if modes:
+        keys = build_normalizer(modes)(lines)
+        first_line = dict(zip(reversed(keys), reversed(lines)))
+        sorted_keys = sorted(first_line)
+    else:
+        sorted_keys = sorted(set(lines))
+    offsets = [0]
+    start = 0
+    with open(path, "wb") as run:
+        for splitter in splitters + [None]:
+            end = len(sorted_keys) if splitter is None else bisect_left(sorted_keys, splitter, start)
+            piece = sorted_keys[start:end]
+            if modes:
+                piece = chain.from_iterable(zip(piece, map(first_line.__getitem__, piece)))
+            data = "\n".join(piece).encode("utf-8") + b"\n" if end > start else b""
+            run.write(data)
+            offsets.append(offsets[-1] + len(data))
+            start = end
+    return len(lines), offsets
+
+def _iter_piece(run_path: str, start: int, end: int) -> Iterator[str]:
+    """Yield the lines stored between two byte offsets of a run file, reading a block at a time."""
+    with open(run_path, "rb") as run:
+        run.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            # The size hint is loose, so lines past the end of the piece are dropped
+            for raw in run.readlines(min(remaining, 1 << 20)):
+                if remaining <= 0:
+                    break
+                remaining -= len(raw)
+                yield raw[:-1].decode("utf-8")
+
+def _merge_range(pieces: List[Tuple[str, int, int]], keyed: bool, path: str) -> int:
+    """K-way merge one key range from every run into a sorted unique file; return its line count.
+
+    Pieces come in input order and heapq.merge puts equal keys in that
+    order, so the earliest run's line is kept. Only one block per run is
+    read at a time.
+    """
+    streams = [_iter_piece(*piece) for piece in pieces if piece[2] > piece[1]]
+    if keyed:
+        # Records alternate key and line; pairing one iterator with itself groups them
+        records = heapq.merge(*(zip(stream, stream) for stream in streams), key=operator.itemgetter(0))
+    else:
+        records = heapq.merge(*streams)
+    count = 0
+    last = None
+    
+    def unique_lines() -> Iterator[str]:
+        nonlocal count, last
+        for record in records:
+            key = record[0] if keyed else record
+            if key != last:
+                last = key
+                count += 1
+                yield record[1] if keyed else record
+    
+    with open(path, "w", encoding="utf-8", newline="\n") as out:
+        for block in iter_line_blocks(unique_lines()):
+            out.write(block)
+    return count
+
+def external_sort_unique(contents: List[str], workdir: str, workers: int = DEDUPE_WORKERS,
+                         modes: Tuple[str, ...] = (), progress: Optional["Progress"] = None
+                         ) -> Tuple[List[str], int, int]:
+    """Dedupe lines and sort them by key with a parallel external merge sort.
+
+    Workers sort SORT_CHUNK_CHARS chunks into run files cut at sampled
+    splitter keys, then k-way merge each key range from all runs into a
+    range file, so no process holds more than about one chunk. Files go
+    in workdir, which the caller removes. Returns the range files in key
+    order, the unique line count and the input line count.
+    """
+    ranges = max(workers, -(-sum(map(len, contents)) // SORT_RANGE_CHARS))
+    splitters = sample_splitters(contents, ranges, modes)
+    chunks = split_text_chunks(contents, SORT_CHUNK_CHARS)
+    pool = get_process_pool()
+    run_paths = [os.path.join(workdir, f"run{n:05d}") for n in range(len(chunks))]
+    runs = pool_results([pool.submit(_sort_run, chunk, splitters, modes, path)
+                         for chunk, path in zip(chunks, run_paths)], progress)
+    del chunks
+    range_paths = [os.path.join(workdir, f"range{r:05d}") for r in range(ranges)]
+    counts = pool_results([pool.submit(_merge_range, [(path, offsets[r], offsets[r + 1])
+                                                      for path, (_, offsets) in zip(run_paths, runs)],
+                                       bool(modes), range_path)
+                           for r, range_path in enumerate(range_paths)], progress)
+    for path in run_paths:
+        os.unlink(path)
+    return range_paths, sum(counts), sum(count for count, _ in runs)
+
+def read_range(range_path: str) -> List[str]:
+    """Return the lines of one merged range file."""
+    with open(range_path, encoding="utf-8", newline="\n") as merged:
+        text = merged.read()
+    return text[:-1].split("\n") if text else []
+
+def uses_external_sort(contents: List[str], sketch: DuplicateSketch = None) -> bool:
+    """Tell whether sorted dedupe of contents goes through the external merge sort."""
+    return sketch is None and DEDUPE_WORKERS > 1 and sum(len(c) for c in contents) >= PARALLEL_DEDUPE_MIN_CHARS
+
+def sort_dedupe(contents: List[str], sketch: DuplicateSketch = None, modes: Tuple[str, ...] = (),
+                progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Dedupe the lines of several contents and sort them by dedupe key.
+
+    Large inputs use the external merge sort; small ones, and runs that
+    feed a duplicate report, dedupe in order and then sort in memory.
+    """
+    if uses_external_sort(contents, sketch):
+        with tempfile.TemporaryDirectory(prefix="sort_") as workdir:
+            range_paths, _, total = external_sort_unique(contents, workdir, modes=modes, progress=progress)
+            lines = []
+            for range_path in range_paths:
+                check_cancelled(progress)
+                lines.extend(read_range(range_path))
+            return lines, total
+    unique_lines, total = combine_dedupe(contents, sketch, modes)
+    if not modes:
+        unique_lines.sort()
+        return unique_lines, total
+    keys = build_normalizer(modes)(unique_lines)
+    return list(map(unique_lines.__getitem__, sorted(range(len(keys)), key=keys.__getitem__))), total
+
+def write_sorted_unique(user_id: int, settings: Dict, contents: List[str], output_format: str, inner_name: str,
+                        progress: Optional["Progress"] = None) -> Tuple[str, int, int, int, Optional[np.ndarray]]:
+    """Externally sort and dedupe contents straight into an output file.
+
+    The merged ranges are read back one at a time, through the seen
+    filter, so the output never sits in memory as a whole. Returns the
+    file path, input lines, unique lines, lines dropped as seen and the
+    new seen hashes.
+    """
+    seen_removed = 0
+    new_hashes = []
+    
+    def kept_lines(range_paths: List[str]) -> Iterator[str]:
+        nonlocal seen_removed
+        for range_path in range_paths:
+            lines, removed, hashes = apply_seen_filter(user_id, settings, read_range(range_path))
+            seen_removed += removed
+            if hashes is not None:
+                new_hashes.append(hashes)
+            yield from lines
+    
+    with tempfile.TemporaryDirectory(prefix="sort_") as workdir:
+        range_paths, unique, total = external_sort_unique(contents, workdir, modes=normalize_modes(settings),
+                                                          progress=progress)
+        path = write_output_file(iter_line_blocks(kept_lines(range_paths), progress=progress), output_format,
+                                 inner_name, progress)
+    return path, total, unique, seen_removed, np.concatenate(new_hashes) if new_hashes else None
+
+def dedupe_content(content: str, settings: Dict, sketch: DuplicateSketch = None,
+                   progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Dedupe one upload's lines, sorted if the user asked; return them and the input line count."""
+    modes = normalize_modes(settings)
+    if settings.get("sort_unique"):
+        return sort_dedupe([content], sketch, modes, progress)
+    raw_lines = content.splitlines()
+    return dedupe_lines(raw_lines, sketch, modes), len(raw_lines)
+
+def new_sketch(settings: Dict) -> DuplicateSketch:
+    """Return a DuplicateSketch when the user enabled the report, else None."""
+    return DuplicateSketch() if settings.get("dup_report") else None
+
+def new_spool(settings: Dict) -> "LineSpool":
+    """Return a MAKE TXT spool configured from the user's settings."""
+    return LineSpool(sketch=new_sketch(settings), modes=normalize_modes(settings))
+
+class LineSpool:
+    """Ordered line store that dedupes on arrival and spills to a session file.
+
+    Only a 16-byte digest per unique line stays in memory; the lines
+    themselves are appended to a temp file once MAKETXT_SPOOL_BYTES of
+    pending text has built up.
+    """
+
+    def __init__(self, spill_bytes: int = MAKETXT_SPOOL_BYTES, sketch: DuplicateSketch = None,
+                 modes: Tuple[str, ...] = ()):
+        self.spill_bytes = spill_bytes
+        self.sketch = sketch
+        self.modes = modes
+        self.digests = set()
+        self.pending = []
+        self.pending_bytes = 0
+        self.path = None
+        self.unique = 0
+        self.duplicates = 0
+        self.size = 0
+        self.recent = deque(maxlen=5)
+
+    def add(self, lines: List[str]) -> None:
+        """Add lines, keeping only the first occurrence of each dedupe key."""
+        keys = build_normalizer(self.modes)(lines) if self.modes else lines
+        for key, line in zip(keys, lines):
+            self.recent.append(line)
+            digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+            is_new = digest not in self.digests
+            if self.sketch is not None:
+                self.sketch.add(key, is_new, line)
+            if not is_new:
+                self.duplicates += 1
+                continue
+            self.digests.add(digest)
+            self.pending.append(line)
+            line_bytes = len(line.encode("utf-8")) + 1
+            self.pending_bytes += line_bytes
+            self.size += line_bytes
+            self.unique += 1
+        if self.pending_bytes >= self.spill_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """Append pending lines to the spool file."""
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(prefix="maketxt_", suffix=".txt")
+            os.close(fd)
+        if self.pending:
+            with open(self.path, "a", encoding="utf-8") as spool:
+                for block in iter_line_blocks(self.pending):
+                    spool.write(block)
+        self.pending = []
+        self.pending_bytes = 0
+
+    def finalize(self) -> str:
+        """Flush everything and return the path of the complete spool file."""
+        self.flush()
+        return self.path
+
+    def close(self) -> None:
+        """Delete the spool file and drop the in-memory state."""
+        if self.path and os.path.exists(self.path):
+            os.unlink(self.path)
+        self.path = None
+        self.digests = set()
+        self.pending = []
+        self.pending_bytes = 0
+
+    def __deepcopy__(self, memo: Dict) -> "LineSpool":
+        # Persistence snapshots deep-copy user_data; the spool owns a file, so share it
+        return self
+
+def reset_session(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Release session resources such as spool files, then clear user_data."""
+    for value in list(context.user_data.values()):
+        if isinstance(value, LineSpool):
+            value.close()
+    context.user_data.clear()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              JOB TRACING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# Innermost open span of the current task: (trace, span id, attributes)
+_active_span: ContextVar[Optional[Tuple["JobTrace", str, Dict]]] = ContextVar("active_span", default=None)
+
+@lru_cache(maxsize=None)
+def trace_exporter() -> logging.Logger:
+    """Return the logger that appends finished traces to the rotating TRACE_LOG_FILE."""
+    handler = RotatingFileHandler(worker_log_path(TRACE_LOG_FILE), maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS,
+                                  encoding="utf-8", delay=True)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    exporter = logging.getLogger(f"{__name__}.traces")
+    exporter.setLevel(logging.INFO)
+    exporter.propagate = False
+    exporter.addHandler(handler)
+    return exporter
+
+def new_span_id() -> str:
+    """Return a random 64-bit span id in hex."""
+    return os.urandom(8).hex()
+
+class JobTrace:
+    """Timed spans of one job, written as JSON lines to TRACE_LOG_FILE when it ends.
+
+    Jobs are sampled at TRACE_SAMPLE_RATE when the trace is created; an
+    unsampled trace records nothing. Each line is one span. The job itself
+    is the root span, and Bot API calls made while a span is open become
+    that span's children.
+    """
+
+    def __init__(self, kind: str, user_id: int):
+        self.sampled = TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+        if not self.sampled:
+            return
+        self.kind = kind
+        self.trace_id = uuid.uuid4().hex
+        self.root_id = new_span_id()
+        self.attrs: Dict = {"user_id": user_id}
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.spans: List[Dict] = []
+        self.dropped = 0
+
+    def activate(self) -> None:
+        """Make the job the current task's open span, so job-level calls are traced too."""
+        if self.sampled:
+            _active_span.set((self, self.root_id, self.attrs))
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time a child of this trace's innermost open span, recording any exception."""
+        if not self.sampled:
+            yield
+            return
+        active = _active_span.get()
+        parent_id = active[1] if active is not None and active[0] is self else self.root_id
+        span_id = new_span_id()
+        token = _active_span.set((self, span_id, attrs))
+        start = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            _active_span.reset(token)
+            self.record(name, span_id, parent_id, start, time.perf_counter() - started, attrs, error)
+
+    def record(self, name: str, span_id: str, parent_id: str, start: float, seconds: float,
+               attrs: Dict, error: Optional[str] = None) -> None:
+        """Keep a finished span for export, up to TRACE_MAX_SPANS per job."""
+        if not self.sampled:
+            return  # Finished already
+        if len(self.spans) >= TRACE_MAX_SPANS:
+            self.dropped += 1
+            return
+        span = {"name": name, "span_id": span_id, "parent_id": parent_id,
+                "start": round(start, 3), "ms": round(seconds * 1000, 2)}
+        if attrs:
+            span["attrs"] = attrs
+        if error:
+            span["error"] = error
+        self.spans.append(span)
+
+    def finish(self, status: str, **attrs) -> None:
+        """Export the root span, with the job's status, and every recorded span."""
+        if not self.sampled:
+            return
+        self.attrs.update(attrs, status=status)
+        if self.dropped:
+            self.attrs["dropped_spans"] = self.dropped
+        root = {"name": self.kind, "span_id": self.root_id, "parent_id": None, "start": round(self.start, 3),
+                "ms": round((time.perf_counter() - self.started) * 1000, 2), "attrs": self.attrs}
+        self.sampled = False
+        self.spans.sort(key=operator.itemgetter("start"))
+        trace_exporter().info("\n".join(json.dumps({"trace_id": self.trace_id, **span}, default=str)
+                                        for span in [root, *self.spans]))
+
+def child_span(name: str, **attrs):
+    """Return a span under the current task's open span, or a no-op context outside traced jobs."""
+    active = _active_span.get()
+    return active[0].span(name, **attrs) if active is not None else nullcontext()
+
+def span_attrs(**attrs) -> None:
+    """Add attributes to the current task's innermost open span, if any."""
+    active = _active_span.get()
+    if active is not None:
+        active[2].update(attrs)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              MEMORY PROFILING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_memory_jobs: deque = deque(maxlen=MEMORY_HISTORY)
+
+def read_rss() -> Tuple[int, int]:
+    """Return the process's current and peak resident set size in bytes."""
+    values = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values.get("VmRSS", 0), values.get("VmHWM", 0)
+
+def session_bytes(obj, seen: Optional[set] = None) -> int:
+    """Estimate the bytes held by session data, following containers and spools."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(session_bytes(key, seen) + session_bytes(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(session_bytes(item, seen) for item in obj)
+    elif isinstance(obj, LineSpool):
+        size += session_bytes(obj.digests, seen) + session_bytes(obj.pending, seen)
+    return size
+
+def format_mb(size: int) -> str:
+    """Format a byte count in MB."""
+    return f"{size / (1024 * 1024):.1f}MB"
+
+class JobProfile:
+    """Per-job record: a span per stage, plus tracemalloc peak per stage, RSS and session size.
+
+    The memory record does nothing unless MEMORY_PROFILING is on, and the
+    trace nothing unless the job is sampled. tracemalloc peaks are
+    process-wide, so overlapping jobs inflate each other's numbers, and
+    work done inside the process pool is not traced.
+    """
+
+    def __init__(self, kind: str, user_id: int):
+        self.kind = kind
+        self.user_id = user_id
+        self.trace = JobTrace(kind, user_id)
+        self.stages: Dict[str, Dict] = {}
+        self.rss_before = read_rss()[0] if MEMORY_PROFILING else 0
+
+    @contextmanager
+    def stage(self, name: str):
+        """Trace the stage and measure the traced allocation peak above its starting point."""
+        with self.trace.span(name):
+            if not MEMORY_PROFILING:
+                yield
+                return
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                peak = tracemalloc.get_traced_memory()[1] - base
+                entry = self.stages.setdefault(name, {"peak": 0, "seconds": 0.0, "calls": 0})
+                entry["peak"] = max(entry["peak"], peak)
+                entry["seconds"] = round(entry["seconds"] + time.perf_counter() - start, 3)
+                entry["calls"] += 1
+
+    def finish(self, user_data: Dict) -> None:
+        """Append the job record to the structured log and the /memory history."""
+        if not MEMORY_PROFILING:
+            return
+        rss, rss_peak = read_rss()
+        record = {
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "job": self.kind,
+            "user_id": self.user_id,
+            "rss_before": self.rss_before,
+            "rss_after": rss,
+            "rss_peak": rss_peak,
+            "user_data_bytes": session_bytes(dict(user_data)),
+            "stages": self.stages,
+        }
+        _memory_jobs.append(record)
+        try:
+            with open(worker_log_path(MEMORY_LOG_FILE), "a", encoding="utf-8") as log:
+                log.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write memory profile: {e}")
+
+def job_profile(context: ContextTypes.DEFAULT_TYPE, kind: str, user_id: int) -> JobProfile:
+    """Return the session's profile for kind, starting a new one if needed."""
+    profile = context.user_data.get("job_profile")
+    if profile is None or profile.kind != kind:
+        profile = context.user_data["job_profile"] = JobProfile(kind, user_id)
+    return profile
+
+def job_stage(profile: Optional[JobProfile], name: str):
+    """Return profile's stage context, or a no-op one without a profile."""
+    return profile.stage(name) if profile is not None else nullcontext()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SEEN CORPUS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def corpus_path(user_id: int) -> str:
+    """Return the path of a user's seen-line corpus file."""
+    return os.path.join(CORPUS_DIR, f"{user_id}.u64")
+
+def corpus_size(user_id: int) -> int:
+    """Return how many line hashes a user's corpus holds."""
+    path = corpus_path(user_id)
+    return os.path.getsize(path) // 8 if os.path.exists(path) else 0
+
+def open_corpus(user_id: int) -> np.ndarray:
+    """Memory-map a user's corpus as a sorted uint64 array (empty if none)."""
+    if corpus_size(user_id) == 0:
+        return np.empty(0, dtype="<u8")
+    return np.memmap(corpus_path(user_id), dtype="<u8", mode="r")
+
+def hash_keys(keys: List[str]) -> np.ndarray:
+    """Hash dedupe keys to 64-bit BLAKE2b values in one batched pass."""
+    hasher = partial(hashlib.blake2b, digest_size=8)
+    digests = map(methodcaller("digest"), map(hasher, map(str.encode, keys)))
+    return np.frombuffer(b"".join(digests), dtype="<u8")
+
+def filter_seen(user_id: int, lines: List[str], modes: Tuple[str, ...] = ()) -> Tuple[List[str], np.ndarray]:
+    """Drop lines already in the user's corpus.
+
+    Returns the kept lines and their hashes, ready for merge_corpus().
+    """
+    keys = build_normalizer(modes)(lines) if modes else lines
+    hashes = hash_keys(keys)
+    corpus = open_corpus(user_id)
+    if len(corpus) == 0 or len(hashes) == 0:
+        return lines, hashes
+    seen = np.empty(len(hashes), dtype=bool)
+    for start in range(0, len(hashes), CORPUS_BATCH):
+        batch = hashes[start:start + CORPUS_BATCH]
+        # Searching in sorted order walks the mapped corpus front to back
+        order = np.argsort(batch)
+        idx = np.searchsorted(corpus, batch[order])
+        np.minimum(idx, len(corpus) - 1, out=idx)
+        seen[start + order] = corpus[idx] == batch[order]
+    keep = ~seen
+    return list(compress(lines, keep.tolist())), hashes[keep]
+
+_corpus_locks: Dict[int, threading.Lock] = {}
+
+def corpus_lock(user_id: int) -> threading.Lock:
+    """Return the lock serializing rewrites of a user's corpus.
+
+    A user may have two jobs finishing at once, and each merge reads the
+    whole corpus before writing it back; users never span processes.
+    """
+    return _corpus_locks.setdefault(user_id, threading.Lock())
+
+def merge_corpus(user_id: int, hashes: np.ndarray) -> None:
+    """Merge new hashes into the user's sorted corpus and swap the file in atomically."""
+    new = np.unique(hashes)
+    with corpus_lock(user_id):
+        corpus = open_corpus(user_id)
+        if len(corpus):
+            idx = np.searchsorted(corpus, new)
+            found = corpus[np.minimum(idx, len(corpus) - 1)] == new
+            # Both sides are sorted, so inserting at the search positions keeps order
+            merged = np.insert(corpus, idx[~found], new[~found])
+        else:
+            merged = new
+        del corpus
+        os.makedirs(CORPUS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", prefix=f"{user_id}.", dir=CORPUS_DIR)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                merged.astype("<u8").tofile(f)
+            os.replace(tmp_path, corpus_path(user_id))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+def apply_seen_filter(user_id: int, settings: Dict, lines: List[str]) -> Tuple[List[str], int, Optional[np.ndarray]]:
+    """Apply the seen filter when enabled; return kept lines, lines dropped and new hashes."""
+    if not settings.get("seen_filter"):
+        return lines, 0, None
+    kept, hashes = filter_seen(user_id, lines, normalize_modes(settings))
+    return kept, len(lines) - len(kept), hashes
+
+def forget_corpus(user_id: int) -> None:
+    """Delete a user's seen-line corpus."""
+    with corpus_lock(user_id):
+        if os.path.exists(corpus_path(user_id)):
+            os.unlink(corpus_path(user_id))
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SET OPERATIONS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def line_hashes(lines: List[str], modes: Tuple[str, ...] = ()) -> np.ndarray:
+    """Hash lines by their dedupe key."""
+    return hash_keys(build_normalizer(modes)(lines) if modes else lines)
+
+def content_batches(content: str) -> Iterator[List[str]]:
+    """Yield a content's lines in batches of about PARALLEL_CHUNK_CHARS, for streaming."""
+    for chunk in split_text_chunks([content], PARALLEL_CHUNK_CHARS):
+        yield chunk.splitlines()
+
+def hash_index(batches: Iterable[List[str]], modes: Tuple[str, ...] = ()) -> np.ndarray:
+    """Build a sorted array of the unique key hashes of all lines."""
+    hashes = [line_hashes(batch, modes) for batch in batches]
+    return np.unique(np.concatenate(hashes)) if hashes else np.empty(0, dtype="<u8")
+
+def in_index(index: np.ndarray, hashes: np.ndarray) -> np.ndarray:
+    """Return a mask of the hashes present in a sorted hash index."""
+    if len(index) == 0:
+        return np.zeros(len(hashes), dtype=bool)
+    idx = np.minimum(np.searchsorted(index, hashes), len(index) - 1)
+    return index[idx] == hashes
+
+def stream_through(index: np.ndarray, content: str, modes: Tuple[str, ...] = (), collect_missed: bool = False,
+                   progress: Optional["Progress"] = None) -> Tuple[np.ndarray, List[str]]:
+    """Stream a content's lines through a hash index.
+
+    Returns the index hashes that were hit and, if asked, the lines that
+    missed, in content order.
+    """
+    found = []
+    missed = []
+    for batch in content_batches(content):
+        check_cancelled(progress)
+        hashes = line_hashes(batch, modes)
+        mask = in_index(index, hashes)
+        found.append(hashes[mask])
+        if collect_missed:
+            missed.extend(compress(batch, (~mask).tolist()))
+    return (np.unique(np.concatenate(found)) if found else np.empty(0, dtype="<u8")), missed
+
+def count_lines(content: str) -> int:
+    """Count a content's lines without splitting it."""
+    return content.count("\n") + (bool(content) and not content.endswith("\n"))
+
+def set_operation(op: str, contents: List[str], modes: Tuple[str, ...] = (),
+                  progress: Optional["Progress"] = None) -> List[str]:
+    """Apply a set operation across contents in order and return the unique result lines.
+
+    intersect keeps lines of the first file found in every other file,
+    subtract keeps those found in none of them, and xor folds symmetric
+    differences, keeping lines found in an odd number of files. Survivors
+    keep first-file order; xor appends each file's new lines in order.
+
+    For intersect and subtract the smaller side is indexed as 64-bit key
+    hashes and the larger one streamed through it in batches, so memory
+    follows the smaller input and time the larger one. xor needs the
+    lines new to the result, so it always streams the next file.
+    """
+    result = dedupe_lines(contents[0].splitlines(), modes=modes)
+    for content in contents[1:]:
+        result_hashes = line_hashes(result, modes)
+        if op == "xor":
+            hit, added = stream_through(np.unique(result_hashes), content, modes, True, progress)
+            result = list(compress(result, (~in_index(hit, result_hashes)).tolist()))
+            result.extend(dedupe_lines(added, modes=modes))
+            continue
+        if sum(map(len, result)) + len(result) <= len(content):
+            present = in_index(stream_through(np.unique(result_hashes), content, modes, progress=progress)[0],
+                               result_hashes)
+        else:
+            check_cancelled(progress)
+            present = in_index(hash_index(content_batches(content), modes), result_hashes)
+        result = list(compress(result, (present if op == "intersect" else ~present).tolist()))
+    return result
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SAMPLING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class BatchCounter:
+    """Pass line batches through while counting their lines."""
+
+    def __init__(self, batches: Iterable[List[str]]):
+        self.batches = batches
+        self.lines = 0
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for batch in self.batches:
+            self.lines += len(batch)
+            yield batch
+
+def dedupe_batches(batches: Iterable[List[str]], modes: Tuple[str, ...] = ()) -> Iterator[List[str]]:
+    """Yield each batch with the lines seen earlier in the stream removed.
+
+    Only a 16-byte digest per unique key is kept, not the lines themselves.
+    """
+    seen = set()
+    hasher = partial(hashlib.blake2b, digest_size=16)
+    for batch in batches:
+        keys = build_normalizer(modes)(batch) if modes else batch
+        digests = map(methodcaller("digest"), map(hasher, map(str.encode, keys)))
+        yield list(compress(batch, [not (d in seen or seen.add(d)) for d in digests]))
+
+def head_sample(batches: Iterable[List[str]], count: int) -> List[str]:
+    """Return the first count lines, reading no further than needed."""
+    sample = []
+    for batch in batches:
+        sample.extend(batch[:count - len(sample)])
+        if len(sample) >= count:
+            break
+    return sample
+
+def tail_sample(batches: Iterable[List[str]], count: int) -> List[str]:
+    """Return the last count lines, keeping them in a ring buffer."""
+    ring = deque(maxlen=count)
+    for batch in batches:
+        ring.extend(batch)
+    return list(ring)
+
+def reservoir_sample(batches: Iterable[List[str]], count: int, rng: random.Random = None) -> List[str]:
+    """Return count lines chosen uniformly at random, in file order.
+
+    Uses reservoir sampling with geometric skips (Algorithm L), so the
+    random number generator runs once per replacement rather than once
+    per line and skipped lines are never touched in Python.
+    """
+    rng = rng or random.Random()
+    uniform = lambda: max(rng.random(), sys.float_info.min)
+    reservoir = []  # (line number, line)
+    position = 0
+    weight = 1.0
+    next_pick = 0
+    for batch in batches:
+        start = position
+        position += len(batch)
+        if len(reservoir) < count:
+            taken = batch[:count - len(reservoir)]
+            reservoir.extend(zip(range(start, start + len(taken)), taken))
+            if len(reservoir) < count:
+                continue
+            weight = math.exp(math.log(uniform()) / count)
+            next_pick = count + math.floor(math.log(uniform()) / math.log1p(-weight))
+        while next_pick < position:
+            reservoir[rng.randrange(count)] = (next_pick, batch[next_pick - start])
+            weight *= math.exp(math.log(uniform()) / count)
+            next_pick += math.floor(math.log(uniform()) / math.log1p(-weight)) + 1
+    reservoir.sort()
+    return [line for _, line in reservoir]
+
+def sample_upload(path: str, file_name: str, method: str, count: int, dedupe: bool = False,
+                  modes: Tuple[str, ...] = (), progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Sample a stored upload in one streaming pass and return the sample and lines read.
+
+    Memory follows count, plus one digest per unique line when
+    deduplicating first.
+    """
+    counter = BatchCounter(iter_upload_lines(path, file_name, progress=progress))
+    batches = dedupe_batches(counter, modes) if dedupe else counter
+    sampler = {"head": head_sample, "tail": tail_sample, "random": reservoir_sample}[method]
+    return sampler(batches, count), counter.lines
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              FILTERING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def parse_filter_patterns(lines: Iterable[str]) -> Tuple[Tuple[str, ...], ...]:
+    """Parse pattern lines into a filter spec.
+
+    Each line is a substring to keep, or to drop when it starts with "-"
+    (a leading "+" is optional); wrapped in slashes, /like this/, it is a
+    regular expression instead. The spec holds include literals, include
+    regexes, exclude literals and exclude regexes. Raises ValueError on a
+    pattern that is too long or does not compile.
+    """
+    groups = ([], [], [], [])
+    for raw in lines:
+        text = raw.strip()
+        exclude = text.startswith("-")
+        if text.startswith(("+", "-")):
+            text = text[1:]
+        if not text:
+            continue
+        if len(text) > MAX_FILTER_PATTERN_CHARS:
+            raise ValueError(f"Pattern longer than {MAX_FILTER_PATTERN_CHARS} characters: {text[:20]}...")
+        regex = len(text) > 2 and text.startswith("/") and text.endswith("/")
+        if regex:
+            text = text[1:-1]
+            try:
+                re.compile(text)  # As compile_filter() compiles it
+            except re.error as e:
+                raise ValueError(f"Invalid regex /{text}/: {e}") from None
+        groups[2 * exclude + regex].append(text)
+    return tuple(tuple(dict.fromkeys(group)) for group in groups)
+
+def filter_pattern_count(spec: Tuple[Tuple[str, ...], ...]) -> Tuple[int, int]:
+    """Return the number of include and exclude patterns in a spec."""
+    return len(spec[0]) + len(spec[1]), len(spec[2]) + len(spec[3])
+
+def literal_trie_regex(literals: Iterable[str]) -> str:
+    """Build a regex matching any of the literals, factored as a trie.
+
+    A plain alternation tries every literal at every position; the trie
+    tests each shared prefix once, which is what makes hundreds of
+    literals affordable for the re engine.
+    """
+    root = {}
+    for literal in literals:
+        node = root
+        for char in literal:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    
+    def build(node: Dict) -> str:
+        if "" in node:
+            return ""  # A shorter literal already matches wherever a longer one would
+        branches = [re.escape(char) + build(child) for char, child in node.items()]
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    
+    return build(root)
+
+@lru_cache(maxsize=32)
+def compile_filter(spec: Tuple[Tuple[str, ...], ...]) -> Tuple[Optional[Callable[[str], bool]],
+                                                                Optional[Callable[[str], bool]]]:
+    """Compile a filter spec once into an include and an exclude matcher.
+
+    Literals and plain regexes share one alternation. A regex with groups
+    or inline flags is matched on its own: the alternation would renumber
+    its groups, breaking backreferences such as \\1, or apply its flags
+    to every pattern.
+    """
+    def combined(literals: Tuple[str, ...], regexes: Tuple[str, ...]) -> Optional[Callable[[str], bool]]:
+        compiled = [re.compile(regex) for regex in regexes]
+        alone = [pattern for pattern in compiled if pattern.groups or pattern.flags != re.UNICODE]
+        sources = ([literal_trie_regex(literals)] if literals else []) + [
+            f"(?:{pattern.pattern})" for pattern in compiled if pattern not in alone
+        ]
+        patterns = ([re.compile("|".join(sources))] if sources else []) + alone
+        if len(patterns) <= 1:
+            return patterns[0].search if patterns else None
+        searches = [pattern.search for pattern in patterns]
+        return lambda line: any(search(line) for search in searches)
+    
+    return combined(spec[0], spec[1]), combined(spec[2], spec[3])
+
+class FilterTimeout(Exception):
+    """Raised when matching one batch takes longer than FILTER_BATCH_SECONDS."""
+
+def _filter_alarm(signum, frame) -> None:
+    raise FilterTimeout()
+
+def filter_lines(lines: List[str], spec: Tuple[Tuple[str, ...], ...]) -> List[str]:
+    """Keep the lines matching any include pattern (if there are any) and no exclude pattern."""
+    include, exclude = compile_filter(spec)
+    if include is not None:
+        lines = list(filter(include, lines))
+    if exclude is not None:
+        lines = list(filterfalse(exclude, lines))
+    return lines
+
+def filter_batch(lines: List[str], spec: Tuple[Tuple[str, ...], ...], timeout: float = FILTER_BATCH_SECONDS
+                 ) -> List[str]:
+    """Run filter_lines() in a pool worker, raising FilterTimeout if it runs past timeout.
+
+    The re engine checks for signals while it backtracks, so the alarm
+    stops a catastrophic pattern mid-match and the worker stays usable.
+    """
+    previous = signal.signal(signal.SIGALRM, _filter_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return filter_lines(lines, spec)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def filter_batches(batches: Iterable[List[str]], spec: Tuple[Tuple[str, ...], ...],
+                   workers: int = DEDUPE_WORKERS) -> Iterator[List[str]]:
+    """Yield each batch's filtered lines in order, matching in the process pool.
+
+    User regexes never run in the bot process, where a slow match would
+    hold the GIL and stall every user. At most two batches per worker are
+    in flight, so memory stays bounded while the reader keeps the pool busy.
+    """
+    pool = get_process_pool()
+    window = deque()
+    try:
+        for batch in batches:
+            window.append(pool.submit(filter_batch, batch, spec))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+    finally:
+        for future in window:
+            future.cancel()
+
+def filter_upload(path: str, file_name: str, spec: Tuple[Tuple[str, ...], ...], modes: Tuple[str, ...] = (),
+                  progress: Optional["Progress"] = None) -> Tuple[List[str], int]:
+    """Filter and dedupe a stored upload in one streaming pass.
+
+    Returns the unique matching lines in file order and the number of
+    lines read. Raises FilterTimeout when a batch takes too long to match.
+    """
+    counter = BatchCounter(iter_upload_lines(path, file_name, progress=progress))
+    kept = dedupe_batches(filter_batches(counter, spec), modes)
+    return list(chain.from_iterable(kept)), counter.lines
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              PROGRESS REPORTING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class JobCancelled(Exception):
+    """Raised by a Progress hook once the user cancelled the job."""
+
+class Progress:
+    """Stage counters that processing code advances and the status updater reads.
+
+    Hooks are plain attribute writes, so they cost next to nothing in hot
+    loops and can be called from worker threads. A Progress doubles as the
+    job's cancel token: once cancelled, the next hook raises JobCancelled.
+    """
+
+    def __init__(self):
+        self.stage = ""
+        self.unit = ""
+        self.done = 0
+        self.total = 0
+        self.cancelled = False
+
+    def start(self, stage: str, total: int = 0, unit: str = "bytes") -> None:
+        """Begin a stage; a total of 0 means the amount of work is unknown."""
+        self.check()
+        self.done = 0
+        self.stage = stage
+        self.unit = unit
+        self.total = total
+
+    def advance(self, amount: int) -> None:
+        self.check()
+        self.done += amount
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def check(self) -> None:
+        """Raise JobCancelled if the job was cancelled."""
+        if self.cancelled:
+            raise JobCancelled()
+
+    def _amount(self, count: int) -> str:
+        return format_mb(count) if self.unit == "bytes" else f"{count} {self.unit}"
+
+    def render(self) -> str:
+        """Return the status line: a bar when the total is known, else the count so far."""
+        if not self.total:
+            return f"▶ {self.stage}" + (f": {self._amount(self.done)}" if self.done else "")
+        fraction = min(1.0, self.done / self.total)
+        filled = int(fraction * 10)
+        done = min(self.done, self.total)
+        counts = (f"{format_mb(done)} of {format_mb(self.total)}" if self.unit == "bytes"
+                  else f"{done} of {self.total} {self.unit}")
+        return f"{'▓' * filled}{'░' * (10 - filled)} {fraction:.0%}\n\n   {self.stage}: {counts}"
+
+def advance_progress(progress: Optional[Progress], amount: int) -> None:
+    """Advance progress if there is one."""
+    if progress is not None:
+        progress.advance(amount)
+
+def check_cancelled(progress: Optional[Progress]) -> None:
+    """Raise JobCancelled if there is a progress and its job was cancelled."""
+    if progress is not None:
+        progress.check()
+
+@asynccontextmanager
+async def progress_updates(edit: Callable[[str], Awaitable], action: str, progress: Progress,
+                           interval: float = PROGRESS_INTERVAL):
+    """Edit the status message with progress at most once per interval while the block runs."""
+    stop = asyncio.Event()
+    
+    async def update_loop() -> None:
+        shown = None
+        while True:
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            text = processing_text(action, progress.render())
+            if text != shown:
+                shown = text
+                try:
+                    await edit(text)
+                except Exception:
+                    pass  # Status edits are best-effort
+    
+    task = asyncio.create_task(update_loop())
+    try:
+        yield progress
+    finally:
+        # Let an in-flight edit land before the caller's final edit
+        stop.set()
+        await task
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              FILE I/O
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def split_compression(file_name: str) -> Tuple[str, str]:
+    """Split a file name into its name without compression suffix and the suffix."""
+    root, ext = os.path.splitext(file_name)
+    if ext.lower() in COMPRESSION_OPENERS or ext.lower() == ".zip":
+        return root, ext.lower()
+    return file_name, ""
+
+def is_supported_upload(file_name: str, extensions: Tuple[str, ...] = TEXT_EXTENSIONS) -> bool:
+    """Check a plain or compressed upload name against the allowed text extensions."""
+    inner, compression = split_compression(file_name)
+    # Archive members are filtered by extension when the zip is read
+    return compression == ".zip" or inner.lower().endswith(extensions)
+
+def upload_base_name(file_name: str) -> str:
+    """Return the upload name without compression and text extensions."""
+    return os.path.splitext(split_compression(file_name)[0])[0]
+
+def _iter_stream(stream) -> Iterator[bytes]:
+    """Yield a binary stream in IO_CHUNK_BYTES pieces."""
+    while True:
+        chunk = stream.read(IO_CHUNK_BYTES)
+        if not chunk:
+            return
+        yield chunk
+
+def iter_upload_bytes(path: str, file_name: str, extensions: Tuple[str, ...] = TEXT_EXTENSIONS) -> Iterator[bytes]:
+    """Yield the decompressed bytes of a stored upload chunk by chunk."""
+    compression = split_compression(file_name)[1]
+    if compression == ".zip":
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not info.filename.lower().endswith(extensions):
+                    continue
+                last = b"\n"
+                with archive.open(info) as member:
+                    for chunk in _iter_stream(member):
+                        last = chunk
+                        yield chunk
+                # Keep the last line of one member apart from the next member
+                if not last.endswith(b"\n"):
+                    yield b"\n"
+        return
+    opener = COMPRESSION_OPENERS.get(compression, open)
+    with opener(path, "rb") as stream:
+        yield from _iter_stream(stream)
+
+def read_upload_text(path: str, file_name: str, extensions: Tuple[str, ...] = TEXT_EXTENSIONS,
+                     progress: Optional[Progress] = None) -> Tuple[str, int]:
+    """Decode a stored upload incrementally and return its text and byte size.
+
+    The whole text stays in memory, so the cap is MAX_TEXT_BYTES rather
+    than the streaming MAX_DECOMPRESSED_BYTES. Raises ValueError above it.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    parts = []
+    size = 0
+    for chunk in iter_upload_bytes(path, file_name, extensions):
+        size += len(chunk)
+        if size > MAX_TEXT_BYTES:
+            raise ValueError("Decompressed upload exceeds size limit")
+        parts.append(decoder.decode(chunk))
+        advance_progress(progress, len(chunk))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts), size
+
+def iter_upload_lines(path: str, file_name: str, extensions: Tuple[str, ...] = TEXT_EXTENSIONS,
+                      progress: Optional[Progress] = None) -> Iterator[List[str]]:
+    """Decode a stored upload incrementally and yield its lines in batches.
+
+    Batches are cut after a newline, so together they hold exactly the
+    lines of read_upload_text()'s text.splitlines() while only about one
+    IO_CHUNK_BYTES chunk of text is in memory at a time.
+    Raises ValueError when the decompressed size exceeds MAX_DECOMPRESSED_BYTES.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    carry = ""
+    size = 0
+    for chunk in iter_upload_bytes(path, file_name, extensions):
+        size += len(chunk)
+        if size > MAX_DECOMPRESSED_BYTES:
+            raise ValueError("Decompressed upload exceeds size limit")
+        text = carry + decoder.decode(chunk)
+        advance_progress(progress, len(chunk))
+        # A partial last line (or a \r waiting for its \n) goes with the next chunk
+        cut = text.rfind("\n") + 1
+        carry = text[cut:]
+        if cut:
+            yield text[:cut].splitlines()
+    carry += decoder.decode(b"", final=True)
+    if carry:
+        yield carry.splitlines()
+
+async def download_file(file, path: str, size: int, progress: Optional[Progress] = None) -> None:
+    """Save a Telegram file to path, streaming it to report progress when wanted."""
+    request = file.get_bot().request
+    if progress is None or not isinstance(request, RoutingRequest) or not file.file_path.startswith("http"):
+        await file.download_to_drive(path, read_timeout=transfer_timeout(size))
+        return
+    with child_span("api.download"):
+        await request.transfer.stream_to_file(file.file_path, path, progress.advance, transfer_timeout(size))
+
+async def download_upload(document: Document, profile: Optional[JobProfile] = None,
+                          progress: Optional[Progress] = None) -> str:
+    """Download a document to a temporary file and return its path; the caller removes it."""
+    fd, path = tempfile.mkstemp(suffix=split_compression(document.file_name)[1] or ".txt")
+    os.close(fd)
+    try:
+        with job_stage(profile, "download"):
+            span_attrs(bytes=document.file_size or 0)
+            if progress is not None:
+                progress.start("Downloading", document.file_size or 0)
+            file = await document.get_file()
+            await download_file(file, path, document.file_size or 0, progress)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+async def download_upload_text(document: Document, extensions: Tuple[str, ...] = TEXT_EXTENSIONS,
+                               profile: Optional[JobProfile] = None,
+                               progress: Optional[Progress] = None) -> Tuple[str, int]:
+    """Download a document to disk and return its decompressed text and size."""
+    path = await download_upload(document, profile, progress)
+    try:
+        with job_stage(profile, "decode"):
+            if progress is not None:
+                progress.start("Decoding")
+            text, size = await asyncio.to_thread(read_upload_text, path, document.file_name, extensions, progress)
+            span_attrs(bytes=size, chars=len(text))
+            return text, size
+    finally:
+        os.unlink(path)
+
+_global_downloads = asyncio.Semaphore(MAX_GLOBAL_DOWNLOADS)
+_user_downloads: Dict[int, asyncio.Semaphore] = {}
+
+@asynccontextmanager
+async def download_slot(user_id: int):
+    """Hold one per-user and one global download slot."""
+    user_slots = _user_downloads.setdefault(user_id, asyncio.Semaphore(MAX_USER_DOWNLOADS))
+    # Take the user slot first so a queued user never pins a global slot
+    async with user_slots:
+        async with _global_downloads:
+            yield
+
+async def bounded_download(user_id: int, document: Document, extensions: Tuple[str, ...] = TEXT_EXTENSIONS,
+                           profile: Optional[JobProfile] = None,
+                           progress: Optional[Progress] = None) -> Tuple[str, int]:
+    """Download an upload's text within the concurrency limits."""
+    async with download_slot(user_id):
+        return await download_upload_text(document, extensions, profile, progress)
+
+async def download_with_status(message, user_id: int, document: Document,
+                               extensions: Tuple[str, ...] = TEXT_EXTENSIONS,
+                               profile: Optional[JobProfile] = None) -> Tuple[str, int]:
+    """Download an upload, showing live progress in a temporary message for large files."""
+    if (document.file_size or 0) < PROGRESS_MIN_BYTES:
+        return await bounded_download(user_id, document, extensions, profile)
+    action = f"Receiving {document.file_name[:28]}..."
+    status_msg = await message.reply_text(processing_text(action, "▶ Downloading"))
+    try:
+        async with progress_updates(status_msg.edit_text, action, Progress()) as progress:
+            return await bounded_download(user_id, document, extensions, profile, progress)
+    finally:
+        try:
+            await status_msg.delete()
+        except Exception:
+            pass
+
+async def download_for_job(user_id: int, document: Document, edit: Callable[..., Awaitable], action: str,
+                           profile: Optional[JobProfile], progress: Progress) -> Optional[str]:
+    """Download a job's upload to a temporary file with live progress.
+
+    Returns the path, or None after telling the user the download failed.
+    """
+    async with progress_updates(edit, action, progress):
+        try:
+            async with download_slot(user_id):
+                return await download_upload(document, profile, progress)
+        except (asyncio.CancelledError, JobCancelled):
+            raise
+        except Exception:
+            pass
+    await edit("⚠ Failed to download file. Try a smaller file.", reply_markup=back_keyboard())
+    return None
+
+def iter_line_blocks(lines: Iterable[str], block_lines: int = 10000,
+                     progress: Optional[Progress] = None) -> Iterator[str]:
+    """Yield newline-terminated lines joined into blocks, stopping if the job is cancelled."""
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) >= block_lines:
+            check_cancelled(progress)
+            yield "\n".join(block) + "\n"
+            block = []
+    if block:
+        yield "\n".join(block) + "\n"
+
+def output_filename(base_name: str, output_format: str) -> str:
+    """Return the delivered file name for a TXT result in the given format."""
+    if output_format == "zip":
+        return f"{base_name}.zip"
+    if output_format == "txt":
+        return f"{base_name}.txt"
+    return f"{base_name}.txt.{output_format}"
+
+class PartWriter:
+    """Encoded text sink for one output file in any of the OUTPUT_FORMATS."""
+
+    def __init__(self, output_format: str, inner_name: str):
+        fd, self.path = tempfile.mkstemp(suffix="." + output_format)
+        os.close(fd)
+        self.size = 0
+        self._archive = None
+        try:
+            if output_format == "zip":
+                self._archive = zipfile.ZipFile(self.path, "w", zipfile.ZIP_DEFLATED)
+                self._stream = self._archive.open(inner_name, "w", force_zip64=True)
+            else:
+                opener = COMPRESSION_OPENERS.get("." + output_format, open)
+                self._stream = opener(self.path, "wb")
+        except BaseException:
+            if self._archive is not None:
+                self._archive.close()
+            os.unlink(self.path)
+            raise
+
+    def write(self, text: str) -> None:
+        """Encode and append text."""
+        data = text.encode("utf-8")
+        self.size += len(data)
+        self._stream.write(data)
+
+    def close(self) -> str:
+        """Finish the file and return its path."""
+        self._stream.close()
+        if self._archive is not None:
+            self._archive.close()
+        return self.path
+
+    def discard(self) -> None:
+        """Close and delete an unfinished file."""
+        try:
+            self.close()
+        finally:
+            os.unlink(self.path)
+
+def discard_part_files(files: List[Tuple[int, str]]) -> None:
+    """Delete written (part number, path) files after a failed or cancelled split."""
+    for _, path in files:
+        if os.path.exists(path):
+            os.unlink(path)
+
+def write_output_file(blocks: Iterable[str], output_format: str, inner_name: str,
+                      progress: Optional[Progress] = None) -> str:
+    """Stream text blocks into a temp file in the requested format; return its path.
+
+    Progress advances by the number of lines in each block.
+    """
+    writer = PartWriter(output_format, inner_name)
+    try:
+        for block in blocks:
+            writer.write(block)
+            advance_progress(progress, block.count("\n"))
+    except BaseException:
+        writer.discard()
+        raise
+    return writer.close()
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SPLITTING
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def byte_balanced_ranges(lines: List[str], parts: int) -> List[Tuple[int, int]]:
+    """Cut lines into up to `parts` contiguous ranges of near-equal byte size."""
+    if not lines:
+        return []
+    parts = min(parts, len(lines))
+    sizes = np.fromiter(map(len, map(str.encode, lines)), dtype=np.int64, count=len(lines))
+    prefix = np.cumsum(sizes + 1)  # bytes up to and including each line's newline
+    targets = prefix[-1] * np.arange(1, parts) / parts
+    after = np.searchsorted(prefix, targets)
+    # Cut after whichever neighbouring line boundary is closer to each target
+    before = np.where(after > 0, prefix[np.maximum(after - 1, 0)], 0)
+    cuts = np.where(targets - before < prefix[after] - targets, after, after + 1)
+    bounds = [0] + sorted(set(cuts.tolist()) - {0, len(lines)}) + [len(lines)]
+    return list(zip(bounds, bounds[1:]))
+
+def split_by_bytes(lines: List[str], parts: int, output_format: str, base_name: str,
+                   progress: Optional[Progress] = None) -> List[Tuple[int, str]]:
+    """Write lines into `parts` files balanced by bytes; return (part number, path) pairs."""
+    files = []
+    ranges = byte_balanced_ranges(lines, parts)
+    if progress is not None:
+        progress.start("Writing parts", len(ranges), "parts")
+    try:
+        for number, (start, end) in enumerate(ranges, 1):
+            path = write_output_file(iter_line_blocks(lines[start:end], progress=progress), output_format,
+                                     f"{base_name}_part{number:03d}.txt")
+            files.append((number, path))
+            advance_progress(progress, 1)
+    except BaseException:
+        discard_part_files(files)
+        raise
+    return files
+
+def parse_key_spec(text: str) -> Tuple[int, Callable[[str], str]]:
+    """Parse '<files> f<field> [delimiter]' or '<files> p<chars>' into a part count and key function."""
+    tokens = text.split()
+    parts = int(tokens[0])
+    spec = tokens[1].lower() if len(tokens) > 1 else "f1"
+    width = int(spec[1:])
+    if parts <= 0 or width <= 0 or spec[0] not in "fp":
+        raise ValueError("Invalid key spec")
+    if spec[0] == "p":
+        return parts, lambda line: line[:width]
+    delimiter = tokens[2] if len(tokens) > 2 else ","
+    delimiter = {"tab": "\t", "space": " "}.get(delimiter.lower(), delimiter)
+
+    def field_key(line: str) -> str:
+        fields = line.split(delimiter, width)
+        return fields[width - 1] if len(fields) >= width else ""
+
+    return parts, field_key
+
+def split_by_key(lines: List[str], parts: int, key_func: Callable[[str], str],
+                 output_format: str, base_name: str, progress: Optional[Progress] = None) -> List[Tuple[int, str]]:
+    """Hash-partition lines by key into `parts` files in one pass.
+
+    Equal keys always land in the same part number. Empty parts are
+    dropped; returns (part number, path) pairs for the rest.
+    """
+    writers = []
+    buffers = [[] for _ in range(parts)]
+    if progress is not None:
+        progress.start("Partitioning by key", len(lines), "lines")
+    try:
+        # Opened inside the try so a failure part-way, such as EMFILE, removes the ones already open
+        writers.extend(PartWriter(output_format, f"{base_name}_part{n:03d}.txt") for n in range(1, parts + 1))
+        for start in range(0, len(lines), 10000):
+            block = lines[start:start + 10000]
+            shard_ids = map(operator.mod, map(zlib.crc32, map(str.encode, map(key_func, block))), repeat(parts))
+            for line, shard in zip(block, shard_ids):
+                buffer = buffers[shard]
+                buffer.append(line)
+                if len(buffer) >= 10000:
+                    writers[shard].write("\n".join(buffer) + "\n")
+                    buffer.clear()
+            advance_progress(progress, len(block))
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+    files = []
+    for number, (writer, buffer) in enumerate(zip(writers, buffers), 1):
+        if buffer:
+            writer.write("\n".join(buffer) + "\n")
+        path = writer.close()
+        if writer.size:
+            files.append((number, path))
+        else:
+            os.unlink(path)
+    return files
+
+def write_chunk_files(chunks: List[str], output_format: str, base_name: str,
+                      progress: Optional[Progress] = None) -> List[Tuple[int, str]]:
+    """Write each text chunk to its own part file; return (part number, path) pairs."""
+    if progress is not None:
+        progress.start("Writing parts", len(chunks), "parts")
+    files = []
+    try:
+        for number, chunk in enumerate(chunks, 1):
+            files.append((number, write_output_file([chunk], output_format, f"{base_name}_part{number:03d}.txt")))
+            advance_progress(progress, 1)
+    except BaseException:
+        discard_part_files(files)
+        raise
+    return files
+
+def split_into_files(unique_lines: List[str], method: str, value: int, key_func: Optional[Callable[[str], str]],
+                     output_format: str, base_name: str, progress: Optional[Progress] = None) -> List[Tuple[int, str]]:
+    """Split lines with the chosen method; return (part number, path) pairs."""
+    if method == "bytes":
+        # Split into N files of near-equal byte size
+        return split_by_bytes(unique_lines, value, output_format, base_name, progress)
+    
+    if method == "key":
+        # Split into N files, equal keys always in the same file
+        return split_by_key(unique_lines, value, key_func, output_format, base_name, progress)
+    
+    lines = [line + "\n" for line in unique_lines]
+    chunks = []
+    
+    if method == "lines":
+        # Split by max lines per file
+        for i in range(0, len(lines), value):
+            chunk = lines[i:i + value]
+            chunks.append("".join(chunk))
+    
+    elif method == "count":
+        # Split into N files
+        if value > len(lines):
+            value = max(1, len(lines))
+        chunk_size = len(lines) // value
+        remainder = len(lines) % value
+        
+        start = 0
+        for i in range(value):
+            extra = 1 if i < remainder else 0
+            end = start + chunk_size + extra
+            chunk = lines[start:end]
+            if chunk:
+                chunks.append("".join(chunk))
+            start = end
+    
+    elif method == "size":
+        # Split by max size in KB
+        max_bytes = value * 1024
+        current_chunk = []
+        current_bytes = 0
+        
+        for line in lines:
+            # A running count, so each line is encoded once rather than the whole chunk
+            line_bytes = len(line.encode('utf-8'))
+            if current_bytes + line_bytes > max_bytes and current_chunk:
+                check_cancelled(progress)
+                chunks.append("".join(current_chunk))
+                current_chunk = []
+                current_bytes = 0
+            current_chunk.append(line)
+            current_bytes += line_bytes
+        
+        if current_chunk:
+            chunks.append("".join(current_chunk))
+    
+    return write_chunk_files(chunks or [""], output_format, base_name, progress)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              JOB SCHEDULER
+# ═══════════════════════════════════════════════════════════════════════════════
+
+class JobScheduler:
+    """Admit CPU-heavy jobs smallest-first, with aging and per-user quotas.
+
+    A waiting job ranks by its estimated input bytes minus aging_rate bytes
+    per second waited, so large jobs still run under a steady stream of
+    small ones. Each user may run user_jobs jobs and user_bytes bytes at
+    once; a job larger than the byte quota runs alone.
+    """
+
+    def __init__(self, slots: int = MAX_RUNNING_JOBS, user_jobs: int = MAX_USER_JOBS,
+                 user_bytes: int = USER_BYTE_QUOTA, aging_rate: float = SCHEDULER_AGING_RATE):
+        self.slots = slots
+        self.user_jobs = user_jobs
+        self.user_bytes = user_bytes
+        self.aging_rate = aging_rate
+        self.waiting: List[Dict] = []
+        self.running: Dict[int, List[int]] = {}
+        self.active = 0
+
+    def _priority(self, job: Dict, now: float) -> float:
+        return job["cost"] - self.aging_rate * (now - job["queued"])
+
+    def _eligible(self, job: Dict) -> bool:
+        costs = self.running.get(job["user_id"], [])
+        return len(costs) < self.user_jobs and (not costs or sum(costs) + job["cost"] <= self.user_bytes)
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self.active < self.slots:
+            eligible = [job for job in self.waiting if self._eligible(job)]
+            if not eligible:
+                return
+            job = min(eligible, key=lambda j: self._priority(j, now))
+            self.waiting.remove(job)
+            self.active += 1
+            self.running.setdefault(job["user_id"], []).append(job["cost"])
+            job["admitted"].set_result(None)
+
+    def _release(self, job: Dict) -> None:
+        self.active -= 1
+        costs = self.running[job["user_id"]]
+        costs.remove(job["cost"])
+        if not costs:
+            del self.running[job["user_id"]]
+        self._dispatch()
+
+    def position(self, job: Dict) -> Tuple[int, int]:
+        """Return a waiting job's 1-based place in priority order and the queue length."""
+        now = time.monotonic()
+        order = sorted(self.waiting, key=lambda j: self._priority(j, now))
+        return order.index(job) + 1, len(order)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, cost: int,
+                   on_queued: Optional[Callable[[int, int], Awaitable[None]]] = None):
+        """Wait for admission, reporting changes of queue position, then hold a slot."""
+        job = {"user_id": user_id, "cost": cost, "queued": time.monotonic(),
+               "admitted": asyncio.get_running_loop().create_future()}
+        self.waiting.append(job)
+        self._dispatch()
+        try:
+            shown = None
+            while not job["admitted"].done():
+                place = self.position(job)
+                if on_queued is not None and place != shown:
+                    shown = place
+                    await on_queued(*place)
+                try:
+                    await asyncio.wait_for(asyncio.shield(job["admitted"]), SCHEDULER_REFRESH)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            if job in self.waiting:
+                self.waiting.remove(job)
+            else:
+                self._release(job)
+            raise
+        try:
+            yield
+        finally:
+            self._release(job)
+
+scheduler = JobScheduler()
+
+def processing_text(action: str, status: str) -> str:
+    """Render the PROCESSING screen for an action and its current status line."""
+    return f"""
+{HEADER}
+
+          PROCESSING
+
+{DIVIDER}
+
+   {status}
+
+   {action}
+
+{DIVIDER}"""
+
+@asynccontextmanager
+async def job_slot(user_id: int, cost: int, edit: Callable[[str], Awaitable], action: str, progress: Progress):
+    """Hold a scheduler slot, showing queue position and then progress on the status message."""
+    queued = False
+    
+    async def show(status: str) -> None:
+        try:
+            await edit(processing_text(action, status))
+        except Exception:
+            pass  # Status edits are best-effort
+    
+    async def on_queued(position: int, length: int) -> None:
+        nonlocal queued
+        queued = True
+        await show(f"⧗ Queued: {position} of {length}")
+    
+    waited = time.perf_counter()
+    async with scheduler.slot(user_id, cost, on_queued):
+        span_attrs(cost=cost, queue_ms=round((time.perf_counter() - waited) * 1000, 2))
+        if queued:
+            await show("▶ Running")
+        async with progress_updates(edit, action, progress):
+            yield progress
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              JOB CANCELLATION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+_running_jobs: Dict[str, Tuple[int, asyncio.Task, Progress]] = {}
+
+def start_job(update: Update, context: ContextTypes.DEFAULT_TYPE,
+              run: Callable[[str, Progress], Awaitable[None]], profile: Optional[JobProfile] = None) -> str:
+    """Run a processing job as its own task so CANCEL is handled while it runs.
+
+    run gets the job id, for the CANCEL button, and the Progress that
+    serves as the job's cancel token. The profile's trace, if sampled,
+    is exported with the job's outcome when the task ends.
+    """
+    job_id = uuid.uuid4().hex[:16]
+    progress = Progress()
+    trace = profile.trace if profile is not None else JobTrace("job", update.effective_user.id)
+    
+    async def run_job() -> None:
+        trace.activate()
+        status = "cancelled"
+        try:
+            await run(job_id, progress)
+            status = "done"
+        except JobCancelled:
+            pass  # Cancelled from a worker thread; cleanup already ran
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            trace.finish(status, job_id=job_id)
+    
+    task = context.application.create_task(run_job(), update=update)
+    _running_jobs[job_id] = (update.effective_user.id, task, progress)
+    task.add_done_callback(lambda _: _running_jobs.pop(job_id, None))
+    return job_id
+
+async def cancel_job(job_id: str, user_id: int) -> bool:
+    """Cancel one of the user's running jobs and wait until it has cleaned up.
+
+    The task is cancelled at its current await, which aborts transfers
+    in flight; worker threads stop at their next progress hook and
+    pending process-pool chunks are dropped.
+    """
+    running = _running_jobs.get(job_id)
+    if running is None or running[0] != user_id:
+        return False
+    _, task, progress = running
+    progress.cancel()
+    task.cancel()
+    await asyncio.wait([task])
+    return True
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              JOB CHECKPOINTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def job_dir(job: Dict) -> str:
+    """Return the directory holding a job's manifest and undelivered parts."""
+    return os.path.join(JOBS_DIR, job["id"])
+
+def create_job(kind: str, chat_id: int, user_id: int, params: Dict) -> Dict:
+    """Start a checkpointed delivery job; nothing is resumable until save_job()."""
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "params": params,
+        "parts": [],
+        "delivered": 0,
+        "resumes": 0,
+        "created": time.time(),
+    }
+    os.makedirs(job_dir(job))
+    return job
+
+def add_job_part(job: Dict, path: str, filename: str, caption: str) -> None:
+    """Move a finished output file into the job directory as its next part."""
+    stored = f"part{len(job['parts']) + 1:04d}"
+    shutil.move(path, os.path.join(job_dir(job), stored))
+    job["parts"].append({"file": stored, "filename": filename, "caption": caption})
+
+def save_job_hashes(job: Dict, hashes: Optional[np.ndarray]) -> None:
+    """Keep seen-corpus hashes so they are merged only after delivery completes."""
+    if hashes is not None:
+        np.save(os.path.join(job_dir(job), "seen.npy"), hashes)
+
+def save_job(job: Dict) -> None:
+    """Atomically write the job manifest."""
+    path = os.path.join(job_dir(job), "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(path + ".tmp", path)
+
+def discard_job(job: Dict) -> None:
+    """Remove a job directory and any parts left in it."""
+    shutil.rmtree(job_dir(job), ignore_errors=True)
+
+def load_jobs() -> List[Dict]:
+    """Return resumable jobs from a previous run, discarding stale or broken ones."""
+    jobs = []
+    if not os.path.isdir(JOBS_DIR):
+        return jobs
+    for job_id in sorted(os.listdir(JOBS_DIR)):
+        try:
+            with open(os.path.join(JOBS_DIR, job_id, "manifest.json"), encoding="utf-8") as f:
+                job = json.load(f)
+        except (OSError, ValueError):
+            # Crashed before the first checkpoint; there is nothing to resume. The
+            # owner is unknown, so under a dispatcher it clears these before workers start
+            if _worker_count == 1:
+                shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+            continue
+        if not owns_user(job["user_id"]):
+            continue
+        pending = job["parts"][job["delivered"]:]
+        if (job["resumes"] >= JOB_MAX_RESUMES or time.time() - job["created"] > JOB_MAX_AGE
+                or not all(os.path.exists(os.path.join(job_dir(job), p["file"])) for p in pending)):
+            discard_job(job)
+            continue
+        jobs.append(job)
+    return jobs
+
+def part_groups(job: Dict, parts: List[Dict]) -> Iterator[List[Dict]]:
+    """Group parts in order for sendMediaGroup, by count and by total size."""
+    group = []
+    size = 0
+    for part in parts:
+        part_size = os.path.getsize(os.path.join(job_dir(job), part["file"]))
+        if group and (len(group) == MEDIA_GROUP_SIZE or size + part_size > MEDIA_GROUP_MAX_BYTES):
+            yield group
+            group = []
+            size = 0
+        group.append(part)
+        size += part_size
+    if group:
+        yield group
+
+def mark_delivered(job: Dict, parts: List[Dict], progress: Optional[Progress] = None) -> None:
+    """Checkpoint sent parts and remove their files."""
+    job["delivered"] += len(parts)
+    save_job(job)
+    for part in parts:
+        os.unlink(os.path.join(job_dir(job), part["file"]))
+    advance_progress(progress, len(parts))
+
+async def send_parts_singly(bot, job: Dict, parts: List[Dict], progress: Optional[Progress] = None) -> None:
+    """Send parts one document at a time, checkpointing after each."""
+    for i, part in enumerate(parts):
+        if i:
+            await asyncio.sleep(PART_SEND_DELAY)  # Prevent rate limiting
+        with open(os.path.join(job_dir(job), part["file"]), "rb") as f:
+            await bot.send_document(
+                chat_id=job["chat_id"],
+                document=f,
+                filename=part["filename"],
+                caption=part["caption"],
+            )
+        mark_delivered(job, [part], progress)
+
+async def deliver_job(bot, job: Dict, progress: Optional[Progress] = None) -> None:
+    """Send a job's undelivered parts in order, checkpointing after each send.
+
+    Parts go out as media groups of up to MEDIA_GROUP_SIZE documents, each
+    keeping its own caption. A group Telegram rejects is sent again one
+    part at a time. Delivery is at-least-once: a crash between a send and
+    its checkpoint resends that part or group on resume.
+    """
+    pending = job["parts"][job["delivered"]:]
+    span_attrs(job=job["id"], parts=len(pending))
+    if progress is not None:
+        progress.start("Sending", len(pending), "files")
+    for i, group in enumerate(part_groups(job, pending)):
+        if i:
+            await asyncio.sleep(PART_SEND_DELAY)  # Prevent rate limiting
+        if len(group) == 1:
+            await send_parts_singly(bot, job, group, progress)
+            continue
+        try:
+            with ExitStack() as stack:
+                media = [
+                    InputMediaDocument(stack.enter_context(open(os.path.join(job_dir(job), part["file"]), "rb")),
+                                       caption=part["caption"], filename=part["filename"])
+                    for part in group
+                ]
+                await bot.send_media_group(chat_id=job["chat_id"], media=media)
+        except TelegramError as e:
+            logger.warning(f"Media group for job {job['id']} failed, sending its parts singly: {e}")
+            if isinstance(e, RetryAfter):
+                await asyncio.sleep(e.retry_after)
+            await send_parts_singly(bot, job, group, progress)
+            continue
+        mark_delivered(job, group, progress)
+    
+    hashes_path = os.path.join(job_dir(job), "seen.npy")
+    if os.path.exists(hashes_path):
+        await asyncio.to_thread(merge_corpus, job["user_id"], np.load(hashes_path))
+    discard_job(job)
+
+async def resume_job(bot, job: Dict) -> None:
+    """Tell the user delivery is resuming, then send the remaining parts."""
+    job["resumes"] += 1
+    save_job(job)
+    remaining = len(job["parts"]) - job["delivered"]
+    trace = JobTrace(f"resume_{job['kind']}", job["user_id"])
+    trace.activate()
+    status = "cancelled"
+    try:
+        await bot.send_message(
+            job["chat_id"],
+            f"↻ Bot restarted. Resuming delivery: {remaining} of {len(job['parts'])} file(s) left."
+        )
+        with trace.span("upload"):
+            await deliver_job(bot, job)
+        status = "done"
+    except Exception as e:
+        status = "failed"
+        logger.warning(f"Could not resume job {job['id']}: {e}")
+    finally:
+        trace.finish(status, resumes=job["resumes"])
+
+_resume_tasks: set = set()
+
+async def resume_jobs(application: Application) -> None:
+    """Resume delivery of every checkpointed job left by a previous run."""
+    for job in await asyncio.to_thread(load_jobs):
+        task = asyncio.create_task(resume_job(application.bot, job))
+        _resume_tasks.add(task)
+        task.add_done_callback(_resume_tasks.discard)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SESSION PERSISTENCE
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def file_reference(entry: Dict) -> Dict:
+    """Return an upload entry without its downloaded content."""
+    return {key: value for key, value in entry.items() if key != "content"}
+
+def session_references(user_data: Dict) -> Dict:
+    """Reduce user_data to the JSON-safe references needed to resume a session."""
+    refs = {key: user_data[key] for key in SESSION_KEYS if key in user_data}
+    if user_data.get("combine_files"):
+        refs["combine_files"] = [file_reference(entry) for entry in user_data["combine_files"]]
+    if user_data.get("split_file"):
+        refs["split_file"] = file_reference(user_data["split_file"])
+    if user_data.get("sample_file"):
+        refs["sample_file"] = file_reference(user_data["sample_file"])
+    if user_data.get("filter_file"):
+        refs["filter_file"] = file_reference(user_data["filter_file"])
+    return refs
+
+def restore_document(entry: Dict, bot) -> Document:
+    """Rebuild a downloadable Document from a stored upload reference."""
+    document = Document(entry["file_id"], entry["file_unique_id"], file_name=entry["name"],
+                        file_size=entry.get("size"))
+    document.set_bot(bot)
+    return document
+
+async def restore_contents(context: ContextTypes.DEFAULT_TYPE, user_id: int, entries: List[Dict]) -> None:
+    """Download again the content of entries restored from persistence."""
+    missing = [entry for entry in entries if "content" not in entry]
+    results = await asyncio.gather(
+        *(bounded_download(user_id, restore_document(entry, context.bot)) for entry in missing)
+    )
+    for entry, (content, _) in zip(missing, results):
+        entry["content"] = content
+
+class ReferencePersistence(BasePersistence):
+    """SQLite persistence for conversation states and upload references.
+
+    user_data is stored through session_references(), so flushes never
+    carry file contents, spools or message objects; restore_contents()
+    fetches uploads again by file_id when a resumed session needs them.
+    Unchanged snapshots are not rewritten. Under a dispatcher, each worker
+    loads only the sessions of users it owns. Queries run in order on one
+    database thread, so a database locked by another worker never stalls
+    the event loop.
+    """
+
+    def __init__(self, path: str = SESSION_DB, update_interval: float = SESSION_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")  # Worker processes share the file
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT, key TEXT, state INTEGER, PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data TEXT);
+        """)
+        self._written: Dict[int, str] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions-db")
+
+    def _execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        with self.db:
+            return self.db.execute(sql, params).fetchall()
+
+    async def execute(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        """Run one statement in its own transaction on the database thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._execute, sql, params)
+
+    async def get_user_data(self) -> Dict[int, Dict]:
+        rows = [row for row in await self.execute("SELECT user_id, data FROM user_data") if owns_user(row[0])]
+        self._written = dict(rows)
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def update_user_data(self, user_id: int, data: Dict) -> None:
+        refs = session_references(data)
+        if not refs:
+            await self.drop_user_data(user_id)
+            return
+        payload = json.dumps(refs, sort_keys=True)
+        if self._written.get(user_id) == payload:
+            return
+        await self.execute("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (user_id, payload))
+        self._written[user_id] = payload
+
+    async def drop_user_data(self, user_id: int) -> None:
+        if self._written.pop(user_id, None) is not None:
+            await self.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+
+    async def get_conversations(self, name: str) -> Dict:
+        rows = await self.execute("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        keys = ((tuple(json.loads(key)), state) for key, state in rows)
+        # Keys are (chat_id, user_id); other workers' users are not loaded
+        return {key: state for key, state in keys if owns_user(key[-1])}
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        if new_state is None:
+            await self.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, json.dumps(key)))
+        else:
+            await self.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)",
+                               (name, json.dumps(key), new_state))
+
+    async def flush(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.db.close)
+        self._executor.shutdown()
+
+    # Chat, bot and callback data are not used by this bot
+    async def get_chat_data(self) -> Dict[int, Dict]:
+        return {}
+
+    async def get_bot_data(self) -> Dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: Dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict) -> None:
+        pass
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              UI COMPONENTS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+HEADER = """
+╔══════════════════════════════════════╗
+║       FILE TOOLKIT BOT               ║
+║          Dev: Levetche               ║
+╚══════════════════════════════════════╝"""
+
+DIVIDER = "━" * 40
+
+# Telegram objects are immutable, so static keyboards are built once and shared
+@lru_cache(maxsize=None)
+def main_menu_keyboard() -> InlineKeyboardMarkup:
+    """Create main menu keyboard."""
+    keyboard = [
+        [
+            InlineKeyboardButton("◈ COMBINER ◈", callback_data="combine"),
+            InlineKeyboardButton("◈ SPLITTER ◈", callback_data="split"),
+        ],
+        [
+            InlineKeyboardButton("◈ MAKE TXT ◈", callback_data="maketxt"),
+            InlineKeyboardButton("◈ CSV→TXT ◈", callback_data="csvtotxt"),
+        ],
+        [
+            InlineKeyboardButton("◈ INTERSECT", callback_data="setop_intersect"),
+            InlineKeyboardButton("◈ SUBTRACT", callback_data="setop_subtract"),
+            InlineKeyboardButton("◈ XOR", callback_data="setop_xor"),
+        ],
+        [
+            InlineKeyboardButton("◈ SAMPLE ◈", callback_data="sample"),
+            InlineKeyboardButton("◈ FILTER ◈", callback_data="filter"),
+        ],
+        [
+            InlineKeyboardButton("▣ STATS", callback_data="stats"),
+            InlineKeyboardButton("▣ HELP", callback_data="help"),
+        ],
+        [InlineKeyboardButton("⚙ SETTINGS", callback_data="settings")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def back_keyboard() -> InlineKeyboardMarkup:
+    """Create back button keyboard."""
+    keyboard = [[InlineKeyboardButton("◄ BACK TO MENU", callback_data="menu")]]
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def combine_keyboard() -> InlineKeyboardMarkup:
+    """Create combiner action keyboard."""
+    keyboard = [
+        [InlineKeyboardButton("▶ COMBINE NOW", callback_data="do_combine")],
+        [InlineKeyboardButton("✕ CLEAR FILES", callback_data="clear_combine")],
+        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_combine")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def setop_keyboard(op: str) -> InlineKeyboardMarkup:
+    """Create set operation action keyboard."""
+    keyboard = [
+        [InlineKeyboardButton(f"▶ RUN {SET_OPERATIONS[op][0]}", callback_data="do_setop")],
+        [InlineKeyboardButton("✕ CLEAR FILES", callback_data="clear_setop")],
+        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_setop")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def setop_text(op: str, note: str = "") -> str:
+    """Render the start screen of a set operation."""
+    title, description = SET_OPERATIONS[op]
+    note = note or f"► {description}"
+    return f"""
+{HEADER}
+
+            {title}
+
+{DIVIDER}
+
+  {note}
+  ► Send 2 or more TXT/CSV files
+  ► Output: single TXT file
+
+  Files received: 0
+
+{DIVIDER}
+      Send your files below
+{DIVIDER}"""
+
+def collector_keyboard(user_data: Dict) -> InlineKeyboardMarkup:
+    """Return the action keyboard of the multi-file mode the session is in."""
+    if user_data.get("mode") == "setop":
+        return setop_keyboard(user_data["set_op"])
+    return combine_keyboard()
+
+@lru_cache(maxsize=None)
+def split_method_keyboard() -> InlineKeyboardMarkup:
+    """Create split method selection keyboard."""
+    keyboard = [
+        [InlineKeyboardButton("◈ BY MAX SIZE (KB)", callback_data="split_size")],
+        [InlineKeyboardButton("◈ BY NUMBER OF FILES", callback_data="split_count")],
+        [InlineKeyboardButton("◈ BY MAX LINES", callback_data="split_lines")],
+        [InlineKeyboardButton("◈ BALANCED BY BYTES", callback_data="split_bytes")],
+        [InlineKeyboardButton("◈ GROUPED BY KEY", callback_data="split_key")],
+        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+@lru_cache(maxsize=None)
+def sample_method_keyboard(dedupe: bool) -> InlineKeyboardMarkup:
+    """Create sample method selection keyboard."""
+    keyboard = [
+        [InlineKeyboardButton(f"◈ {title} N", callback_data=f"sample_{method}")]
+        for method, (title, _) in SAMPLE_METHODS.items()
+    ]
+    keyboard.append([InlineKeyboardButton(f"▣ DEDUPE FIRST: {'ON' if dedupe else 'OFF'}",
+                                          callback_data="sample_dedupe")])
+    keyboard.append([InlineKeyboardButton("◄ CANCEL", callback_data="cancel_sample")])
+    return InlineKeyboardMarkup(keyboard)
+
+def sample_method_text(file_data: Dict) -> str:
+    """Render the sample method screen for an uploaded file."""
+    return f"""
+{HEADER}
+
+             SAMPLE
+
+{DIVIDER}
+
+  ► File: {file_data['name'][:28]}
+  ► Size: {(file_data.get('size') or 0) / 1024:.1f} KB
+
+  ► HEAD   - first N lines
+  ► TAIL   - last N lines
+  ► RANDOM - N lines at random
+  ► DEDUPE FIRST drops repeated
+    lines before sampling
+
+{DIVIDER}
+       Select method below
+{DIVIDER}"""
+
+@lru_cache(maxsize=None)
+def filter_keyboard() -> InlineKeyboardMarkup:
+    """Create filter action keyboard."""
+    keyboard = [
+        [InlineKeyboardButton("▶ RUN FILTER", callback_data="do_filter")],
+        [InlineKeyboardButton("✕ CLEAR PATTERNS", callback_data="clear_filter")],
+        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_filter")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def filter_text(file_data: Dict, patterns: List[str], note: str = "") -> str:
+    """Render the filter pattern screen for an uploaded file."""
+    keep, drop = filter_pattern_count(parse_filter_patterns(patterns))
+    note = f"\n  {note}\n" if note else ""
+    return f"""
+{HEADER}
+
+             FILTER
+
+{DIVIDER}
+
+  ► File: {file_data['name'][:28]}
+  ► Size: {(file_data.get('size') or 0) / 1024:.1f} KB
+{note}
+  Send patterns, one per line:
+    gmail.com   keep lines with it
+    -test       drop lines with it
+    /^\\d+:/     keep regex matches
+    -/regex/    drop regex matches
+
+  Patterns: {keep} keep, {drop} drop
+
+{DIVIDER}
+   Send more or click RUN FILTER
+{DIVIDER}"""
+
+def settings_keyboard(settings: Dict) -> InlineKeyboardMarkup:
+    """Create settings keyboard showing the current values."""
+    keyboard = [
+        [InlineKeyboardButton(f"▣ OUTPUT: {settings['output_format'].upper()}", callback_data="set_output")],
+        [InlineKeyboardButton(f"▣ DUP REPORT: {'ON' if settings['dup_report'] else 'OFF'}", callback_data="set_report")],
+        [InlineKeyboardButton(f"▣ SORT + UNIQUE: {'ON' if settings['sort_unique'] else 'OFF'}", callback_data="set_sort")],
+        [InlineKeyboardButton(f"▣ NORMALIZE: {len(normalize_modes(settings))} ON", callback_data="normalize_menu")],
+        [
+            InlineKeyboardButton(f"▣ SEEN FILTER: {'ON' if settings['seen_filter'] else 'OFF'}", callback_data="set_seen"),
+            InlineKeyboardButton("✕ FORGET SEEN", callback_data="forget_seen"),
+        ],
+        [InlineKeyboardButton("◄ BACK TO MENU", callback_data="menu")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def normalize_keyboard(settings: Dict) -> InlineKeyboardMarkup:
+    """Create normalize-mode toggle keyboard."""
+    enabled = normalize_modes(settings)
+    keyboard = [
+        [InlineKeyboardButton(f"{'☑' if mode in enabled else '☐'} {label}", callback_data=f"set_norm_{mode}")]
+        for mode, label in NORMALIZE_MODES.items()
+    ]
+    keyboard.append([InlineKeyboardButton("◄ BACK", callback_data="settings")])
+    return InlineKeyboardMarkup(keyboard)
+
+def settings_text(settings: Dict, remembered: int = 0) -> str:
+    """Render the settings screen."""
+    return f"""
+{HEADER}
+
+            SETTINGS
+
+{DIVIDER}
+
+  ► Output: {settings['output_format'].upper()}
+    TXT, or compressed GZ/BZ2/XZ/ZIP
+    for combiner, splitter, CSV→TXT
+
+  ► Dup report: {'ON' if settings['dup_report'] else 'OFF'}
+    Most repeated lines and a
+    repeat histogram on completion
+
+  ► Sort + unique: {'ON' if settings['sort_unique'] else 'OFF'}
+    Output sorted A→Z instead of
+    in first-seen order
+
+  ► Normalize: {', '.join(NORMALIZE_MODES[m] for m in normalize_modes(settings)) or 'OFF'}
+    How lines are compared when
+    removing duplicates
+
+  ► Seen filter: {'ON' if settings['seen_filter'] else 'OFF'}
+    Drop lines delivered to you in
+    earlier jobs ({remembered} remembered)
+
+{DIVIDER}
+      Tap a setting to change it
+{DIVIDER}"""
+
+NORMALIZE_TEXT = f"""
+{HEADER}
+
+           NORMALIZE
+
+{DIVIDER}
+
+  Lines are compared after these
+  steps; the first original line
+  is kept in the output.
+
+  ► NFC      - unify Unicode forms
+  ► CASE     - ignore letter case
+  ► STRIP    - ignore edge spaces
+  ► COLLAPSE - squeeze inner spaces
+  ► DELIMS   - ignore trailing ,;:|
+
+{DIVIDER}
+       Tap to toggle a step
+{DIVIDER}"""
+
+def seen_line(settings: Dict, seen_removed: int) -> str:
+    """Render the COMPLETED line for the seen filter, if it is enabled."""
+    return f"\n  ► Previously seen: {seen_removed}" if settings.get("seen_filter") else ""
+
+@lru_cache(maxsize=None)
+def cancel_keyboard() -> InlineKeyboardMarkup:
+    """Create cancel keyboard."""
+    keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="menu")]]
+    return InlineKeyboardMarkup(keyboard)
+
+def job_cancel_keyboard(job_id: str) -> InlineKeyboardMarkup:
+    """Create the cancel keyboard kept on a running job's status message."""
+    keyboard = [[InlineKeyboardButton("✕ CANCEL", callback_data=f"cancel_job_{job_id}")]]
+    return InlineKeyboardMarkup(keyboard)
+
+CANCELLED_TEXT = f"""
+{HEADER}
+
+           CANCELLED
+
+{DIVIDER}
+
+  ► Processing stopped
+  ► Unsent files were discarded
+
+{DIVIDER}"""
+
+@lru_cache(maxsize=None)
+def maketxt_keyboard() -> InlineKeyboardMarkup:
+    """Create make txt action keyboard."""
+    keyboard = [
+        [InlineKeyboardButton("▶ CREATE TXT", callback_data="do_maketxt")],
+        [InlineKeyboardButton("✕ CLEAR LINES", callback_data="clear_maketxt")],
+        [InlineKeyboardButton("◄ CANCEL", callback_data="cancel_maketxt")],
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+# Static screens are formatted once at import
+
+MENU_TEXT = f"""
+{HEADER}
+
+            MAIN MENU
+
+{DIVIDER}
+
+  ◈ COMBINER - Merge files
+  ◈ SPLITTER - Split files
+  ◈ MAKE TXT - Text to file
+  ◈ CSV→TXT  - Convert CSV
+  ◈ SET OPS  - Compare files
+  ◈ SAMPLE   - Head, tail, random
+  ◈ FILTER   - Keep or drop lines
+
+{DIVIDER}
+      Select an option below
+{DIVIDER}"""
+
+HELP_TEXT = f"""
+{HEADER}
+
+           HELP GUIDE
+
+{DIVIDER}
+
+  ► COMBINER
+    1. Select COMBINER
+    2. Send multiple TXT/CSV files
+    3. Click COMBINE NOW
+    4. Receive merged TXT file
+
+  ► SPLITTER
+    1. Select SPLITTER
+    2. Send a TXT/CSV file
+    3. Choose split method
+    4. Enter the value
+    5. Receive split TXT files
+
+  ► MAKE TXT
+    1. Select MAKE TXT
+    2. Send text messages
+    3. Click CREATE TXT
+    4. Receive TXT file
+
+  ► CSV→TXT
+    1. Select CSV→TXT
+    2. Send a CSV file
+    3. Receive TXT file
+
+  ► INTERSECT / SUBTRACT / XOR
+    1. Select an operation
+    2. Send 2+ TXT/CSV files
+       (SUBTRACT: first file is A)
+    3. Click RUN
+    4. Receive the resulting lines
+
+  ► SAMPLE
+    1. Select SAMPLE
+    2. Send a TXT/CSV file
+    3. Choose HEAD, TAIL or RANDOM
+       (DEDUPE FIRST is optional)
+    4. Enter the number of lines
+
+  ► FILTER
+    1. Select FILTER
+    2. Send a TXT/CSV file
+    3. Send patterns, one per line:
+       text to keep, -text to drop,
+       /regex/ or -/regex/
+    4. Click RUN FILTER
+
+  ► COMMANDS
+    /start  - Main menu
+    /help   - This guide
+    /stats  - User statistics
+
+  ► NOTE
+    Duplicates removed automatically
+    Uploads may be .gz/.bz2/.xz/.zip
+    Output format is set in SETTINGS
+
+{DIVIDER}"""
+
+NO_USERS_TEXT = f"""
+{HEADER}
+
+         USER STATISTICS
+
+{DIVIDER}
+
+    No users registered yet
+
+{DIVIDER}"""
+
+COMBINE_START_TEXT = f"""
+{HEADER}
+
+            COMBINER
+
+{DIVIDER}
+
+  ► Send TXT or CSV files
+  ► Files will be merged by lines
+  ► Output: single TXT file
+
+  Files received: 0
+
+{DIVIDER}
+      Send your files below
+{DIVIDER}"""
+
+COMBINE_CLEARED_TEXT = f"""
+{HEADER}
+
+            COMBINER
+
+{DIVIDER}
+
+  ► Files cleared!
+  ► Send new TXT or CSV files
+
+  Files received: 0
+
+{DIVIDER}
+      Send your files below
+{DIVIDER}"""
+
+SPLIT_START_TEXT = f"""
+{HEADER}
+
+            SPLITTER
+
+{DIVIDER}
+
+  ► Send a TXT or CSV file
+  ► Choose split method
+  ► Output: multiple TXT files
+
+  Waiting for file...
+
+{DIVIDER}
+       Send your file below
+{DIVIDER}"""
+
+SPLIT_METHOD_TEXT = f"""
+{HEADER}
+
+            SPLITTER
+
+{DIVIDER}
+
+  ► File received!
+  ► Choose split method below
+
+{DIVIDER}
+      Select split method
+{DIVIDER}"""
+
+MAKETXT_START_TEXT = f"""
+{HEADER}
+
+            MAKE TXT
+
+{DIVIDER}
+
+  ► Send text messages
+  ► Each message = one line
+  ► Duplicates auto-removed
+
+  Lines received: 0
+
+{DIVIDER}
+       Send your text below
+{DIVIDER}"""
+
+MAKETXT_CLEARED_TEXT = f"""
+{HEADER}
+
+            MAKE TXT
+
+{DIVIDER}
+
+  ► Lines cleared!
+  ► Send new text messages
+
+  Lines received: 0
+
+{DIVIDER}
+       Send your text below
+{DIVIDER}"""
+
+CSVTOTXT_START_TEXT = f"""
+{HEADER}
+
+           CSV → TXT
+
+{DIVIDER}
+
+  ► Send a CSV file
+  ► Converts to TXT format
+  ► Duplicates auto-removed
+
+  Waiting for file...
+
+{DIVIDER}
+     Send your CSV file below
+{DIVIDER}"""
+
+SAMPLE_START_TEXT = f"""
+{HEADER}
+
+             SAMPLE
+
+{DIVIDER}
+
+  ► Send a TXT or CSV file
+  ► Take the first, last or
+    random N lines
+  ► Output: single TXT file
+
+  Waiting for file...
+
+{DIVIDER}
+       Send your file below
+{DIVIDER}"""
+
+FILTER_START_TEXT = f"""
+{HEADER}
+
+             FILTER
+
+{DIVIDER}
+
+  ► Send a TXT or CSV file
+  ► Then send patterns to keep
+    or drop lines
+  ► Output: single TXT file
+
+  Waiting for file...
+
+{DIVIDER}
+       Send your file below
+{DIVIDER}"""
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              COMMAND HANDLERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle /start command."""
+    user = update.effective_user
+    register_user(user)
+    
+    welcome_text = f"""
+{HEADER}
+
+  Welcome, {user.first_name}!
+
+{DIVIDER}
+
+  ◈ COMBINER
+    Merge multiple TXT/CSV files
+    into a single TXT file
+
+  ◈ SPLITTER
+    Split large TXT/CSV files
+    by size, count, or lines
+
+  ◈ MAKE TXT
+    Convert text messages to TXT
+
+  ◈ CSV→TXT
+    Convert CSV file to TXT
+
+  ◈ INTERSECT / SUBTRACT / XOR
+    Compare lists of lines
+
+  ◈ SAMPLE
+    First, last or random N lines
+
+  ◈ FILTER
+    Keep or drop lines by text
+    or regex patterns
+
+{DIVIDER}
+      Select an option below
+{DIVIDER}"""
+    
+    # Clear any previous session data
+    reset_session(context)
+    
+    await update.message.reply_text(
+        welcome_text,
+        reply_markup=main_menu_keyboard(),
+        parse_mode=None
+    )
+    return ConversationHandler.END
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /help command."""
+    register_user(update.effective_user)
+    
+    await update.message.reply_text(HELP_TEXT, reply_markup=back_keyboard())
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /stats command."""
+    register_user(update.effective_user)
+    await show_stats(update, context)
+
+async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Display user statistics."""
+    users = load_users()
+    total_users = len(users)
+    
+    if total_users == 0:
+        stats_text = NO_USERS_TEXT
+    else:
+        user_list = ""
+        for idx, (uid, data) in enumerate(users.items(), 1):
+            name = f"{data.get('first_name', '')} {data.get('last_name', '')}".strip()
+            username = data.get('username', '')
+            username_display = f"@{username}" if username else "[no username]"
+            user_list += f"  {idx:03d}. {name[:15]:<15} {username_display}\n"
+        
+        stats_text = f"""
+{HEADER}
+
+         USER STATISTICS
+
+{DIVIDER}
+  Total Users: {total_users}
+{DIVIDER}
+
+{user_list}
+{DIVIDER}"""
+    
+    if update.callback_query:
+        await update.callback_query.edit_message_text(
+            stats_text,
+            reply_markup=back_keyboard()
+        )
+    else:
+        await update.message.reply_text(stats_text, reply_markup=back_keyboard())
+
+async def memory_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /memory [user_id|job]: recent job memory profiles, admins only."""
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    
+    jobs = list(_memory_jobs)
+    if context.args:
+        wanted = context.args[0]
+        jobs = [job for job in jobs if wanted in (str(job["user_id"]), job["job"])]
+    
+    rss, rss_peak = read_rss()
+    job_lines = ""
+    for job in jobs[-5:]:
+        stages = " ".join(f"{name}={format_mb(stage['peak'])}" for name, stage in job["stages"].items())
+        job_lines += (
+            f"  {job['time'][11:]} {job['job']} u{job['user_id']}\n"
+            f"    rss {format_mb(job['rss_before'])}→{format_mb(job['rss_after'])}"
+            f" session {format_mb(job['user_data_bytes'])}\n"
+            f"    {stages}\n"
+        )
+    
+    memory_text = f"""
+{HEADER}
+
+         MEMORY PROFILE
+
+{DIVIDER}
+  Profiling: {'ON' if MEMORY_PROFILING else 'OFF (set MEMORY_PROFILING=1)'}
+  RSS: {format_mb(rss)}  Peak: {format_mb(rss_peak)}
+  Jobs recorded: {len(jobs)}
+{DIVIDER}
+
+{job_lines or "  No jobs recorded yet"}
+{DIVIDER}"""
+    
+    await update.message.reply_text(memory_text)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              CALLBACK HANDLERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle button callbacks."""
+    query = update.callback_query
+    await query.answer()
+    
+    register_user(update.effective_user)
+    data = query.data
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # MENU NAVIGATION
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    if data == "menu":
+        reset_session(context)
+        await query.edit_message_text(MENU_TEXT, reply_markup=main_menu_keyboard())
+        return ConversationHandler.END
+    
+    elif data == "help":
+        await query.edit_message_text(HELP_TEXT, reply_markup=back_keyboard())
+        return ConversationHandler.END
+    
+    elif data == "stats":
+        await show_stats(update, context)
+        return ConversationHandler.END
+    
+    elif data == "settings":
+        settings = get_settings(update.effective_user.id)
+        await query.edit_message_text(
+            settings_text(settings, corpus_size(update.effective_user.id)),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    elif data == "set_output":
+        current = get_settings(update.effective_user.id)["output_format"]
+        next_format = OUTPUT_FORMATS[(OUTPUT_FORMATS.index(current) + 1) % len(OUTPUT_FORMATS)]
+        settings = update_settings(update.effective_user.id, output_format=next_format)
+        await query.edit_message_text(
+            settings_text(settings, corpus_size(update.effective_user.id)),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    elif data == "normalize_menu":
+        settings = get_settings(update.effective_user.id)
+        await query.edit_message_text(NORMALIZE_TEXT, reply_markup=normalize_keyboard(settings))
+        return ConversationHandler.END
+    
+    elif data.startswith("set_norm_"):
+        mode = data.replace("set_norm_", "")
+        enabled = set(normalize_modes(get_settings(update.effective_user.id)))
+        enabled ^= {mode}
+        settings = update_settings(update.effective_user.id, normalize=sorted(enabled))
+        await query.edit_message_text(NORMALIZE_TEXT, reply_markup=normalize_keyboard(settings))
+        return ConversationHandler.END
+    
+    elif data == "set_seen":
+        current = get_settings(update.effective_user.id)["seen_filter"]
+        settings = update_settings(update.effective_user.id, seen_filter=not current)
+        await query.edit_message_text(
+            settings_text(settings, corpus_size(update.effective_user.id)),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    elif data == "forget_seen":
+        forget_corpus(update.effective_user.id)
+        settings = get_settings(update.effective_user.id)
+        await query.edit_message_text(
+            settings_text(settings),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    elif data == "set_report":
+        current = get_settings(update.effective_user.id)["dup_report"]
+        settings = update_settings(update.effective_user.id, dup_report=not current)
+        await query.edit_message_text(
+            settings_text(settings, corpus_size(update.effective_user.id)),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    elif data == "set_sort":
+        current = get_settings(update.effective_user.id)["sort_unique"]
+        settings = update_settings(update.effective_user.id, sort_unique=not current)
+        await query.edit_message_text(
+            settings_text(settings, corpus_size(update.effective_user.id)),
+            reply_markup=settings_keyboard(settings)
+        )
+        return ConversationHandler.END
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # RUNNING JOBS
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data.startswith("cancel_job_"):
+        # A finished job already replaced its CANCEL button, so a miss is a late tap
+        if await cancel_job(data.replace("cancel_job_", ""), update.effective_user.id):
+            await query.edit_message_text(CANCELLED_TEXT, reply_markup=back_keyboard())
+        return None  # Leave any operation the user started meanwhile untouched
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # COMBINER
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "combine":
+        context.user_data["combine_files"] = []
+        context.user_data["mode"] = "combine"
+        context.user_data["session_id"] = uuid.uuid4().hex
+        
+        await query.edit_message_text(COMBINE_START_TEXT, reply_markup=combine_keyboard())
+        return COMBINE_WAITING
+    
+    elif data == "do_combine":
+        files = context.user_data.get("combine_files", [])
+        if context.user_data.get("pending_albums"):
+            await query.answer("Files are still downloading, please wait!", show_alert=True)
+            return COMBINE_WAITING
+        if len(files) < 2:
+            await query.answer("Please send at least 2 files to combine!", show_alert=True)
+            return COMBINE_WAITING
+        
+        await do_combine_files(update, context)
+        return ConversationHandler.END
+    
+    elif data == "clear_combine":
+        context.user_data["combine_files"] = []
+        await query.edit_message_text(COMBINE_CLEARED_TEXT, reply_markup=combine_keyboard())
+        return COMBINE_WAITING
+    
+    elif data == "cancel_combine":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # SET OPERATIONS
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data.startswith("setop_"):
+        op = data.replace("setop_", "")
+        reset_session(context)
+        context.user_data["combine_files"] = []
+        context.user_data["mode"] = "setop"
+        context.user_data["set_op"] = op
+        context.user_data["session_id"] = uuid.uuid4().hex
+        await query.edit_message_text(setop_text(op), reply_markup=setop_keyboard(op))
+        return SETOP_WAITING
+    
+    elif data == "do_setop":
+        files = context.user_data.get("combine_files", [])
+        if context.user_data.get("pending_albums"):
+            await query.answer("Files are still downloading, please wait!", show_alert=True)
+            return SETOP_WAITING
+        if len(files) < 2:
+            await query.answer("Please send at least 2 files!", show_alert=True)
+            return SETOP_WAITING
+        
+        await do_set_operation(update, context)
+        return ConversationHandler.END
+    
+    elif data == "clear_setop":
+        context.user_data["combine_files"] = []
+        op = context.user_data["set_op"]
+        await query.edit_message_text(setop_text(op, "► Files cleared!"), reply_markup=setop_keyboard(op))
+        return SETOP_WAITING
+    
+    elif data == "cancel_setop":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # SPLITTER
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "split":
+        context.user_data["mode"] = "split"
+        context.user_data["split_file"] = None
+        
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
+        await query.edit_message_text(SPLIT_START_TEXT, reply_markup=InlineKeyboardMarkup(keyboard))
+        return SPLIT_WAITING
+    
+    elif data == "cancel_split":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    elif data.startswith("split_") and data != "split_method_back":
+        method = data.replace("split_", "")
+        context.user_data["split_method"] = method
+        
+        method_names = {
+            "size": "MAX SIZE (KB)",
+            "count": "NUMBER OF FILES",
+            "lines": "MAX LINES PER FILE",
+            "bytes": "FILES BALANCED BY BYTES",
+            "key": "FILES GROUPED BY KEY"
+        }
+        
+        prompts = {
+            "size": "Enter maximum size per file in KB:",
+            "count": f"Enter number of files to split into (max {MAX_SPLIT_PARTS}):",
+            "lines": "Enter maximum lines per file:",
+            "bytes": f"Enter number of files to split into (max {MAX_SPLIT_PARTS}):",
+            "key": (
+                f"Enter number of files (max {MAX_SPLIT_PARTS}) and key:\n"
+                "    4 f1 :   field 1, split on ':'\n"
+                "    4 f2 ,   field 2 of a CSV\n"
+                "    8 p3     first 3 characters"
+            )
+        }
+        
+        value_text = f"""
+{HEADER}
+
+            SPLITTER
+
+{DIVIDER}
+
+  Method: {method_names[method]}
+
+  {prompts[method]}
+
+{DIVIDER}
+       Type {'files and key' if method == 'key' else 'a number'} below
+{DIVIDER}"""
+        
+        keyboard = [[InlineKeyboardButton("◄ BACK", callback_data="split_method_back")]]
+        await query.edit_message_text(value_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        return SPLIT_VALUE
+    
+    elif data == "split_method_back":
+        await query.edit_message_text(SPLIT_METHOD_TEXT, reply_markup=split_method_keyboard())
+        return SPLIT_METHOD
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # MAKE TXT
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "maketxt":
+        reset_session(context)
+        context.user_data["maketxt_spool"] = new_spool(get_settings(update.effective_user.id))
+        context.user_data["mode"] = "maketxt"
+        
+        await query.edit_message_text(MAKETXT_START_TEXT, reply_markup=maketxt_keyboard())
+        return MAKETXT_WAITING
+    
+    elif data == "do_maketxt":
+        spool = context.user_data.get("maketxt_spool")
+        if spool is None or spool.unique < 1:
+            await query.answer("Please send at least 1 line of text!", show_alert=True)
+            return MAKETXT_WAITING
+        
+        await do_maketxt(update, context)
+        return ConversationHandler.END
+    
+    elif data == "clear_maketxt":
+        if "maketxt_spool" in context.user_data:
+            context.user_data["maketxt_spool"].close()
+        context.user_data["maketxt_spool"] = new_spool(get_settings(update.effective_user.id))
+        await query.edit_message_text(MAKETXT_CLEARED_TEXT, reply_markup=maketxt_keyboard())
+        return MAKETXT_WAITING
+    
+    elif data == "cancel_maketxt":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # CSV TO TXT
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "csvtotxt":
+        context.user_data["mode"] = "csvtotxt"
+        
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
+        await query.edit_message_text(CSVTOTXT_START_TEXT, reply_markup=InlineKeyboardMarkup(keyboard))
+        return CSVTOTXT_WAITING
+    
+    elif data == "cancel_csvtotxt":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # SAMPLE
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "sample":
+        reset_session(context)
+        context.user_data["mode"] = "sample"
+        context.user_data["sample_dedupe"] = False
+        
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_sample")]]
+        await query.edit_message_text(SAMPLE_START_TEXT, reply_markup=InlineKeyboardMarkup(keyboard))
+        return SAMPLE_WAITING
+    
+    elif data == "cancel_sample":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    elif data in ("sample_dedupe", "sample_method_back"):
+        file_data = context.user_data.get("sample_file")
+        if not file_data:
+            return await button_callback_menu(update, context)
+        if data == "sample_dedupe":
+            context.user_data["sample_dedupe"] = not context.user_data.get("sample_dedupe")
+        await query.edit_message_text(sample_method_text(file_data),
+                                      reply_markup=sample_method_keyboard(context.user_data["sample_dedupe"]))
+        return SAMPLE_METHOD
+    
+    elif data.startswith("sample_"):
+        method = data.replace("sample_", "")
+        context.user_data["sample_method"] = method
+        title, description = SAMPLE_METHODS[method]
+        dedupe = "ON" if context.user_data.get("sample_dedupe") else "OFF"
+        
+        value_text = f"""
+{HEADER}
+
+             SAMPLE
+
+{DIVIDER}
+
+  Method: {title} - {description}
+  Dedupe first: {dedupe}
+
+  Enter number of lines (N):
+
+{DIVIDER}
+        Type a number below
+{DIVIDER}"""
+        
+        keyboard = [[InlineKeyboardButton("◄ BACK", callback_data="sample_method_back")]]
+        await query.edit_message_text(value_text, reply_markup=InlineKeyboardMarkup(keyboard))
+        return SAMPLE_VALUE
+    
+    # ─────────────────────────────────────────────────────────────────────────
+    # FILTER
+    # ─────────────────────────────────────────────────────────────────────────
+    
+    elif data == "filter":
+        reset_session(context)
+        context.user_data["mode"] = "filter"
+        context.user_data["filter_patterns"] = []
+        
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_filter")]]
+        await query.edit_message_text(FILTER_START_TEXT, reply_markup=InlineKeyboardMarkup(keyboard))
+        return FILTER_WAITING
+    
+    elif data == "do_filter":
+        if not context.user_data.get("filter_file"):
+            return await button_callback_menu(update, context)
+        if not context.user_data.get("filter_patterns"):
+            await query.answer("Please send at least 1 pattern!", show_alert=True)
+            return FILTER_PATTERNS
+        
+        await do_filter(update, context)
+        return ConversationHandler.END
+    
+    elif data == "clear_filter":
+        file_data = context.user_data.get("filter_file")
+        if not file_data:
+            return await button_callback_menu(update, context)
+        context.user_data["filter_patterns"] = []
+        await query.edit_message_text(filter_text(file_data, [], "► Patterns cleared!"),
+                                      reply_markup=filter_keyboard())
+        return FILTER_PATTERNS
+    
+    elif data == "cancel_filter":
+        reset_session(context)
+        return await button_callback_menu(update, context)
+    
+    return ConversationHandler.END
+
+async def button_callback_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Return to main menu."""
+    query = update.callback_query
+    reset_session(context)
+    
+    await query.edit_message_text(MENU_TEXT, reply_markup=main_menu_keyboard())
+    return ConversationHandler.END
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              OUTPUT JOBS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def run_output_job(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, action: str, params: Dict,
+                   uploads: List[Dict], produce: Callable[..., Awaitable[Optional[Dict]]],
+                   stream: bool = False) -> None:
+    """Start a cancellable job that produces output files, checkpoints them and delivers them.
+
+    The uploads are restored into memory first or, with stream, the single
+    upload is downloaded to a temporary file instead. produce(settings,
+    profile, progress, edit, path) runs in a scheduler slot and returns
+    {"parts": [(path, filename, caption)], "summary", "report", "hashes"}
+    for the COMPLETED screen, or None after reporting a failure itself.
+    """
+    query = update.callback_query
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    session = dict(context.user_data)
+    profile = job_profile(context, kind, user_id)
+    # The job owns the uploads now, so the session is free for the next operation
+    reset_session(context)
+    
+    async def run(job_id: str, progress: Progress) -> None:
+        if query:
+            edit = partial(query.edit_message_text, reply_markup=job_cancel_keyboard(job_id))
+            await edit(processing_text(action, "▶ Running"))
+        else:
+            status_msg = await update.message.reply_text(processing_text(action, "▶ Running"),
+                                                         reply_markup=job_cancel_keyboard(job_id))
+            edit = partial(status_msg.edit_text, reply_markup=job_cancel_keyboard(job_id))
+        
+        settings = get_settings(user_id)
+        path = None
+        if stream:
+            document = restore_document(uploads[0], context.bot)
+            path = await download_for_job(user_id, document, edit, action, profile, progress)
+            if path is None:
+                return
+        else:
+            # Sessions restored after a restart hold only file references
+            try:
+                await restore_contents(context, user_id, uploads)
+            except Exception:
+                await edit("⚠ Could not fetch your files again. Please start over.", reply_markup=back_keyboard())
+                return
+        
+        cost = sum(f.get("size") or len(f.get("content", "")) for f in uploads)
+        try:
+            async with job_slot(user_id, cost, edit, action, progress):
+                output = await produce(settings, profile, progress, edit, path)
+        finally:
+            if path is not None:
+                os.unlink(path)
+        if output is None:
+            return
+        
+        # Checkpoint every part so a restart resumes delivery from the first unsent one
+        output_format = settings["output_format"]
+        job = create_job(kind, chat_id, user_id, {**params, "output_format": output_format})
+        for part_path, filename, caption in output["parts"]:
+            add_job_part(job, part_path, filename, caption)
+        save_job_hashes(job, output.get("hashes"))
+        save_job(job)
+        
+        try:
+            with profile.stage("upload"):
+                sending = "Sending parts..." if len(job["parts"]) > 1 else "Sending file..."
+                async with progress_updates(edit, sending, progress):
+                    await deliver_job(context.bot, job, progress)
+        except (asyncio.CancelledError, JobCancelled):
+            discard_job(job)
+            raise
+        
+        result_text = f"""
+{HEADER}
+
+           COMPLETED
+
+{DIVIDER}
+
+{output["summary"]}
+  ► Output format: {output_format.upper()}
+{output.get("report", "")}
+{DIVIDER}"""
+        
+        await edit(result_text, reply_markup=back_keyboard())
+        profile.finish(session)
+    
+    start_job(update, context, run, profile)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              FILE HANDLERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+async def handle_combine_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle file upload for combining or a set operation."""
+    document = update.message.document
+    state = SETOP_WAITING if context.user_data.get("mode") == "setop" else COMBINE_WAITING
+    
+    if not document:
+        await update.message.reply_text("Please send a valid file.")
+        return state
+    
+    if not is_supported_upload(document.file_name):
+        await update.message.reply_text(
+            "⚠ Only TXT and CSV files are supported!\n  (plain or .gz/.bz2/.xz/.zip)",
+            reply_markup=collector_keyboard(context.user_data)
+        )
+        return state
+    
+    # Check file size (Telegram bot API limit is 20MB)
+    if document.file_size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text(
+            "⚠ File too large! Maximum size is 20MB.",
+            reply_markup=collector_keyboard(context.user_data)
+        )
+        return state
+    
+    # Albums are collected and downloaded together once complete
+    if update.message.media_group_id:
+        collect_album_file(update, context)
+        return state
+    
+    # Download and decompress file
+    try:
+        profile = job_profile(context, "combine", update.effective_user.id)
+        content, _ = await download_with_status(update.message, update.effective_user.id, document, profile=profile)
+    except ValueError:
+        await update.message.reply_text(
+            f"⚠ Decompressed file too large! Maximum is {MAX_TEXT_BYTES >> 20}MB.",
+            reply_markup=collector_keyboard(context.user_data)
+        )
+        return state
+    except Exception as e:
+        await update.message.reply_text(
+            "⚠ Failed to download file. Try a smaller file.",
+            reply_markup=collector_keyboard(context.user_data)
+        )
+        return state
+    
+    if "combine_files" not in context.user_data:
+        context.user_data["combine_files"] = []
+    
+    context.user_data["combine_files"].append({
+        "name": document.file_name,
+        "file_id": document.file_id,
+        "file_unique_id": document.file_unique_id,
+        "size": document.file_size,
+        "content": content
+    })
+    
+    await send_combine_status(update.message, context)
+    return state
+
+def collect_album_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Queue one file of a media group; the first file starts the album task."""
+    group_id = update.message.media_group_id
+    albums = context.user_data.setdefault("pending_albums", {})
+    if group_id not in albums:
+        # Each combine or set session gets a new id, so a later session never matches this album
+        session_id = context.user_data.setdefault("session_id", uuid.uuid4().hex)
+        albums[group_id] = {"messages": [], "last": 0.0, "session_id": session_id}
+        context.application.create_task(
+            process_album(context, group_id, update.effective_user.id), update=update
+        )
+    albums[group_id]["messages"].append(update.message)
+    albums[group_id]["last"] = time.monotonic()
+
+async def process_album(context: ContextTypes.DEFAULT_TYPE, group_id: str, user_id: int) -> None:
+    """Download a complete album concurrently and add its files in message order."""
+    user_data = context.user_data
+    album = user_data["pending_albums"][group_id]
+    # Telegram delivers album parts as separate updates; wait until they stop
+    while True:
+        delay = album["last"] + MEDIA_GROUP_WAIT - time.monotonic()
+        if delay <= 0:
+            break
+        await asyncio.sleep(delay)
+    
+    messages = sorted(album["messages"], key=lambda m: m.message_id)
+    profile = job_profile(context, "combine", user_id)
+    results = await asyncio.gather(
+        *(bounded_download(user_id, m.document, profile=profile) for m in messages),
+        return_exceptions=True
+    )
+    user_data.get("pending_albums", {}).pop(group_id, None)
+    if user_data.get("session_id") != album["session_id"] or user_data.get("mode") not in ("combine", "setop"):
+        return  # session ended while downloading, perhaps replaced by a new one
+    
+    failed = []
+    for message, result in zip(messages, results):
+        if isinstance(result, BaseException):
+            failed.append(message.document.file_name)
+            continue
+        user_data.setdefault("combine_files", []).append({
+            "name": message.document.file_name,
+            "file_id": message.document.file_id,
+            "file_unique_id": message.document.file_unique_id,
+            "size": message.document.file_size,
+            "content": result[0]
+        })
+    
+    if failed:
+        await messages[-1].reply_text(
+            "⚠ Failed to download:\n" + "\n".join(f"  {name[:30]}" for name in failed)
+        )
+    await send_combine_status(messages[-1], context)
+
+async def send_combine_status(message, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Replace the combiner or set operation status message with an up-to-date file list."""
+    # Delete previous status message if exists
+    if "combine_status_msg" in context.user_data:
+        try:
+            await context.user_data["combine_status_msg"].delete()
+        except Exception:
+            pass
+    
+    count = len(context.user_data.get("combine_files", []))
+    file_list = "\n".join([f"  {i+1}. {f['name'][:30]}" 
+                           for i, f in enumerate(context.user_data.get("combine_files", []))])
+    
+    title, button = "COMBINER", "COMBINE"
+    if context.user_data.get("mode") == "setop":
+        title = button = SET_OPERATIONS[context.user_data["set_op"]][0]
+    
+    status_text = f"""
+{HEADER}
+
+            {title}
+
+{DIVIDER}
+  Files received: {count}
+{DIVIDER}
+
+{file_list}
+
+{DIVIDER}
+   Send more files or click {button}
+{DIVIDER}"""
+    
+    # Send new status and store reference
+    status_msg = await message.reply_text(status_text, reply_markup=collector_keyboard(context.user_data))
+    context.user_data["combine_status_msg"] = status_msg
+
+async def do_combine_files(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Combine all uploaded files in a cancellable job."""
+    user_id = update.effective_user.id
+    files = context.user_data.get("combine_files", [])
+    
+    async def produce(settings: Dict, profile: JobProfile, progress: Progress, edit, path) -> Dict:
+        # Combine files and remove duplicates
+        sketch = new_sketch(settings)
+        output_format = settings["output_format"]
+        contents = [f["content"] for f in files]
+        if settings["sort_unique"] and uses_external_sort(contents, sketch):
+            # Sorted key ranges stream from disk into the output file
+            with profile.stage("sort"):
+                progress.start("Sorting")
+                tmp_path, total_input, unique_count, seen_removed, new_hashes = await asyncio.to_thread(
+                    write_sorted_unique, user_id, settings, contents, output_format, "combined_output.txt", progress
+                )
+                line_count = unique_count - seen_removed
+                dupes_removed = total_input - unique_count
+                span_attrs(lines_in=total_input, lines_out=line_count, seen_removed=seen_removed,
+                           bytes=os.path.getsize(tmp_path))
+        else:
+            with profile.stage("dedupe"):
+                progress.start("Removing duplicates")
+                dedupe = sort_dedupe if settings["sort_unique"] else combine_dedupe
+                unique_lines, total_input = await asyncio.to_thread(
+                    dedupe, contents, sketch, normalize_modes(settings), progress
+                )
+                dupes_removed = total_input - len(unique_lines)
+                unique_lines, seen_removed, new_hashes = await asyncio.to_thread(
+                    apply_seen_filter, user_id, settings, unique_lines
+                )
+                line_count = len(unique_lines)
+                span_attrs(lines_in=total_input, lines_out=line_count, seen_removed=seen_removed)
+            
+            # Create temporary file
+            with profile.stage("write"):
+                progress.start("Writing", line_count, "lines")
+                tmp_path = await asyncio.to_thread(
+                    write_output_file, iter_line_blocks(unique_lines), output_format, "combined_output.txt", progress
+                )
+                span_attrs(lines=line_count, bytes=os.path.getsize(tmp_path))
+        
+        return {
+            "parts": [(tmp_path, output_filename("combined_output", output_format), "► Combined file ready!")],
+            "summary": f"""  ► Files combined: {len(files)}
+  ► Total lines: {line_count}
+  ► Duplicates removed: {dupes_removed}{seen_line(settings, seen_removed)}""",
+            "report": duplicate_report_text(sketch) if sketch else "",
+            "hashes": new_hashes,
+        }
+    
+    run_output_job(update, context, "combine", f"Combining {len(files)} files...",
+                   {"sources": [f["file_id"] for f in files]}, files, produce)
+
+async def do_set_operation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Run the session's set operation over the uploaded files in a cancellable job."""
+    user_id = update.effective_user.id
+    files = context.user_data.get("combine_files", [])
+    op = context.user_data["set_op"]
+    title = SET_OPERATIONS[op][0]
+    
+    async def produce(settings: Dict, profile: JobProfile, progress: Progress, edit, path) -> Dict:
+        output_format = settings["output_format"]
+        with profile.stage("setop"):
+            progress.start("Comparing files")
+            result_lines = await asyncio.to_thread(
+                set_operation, op, [f["content"] for f in files], normalize_modes(settings), progress
+            )
+            result_lines, seen_removed, new_hashes = await asyncio.to_thread(
+                apply_seen_filter, user_id, settings, result_lines
+            )
+            span_attrs(files=len(files), lines_out=len(result_lines), seen_removed=seen_removed)
+        
+        with profile.stage("write"):
+            progress.start("Writing", len(result_lines), "lines")
+            tmp_path = await asyncio.to_thread(
+                write_output_file, iter_line_blocks(result_lines), output_format, f"{op}_output.txt", progress
+            )
+            span_attrs(lines=len(result_lines), bytes=os.path.getsize(tmp_path))
+        
+        return {
+            "parts": [(tmp_path, output_filename(f"{op}_output", output_format), f"► {title} result ready!")],
+            "summary": f"""  ► Operation: {title}
+  ► Files compared: {len(files)}
+  ► Result lines: {len(result_lines)}{seen_line(settings, seen_removed)}""",
+            "hashes": new_hashes,
+        }
+    
+    run_output_job(update, context, "setop", f"{title.capitalize()}: {len(files)} files...",
+                   {"op": op, "sources": [f["file_id"] for f in files]}, files, produce)
+
+async def handle_split_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle file upload for splitting."""
+    document = update.message.document
+    
+    if not document:
+        await update.message.reply_text("Please send a valid file.")
+        return SPLIT_WAITING
+    
+    if not is_supported_upload(document.file_name):
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
+        await update.message.reply_text(
+            "⚠ Only TXT and CSV files are supported!\n  (plain or .gz/.bz2/.xz/.zip)",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SPLIT_WAITING
+    
+    # Check file size (Telegram bot API limit is 20MB)
+    if document.file_size > MAX_UPLOAD_BYTES:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
+        await update.message.reply_text(
+            "⚠ File too large! Maximum size is 20MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SPLIT_WAITING
+    
+    # Download and decompress file
+    try:
+        profile = job_profile(context, "split", update.effective_user.id)
+        content, size = await download_with_status(update.message, update.effective_user.id, document, profile=profile)
+    except ValueError:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
+        await update.message.reply_text(
+            f"⚠ Decompressed file too large! Maximum is {MAX_TEXT_BYTES >> 20}MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SPLIT_WAITING
+    except Exception as e:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_split")]]
+        await update.message.reply_text(
+            "⚠ Failed to download file. Try a smaller file.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SPLIT_WAITING
+    
+    context.user_data["split_file"] = {
+        "name": document.file_name,
+        "file_id": document.file_id,
+        "file_unique_id": document.file_unique_id,
+        "size": document.file_size,
+        "content": content
+    }
+    
+    lines = content.count('\n') + 1
+    size_kb = size / 1024
+    
+    split_text = f"""
+{HEADER}
+
+            SPLITTER
+
+{DIVIDER}
+
+  ► File: {document.file_name[:28]}
+  ► Size: {size_kb:.1f} KB
+  ► Lines: {lines}
+
+  Choose split method:
+
+{DIVIDER}
+       Select method below
+{DIVIDER}"""
+    
+    await update.message.reply_text(split_text, reply_markup=split_method_keyboard())
+    return SPLIT_METHOD
+
+async def handle_split_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle split value input."""
+    method = context.user_data.get("split_method")
+    key_func = None
+    try:
+        if method == "key":
+            value, key_func = parse_key_spec(update.message.text)
+        else:
+            value = int(update.message.text.strip())
+        if value <= 0:
+            raise ValueError("Value must be positive")
+    except (ValueError, IndexError):
+        if method == "key":
+            await update.message.reply_text("⚠ Use: <files> f<field> [delimiter] or <files> p<chars>")
+        else:
+            await update.message.reply_text("⚠ Please enter a valid positive number!")
+        return SPLIT_VALUE
+    
+    if method in PART_COUNT_METHODS and value > MAX_SPLIT_PARTS:
+        await update.message.reply_text(f"⚠ At most {MAX_SPLIT_PARTS} files! Please enter a smaller number.")
+        return SPLIT_VALUE
+    
+    file_data = context.user_data.get("split_file")
+    
+    if not file_data:
+        await update.message.reply_text("⚠ No file found. Please start over.", reply_markup=back_keyboard())
+        return ConversationHandler.END
+    
+    user_id = update.effective_user.id
+    value_text = update.message.text.strip()
+    
+    async def produce(settings: Dict, profile: JobProfile, progress: Progress, edit, path) -> Dict:
+        sketch = new_sketch(settings)
+        output_format = settings["output_format"]
+        base_name = upload_base_name(file_data["name"])
+        
+        # Remove duplicates while preserving order
+        with profile.stage("dedupe"):
+            progress.start("Removing duplicates")
+            unique_lines, total_input = await asyncio.to_thread(
+                dedupe_content, file_data["content"], settings, sketch, progress
+            )
+            dupes_removed = total_input - len(unique_lines)
+            unique_lines, seen_removed, new_hashes = await asyncio.to_thread(
+                apply_seen_filter, user_id, settings, unique_lines
+            )
+            span_attrs(lines_in=total_input, lines_out=len(unique_lines), seen_removed=seen_removed)
+        
+        with profile.stage("split"):
+            # More files than lines would only add empty parts
+            parts = min(value, max(1, len(unique_lines))) if method in PART_COUNT_METHODS else value
+            part_files = await asyncio.to_thread(
+                split_into_files, unique_lines, method, parts, key_func, output_format, base_name, progress
+            )
+            span_attrs(parts=len(part_files), bytes=sum(os.path.getsize(part) for _, part in part_files))
+        total_parts = parts if method == "key" else len(part_files)
+        
+        return {
+            "parts": [(tmp_path, output_filename(f"{base_name}_part{i:03d}", output_format),
+                       f"► Part {i} of {total_parts}") for i, tmp_path in part_files],
+            "summary": f"""  ► Files created: {len(part_files)}
+  ► Duplicates removed: {dupes_removed}{seen_line(settings, seen_removed)}""",
+            "report": duplicate_report_text(sketch) if sketch else "",
+            "hashes": new_hashes,
+        }
+    
+    run_output_job(update, context, "split", "Splitting file...",
+                   {"source": file_data["file_id"], "method": method, "value": value_text}, [file_data], produce)
+    return ConversationHandler.END
+
+async def handle_maketxt_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle text message for Make TXT."""
+    text = update.message.text.strip()
+    
+    if not text:
+        await update.message.reply_text("Please send some text.")
+        return MAKETXT_WAITING
+    
+    if "maketxt_spool" not in context.user_data:
+        context.user_data["maketxt_spool"] = new_spool(get_settings(update.effective_user.id))
+    
+    # Add each line from the message, deduped on arrival
+    spool = context.user_data["maketxt_spool"]
+    with job_profile(context, "maketxt", update.effective_user.id).stage("dedupe"):
+        await asyncio.to_thread(spool.add, text.splitlines())
+    
+    preview = "\n".join([f"  {line[:34]}" for line in spool.recent])  # Show last 5 lines
+    
+    status_text = f"""
+{HEADER}
+
+            MAKE TXT
+
+{DIVIDER}
+  Unique lines: {spool.unique}
+  Duplicates skipped: {spool.duplicates}
+{DIVIDER}
+  Last lines:
+{preview}
+{DIVIDER}
+   Send more or click CREATE TXT
+{DIVIDER}"""
+    
+    await update.message.reply_text(status_text, reply_markup=maketxt_keyboard())
+    return MAKETXT_WAITING
+
+async def do_maketxt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create TXT file from collected lines in a cancellable job."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    session = dict(context.user_data)
+    spool = context.user_data.pop("maketxt_spool")
+    profile = job_profile(context, "maketxt", user_id)
+    action = "Creating TXT file..."
+    # The job owns the spool now, so the session is free for the next operation
+    reset_session(context)
+    
+    async def run(job_id: str, progress: Progress) -> None:
+        edit = partial(query.edit_message_text, reply_markup=job_cancel_keyboard(job_id))
+        await edit(processing_text(action, "▶ Running"))
+        try:
+            # Lines were deduped on arrival, so the spool file is the output
+            async with job_slot(user_id, spool.size, edit, action, progress):
+                with profile.stage("write"):
+                    progress.start("Writing")
+                    tmp_path = await asyncio.to_thread(spool.finalize)
+                    span_attrs(lines=spool.unique, bytes=os.path.getsize(tmp_path))
+            report = duplicate_report_text(spool.sketch) if spool.sketch else ""
+            
+            with profile.stage("upload"), open(tmp_path, 'rb') as f:
+                await edit(processing_text(action, "▶ Sending"))
+                await query.message.reply_document(
+                    document=f,
+                    filename="output.txt",
+                    caption="► TXT file ready!"
+                )
+        finally:
+            # Removes the spool file, sent or not
+            spool.close()
+        
+        result_text = f"""
+{HEADER}
+
+           COMPLETED
+
+{DIVIDER}
+
+  ► Total lines: {spool.unique}
+  ► Duplicates removed: {spool.duplicates}
+  ► Output format: TXT
+{report}
+{DIVIDER}"""
+        
+        await query.edit_message_text(result_text, reply_markup=back_keyboard())
+        profile.finish(session)
+    
+    start_job(update, context, run, profile)
+
+async def handle_csvtotxt_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle CSV file upload for conversion to TXT."""
+    document = update.message.document
+    
+    if not document:
+        await update.message.reply_text("Please send a valid file.")
+        return CSVTOTXT_WAITING
+    
+    if not is_supported_upload(document.file_name, (".csv",)):
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
+        await update.message.reply_text(
+            "⚠ Only CSV files are supported!\n  (plain or .gz/.bz2/.xz/.zip)",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return CSVTOTXT_WAITING
+    
+    # Check file size (Telegram bot API limit is 20MB)
+    if document.file_size > MAX_UPLOAD_BYTES:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
+        await update.message.reply_text(
+            "⚠ File too large! Maximum size is 20MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return CSVTOTXT_WAITING
+    
+    # Download and decompress file
+    try:
+        profile = job_profile(context, "csvtotxt", update.effective_user.id)
+        content, _ = await download_with_status(update.message, update.effective_user.id, document, (".csv",), profile)
+    except ValueError:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
+        await update.message.reply_text(
+            f"⚠ Decompressed file too large! Maximum is {MAX_TEXT_BYTES >> 20}MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return CSVTOTXT_WAITING
+    except Exception as e:
+        keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_csvtotxt")]]
+        await update.message.reply_text(
+            "⚠ Failed to download file. Try a smaller file.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return CSVTOTXT_WAITING
+    
+    user_id = update.effective_user.id
+    session = dict(context.user_data)
+    action = "Converting CSV to TXT..."
+    reset_session(context)
+    
+    async def run(job_id: str, progress: Progress) -> None:
+        status_msg = await update.message.reply_text(processing_text(action, "▶ Running"),
+                                                     reply_markup=job_cancel_keyboard(job_id))
+        edit = partial(status_msg.edit_text, reply_markup=job_cancel_keyboard(job_id))
+        
+        settings = get_settings(user_id)
+        sketch = new_sketch(settings)
+        base_name = upload_base_name(document.file_name)
+        output_format = settings["output_format"]
+        async with job_slot(user_id, document.file_size or len(content), edit, action, progress):
+            # Remove duplicates while preserving order
+            with profile.stage("dedupe"):
+                progress.start("Removing duplicates")
+                unique_lines, total_input = await asyncio.to_thread(
+                    dedupe_content, content, settings, sketch, progress
+                )
+                report = duplicate_report_text(sketch) if sketch else ""
+                
+                dupes_removed = total_input - len(unique_lines)
+                unique_lines, seen_removed, new_hashes = await asyncio.to_thread(
+                    apply_seen_filter, user_id, settings, unique_lines
+                )
+                span_attrs(lines_in=total_input, lines_out=len(unique_lines), seen_removed=seen_removed)
+            
+            # Create temporary file
+            with profile.stage("write"):
+                progress.start("Writing", len(unique_lines), "lines")
+                tmp_path = await asyncio.to_thread(
+                    write_output_file, iter_line_blocks(unique_lines), output_format, f"{base_name}.txt", progress
+                )
+                span_attrs(lines=len(unique_lines), bytes=os.path.getsize(tmp_path))
+        
+        try:
+            with profile.stage("upload"), open(tmp_path, 'rb') as f:
+                await edit(processing_text(action, "▶ Sending"))
+                await update.message.reply_document(
+                    document=f,
+                    filename=output_filename(base_name, output_format),
+                    caption="► TXT file ready!"
+                )
+        finally:
+            os.unlink(tmp_path)
+        
+        if new_hashes is not None:
+            await asyncio.to_thread(merge_corpus, user_id, new_hashes)
+        
+        result_text = f"""
+{HEADER}
+
+           COMPLETED
+
+{DIVIDER}
+
+  ► Total lines: {len(unique_lines)}
+  ► Duplicates removed: {dupes_removed}{seen_line(settings, seen_removed)}
+  ► Output format: {output_format.upper()}
+{report}
+{DIVIDER}"""
+        
+        await status_msg.edit_text(result_text, reply_markup=back_keyboard())
+        profile.finish(session)
+    
+    start_job(update, context, run, profile)
+    return ConversationHandler.END
+
+async def handle_sample_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle file upload for sampling; the job streams it later."""
+    document = update.message.document
+    
+    if not document:
+        await update.message.reply_text("Please send a valid file.")
+        return SAMPLE_WAITING
+    
+    keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_sample")]]
+    if not is_supported_upload(document.file_name):
+        await update.message.reply_text(
+            "⚠ Only TXT and CSV files are supported!\n  (plain or .gz/.bz2/.xz/.zip)",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SAMPLE_WAITING
+    
+    # Check file size (Telegram bot API limit is 20MB)
+    if document.file_size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text(
+            "⚠ File too large! Maximum size is 20MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return SAMPLE_WAITING
+    
+    # Only the reference is kept: the job downloads and samples the file in one pass
+    context.user_data["sample_file"] = {
+        "name": document.file_name,
+        "file_id": document.file_id,
+        "file_unique_id": document.file_unique_id,
+        "size": document.file_size,
+    }
+    
+    await update.message.reply_text(
+        sample_method_text(context.user_data["sample_file"]),
+        reply_markup=sample_method_keyboard(context.user_data.get("sample_dedupe", False))
+    )
+    return SAMPLE_METHOD
+
+async def handle_sample_value(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle the sample size input and start the sampling job."""
+    try:
+        count = int(update.message.text.strip())
+        if count <= 0:
+            raise ValueError("Value must be positive")
+    except ValueError:
+        await update.message.reply_text("⚠ Please enter a valid positive number!")
+        return SAMPLE_VALUE
+    
+    file_data = context.user_data.get("sample_file")
+    
+    if not file_data:
+        await update.message.reply_text("⚠ No file found. Please start over.", reply_markup=back_keyboard())
+        return ConversationHandler.END
+    
+    method = context.user_data["sample_method"]
+    dedupe = bool(context.user_data.get("sample_dedupe"))
+    title = SAMPLE_METHODS[method][0]
+    
+    async def produce(settings: Dict, profile: JobProfile, progress: Progress, edit, path) -> Optional[Dict]:
+        output_format = settings["output_format"]
+        base_name = upload_base_name(file_data["name"])
+        with profile.stage("sample"):
+            progress.start("Sampling")
+            try:
+                sample, lines_read = await asyncio.to_thread(
+                    sample_upload, path, file_data["name"], method, count, dedupe, normalize_modes(settings), progress
+                )
+            except ValueError:
+                await edit(f"⚠ Decompressed file too large! Maximum is {MAX_DECOMPRESSED_BYTES >> 20}MB.",
+                           reply_markup=back_keyboard())
+                return None
+            span_attrs(lines_in=lines_read, lines_out=len(sample))
+        
+        with profile.stage("write"):
+            progress.start("Writing", len(sample), "lines")
+            tmp_path = await asyncio.to_thread(
+                write_output_file, iter_line_blocks(sample), output_format, f"{base_name}_{method}.txt", progress
+            )
+            span_attrs(lines=len(sample), bytes=os.path.getsize(tmp_path))
+        
+        return {
+            "parts": [(tmp_path, output_filename(f"{base_name}_{method}", output_format),
+                       f"► {title} {len(sample)} lines ready!")],
+            "summary": f"""  ► Method: {title} {count}
+  ► Dedupe first: {'ON' if dedupe else 'OFF'}
+  ► Lines read: {lines_read}
+  ► Lines sampled: {len(sample)}""",
+        }
+    
+    params = {"source": file_data["file_id"], "method": method, "count": count, "dedupe": dedupe}
+    run_output_job(update, context, "sample", f"Sampling {title.lower()} {count} lines...", params,
+                   [file_data], produce, stream=True)
+    return ConversationHandler.END
+
+async def handle_filter_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle file upload for filtering; the job streams it later."""
+    document = update.message.document
+    
+    if not document:
+        await update.message.reply_text("Please send a valid file.")
+        return FILTER_WAITING
+    
+    keyboard = [[InlineKeyboardButton("◄ CANCEL", callback_data="cancel_filter")]]
+    if not is_supported_upload(document.file_name):
+        await update.message.reply_text(
+            "⚠ Only TXT and CSV files are supported!\n  (plain or .gz/.bz2/.xz/.zip)",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return FILTER_WAITING
+    
+    # Check file size (Telegram bot API limit is 20MB)
+    if document.file_size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text(
+            "⚠ File too large! Maximum size is 20MB.",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return FILTER_WAITING
+    
+    # Only the reference is kept: the job downloads and filters the file in one pass
+    context.user_data["filter_file"] = {
+        "name": document.file_name,
+        "file_id": document.file_id,
+        "file_unique_id": document.file_unique_id,
+        "size": document.file_size,
+    }
+    patterns = context.user_data.setdefault("filter_patterns", [])
+    
+    await update.message.reply_text(filter_text(context.user_data["filter_file"], patterns),
+                                    reply_markup=filter_keyboard())
+    return FILTER_PATTERNS
+
+async def handle_filter_patterns(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handle a message of filter patterns, one per line."""
+    file_data = context.user_data.get("filter_file")
+    
+    if not file_data:
+        await update.message.reply_text("⚠ No file found. Please start over.", reply_markup=back_keyboard())
+        return ConversationHandler.END
+    
+    patterns = context.user_data.setdefault("filter_patterns", [])
+    new_patterns = [line.strip() for line in update.message.text.splitlines() if line.strip()]
+    try:
+        # Compile the whole set now so a bad pattern is reported before the job runs
+        compile_filter(parse_filter_patterns(patterns + new_patterns))
+    except (ValueError, re.error) as e:
+        await update.message.reply_text(f"⚠ {e}\n  Nothing from this message was added.")
+        return FILTER_PATTERNS
+    
+    if len(patterns) + len(new_patterns) > MAX_FILTER_PATTERNS:
+        await update.message.reply_text(f"⚠ At most {MAX_FILTER_PATTERNS} patterns per filter.")
+        return FILTER_PATTERNS
+    
+    patterns.extend(new_patterns)
+    await update.message.reply_text(filter_text(file_data, patterns), reply_markup=filter_keyboard())
+    return FILTER_PATTERNS
+
+async def do_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Filter the session's upload by its patterns in a cancellable job."""
+    user_id = update.effective_user.id
+    file_data = context.user_data["filter_file"]
+    patterns = context.user_data["filter_patterns"]
+    spec = parse_filter_patterns(patterns)
+    keep, drop = filter_pattern_count(spec)
+    
+    async def produce(settings: Dict, profile: JobProfile, progress: Progress, edit, path) -> Optional[Dict]:
+        output_format = settings["output_format"]
+        base_name = upload_base_name(file_data["name"])
+        with profile.stage("filter"):
+            progress.start("Filtering")
+            try:
+                kept, lines_read = await asyncio.to_thread(
+                    filter_upload, path, file_data["name"], spec, normalize_modes(settings), progress
+                )
+            except ValueError:
+                await edit(f"⚠ Decompressed file too large! Maximum is {MAX_DECOMPRESSED_BYTES >> 20}MB.",
+                           reply_markup=back_keyboard())
+                return None
+            except FilterTimeout:
+                await edit("⚠ Your patterns are too slow to match! Simplify the regexes and try again.",
+                           reply_markup=back_keyboard())
+                return None
+            kept, seen_removed, new_hashes = await asyncio.to_thread(apply_seen_filter, user_id, settings, kept)
+            span_attrs(lines_in=lines_read, lines_out=len(kept), seen_removed=seen_removed)
+        
+        with profile.stage("write"):
+            progress.start("Writing", len(kept), "lines")
+            tmp_path = await asyncio.to_thread(
+                write_output_file, iter_line_blocks(kept), output_format, f"{base_name}_filtered.txt", progress
+            )
+            span_attrs(lines=len(kept), bytes=os.path.getsize(tmp_path))
+        
+        return {
+            "parts": [(tmp_path, output_filename(f"{base_name}_filtered", output_format),
+                       f"► {len(kept)} matching lines ready!")],
+            "summary": f"""  ► Patterns: {keep} keep, {drop} drop
+  ► Lines read: {lines_read}
+  ► Lines kept: {len(kept)}{seen_line(settings, seen_removed)}""",
+            "hashes": new_hashes,
+        }
+    
+    run_output_job(update, context, "filter", f"Filtering by {keep + drop} patterns...",
+                   {"source": file_data["file_id"], "patterns": patterns}, [file_data], produce, stream=True)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              FALLBACK HANDLERS
+# ═══════════════════════════════════════════════════════════════════════════════
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Cancel current operation."""
+    reset_session(context)
+    await update.message.reply_text(
+        "Operation cancelled. Use /start to begin again.",
+        reply_markup=back_keyboard()
+    )
+    return ConversationHandler.END
+
+async def unknown_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle unexpected files."""
+    register_user(update.effective_user)
+    await update.message.reply_text(
+        "Use /start to access the menu and select COMBINER or SPLITTER first.",
+        reply_markup=back_keyboard()
+    )
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              HTTP TRANSPORT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+def transfer_timeout(size: int) -> float:
+    """Return a read/write timeout that grows with the transferred size."""
+    return TRANSFER_BASE_TIMEOUT + size / TRANSFER_MIN_RATE
+
+@lru_cache(maxsize=None)
+def shared_ssl_context() -> ssl.SSLContext:
+    """Return the TLS context shared by all HTTP clients.
+
+    Loading the CA bundle is the slowest step of building a client, so it
+    is done once instead of once per client at start-up.
+    """
+    return httpx.create_ssl_context()
+
+class KeepAliveHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest that keeps idle connections open for KEEPALIVE_EXPIRY seconds."""
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = self._client_kwargs["limits"]
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        self._client_kwargs["verify"] = shared_ssl_context()
+        return super()._build_client()
+
+    async def stream_to_file(self, url: str, path: str, on_chunk: Callable[[int], None], read_timeout: float) -> None:
+        """Stream a GET response body to path, calling on_chunk with each chunk's size."""
+        base = self._client.timeout
+        timeout = httpx.Timeout(connect=base.connect, read=read_timeout, write=base.write, pool=base.pool)
+        async with self._client.stream("GET", url, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(path, "wb") as out:
+                async for chunk in response.aiter_bytes(IO_CHUNK_BYTES):
+                    out.write(chunk)
+                    on_chunk(len(chunk))
+
+class RoutingRequest(BaseRequest):
+    """Route file transfers and Bot API control calls to separate HTTP clients.
+
+    Downloads (GET) and document uploads go to a large transfer pool with
+    size-scaled timeouts, so they can never starve getUpdates-adjacent
+    calls such as editMessageText, which keep a small, fast pool.
+    """
+
+    def __init__(self, control: BaseRequest, transfer: BaseRequest):
+        self.control = control
+        self.transfer = transfer
+
+    async def initialize(self) -> None:
+        await self.control.initialize()
+        await self.transfer.initialize()
+
+    async def shutdown(self) -> None:
+        await self.control.shutdown()
+        await self.transfer.shutdown()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        active = _active_span.get()
+        if active is None:
+            return await self.route(url, method, request_data, read_timeout, write_timeout, connect_timeout,
+                                    pool_timeout)
+        # The URL carries the bot token, so spans are named by API method only
+        api_method = url.rsplit("/", 1)[-1] if method != "GET" else "download"
+        with active[0].span(f"api.{api_method}"):
+            if request_data is not None and request_data.contains_files:
+                span_attrs(upload_bytes=sum(len(part[1]) for part in request_data.multipart_data.values()))
+            code, payload = await self.route(url, method, request_data, read_timeout, write_timeout,
+                                             connect_timeout, pool_timeout)
+            span_attrs(status=code, response_bytes=len(payload))
+            return code, payload
+
+    async def route(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        """Send the request through the control or the transfer client."""
+        if method != "GET" and url.rsplit("/", 1)[-1] not in TRANSFER_METHODS:
+            return await self.control.do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        size = 0
+        if request_data is not None:
+            size = sum(len(part[1]) for part in request_data.multipart_data.values())
+        scaled = transfer_timeout(size)
+        # Explicit timeouts are only ever raised; defaults fall to the transfer pool's own
+        default = type(BaseRequest.DEFAULT_NONE)
+        if not isinstance(write_timeout, default) and write_timeout is not None:
+            write_timeout = max(write_timeout, scaled)
+        if not isinstance(read_timeout, default) and read_timeout is not None:
+            read_timeout = max(read_timeout, scaled)
+        return await self.transfer.do_request(
+            url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+        )
+
+def build_request() -> RoutingRequest:
+    """Create the routed request object used for all non-getUpdates calls."""
+    control = KeepAliveHTTPXRequest(
+        connection_pool_size=CONTROL_POOL_SIZE,
+        read_timeout=CONTROL_TIMEOUT,
+        write_timeout=CONTROL_TIMEOUT,
+        connect_timeout=5.0,
+        pool_timeout=1.0,
+    )
+    transfer = KeepAliveHTTPXRequest(
+        connection_pool_size=TRANSFER_POOL_SIZE,
+        read_timeout=TRANSFER_BASE_TIMEOUT,
+        write_timeout=TRANSFER_BASE_TIMEOUT,
+        connect_timeout=10.0,
+        pool_timeout=30.0,
+        http_version=TRANSFER_HTTP_VERSION,
+    )
+    return RoutingRequest(control, transfer)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              SCALE-OUT
+# ═══════════════════════════════════════════════════════════════════════════════
+
+# This process's place among the workers; a single process owns every user
+_worker_index = 0
+_worker_count = 1
+
+def worker_for(user_id: int, workers: int) -> int:
+    """Return the worker that owns a user.
+
+    crc32, unlike hash(), agrees across processes and restarts, so a user
+    keeps their worker for as long as the worker count stays the same.
+    """
+    return zlib.crc32(str(user_id).encode()) % workers
+
+def owns_user(user_id: int) -> bool:
+    """Whether this process handles the user's updates, jobs and sessions."""
+    return _worker_count == 1 or worker_for(user_id, _worker_count) == _worker_index
+
+def update_worker(update: Update, workers: int) -> int:
+    """Route an update by its user, falling back to its chat."""
+    if update.effective_user is not None:
+        return worker_for(update.effective_user.id, workers)
+    if update.effective_chat is not None:
+        return worker_for(update.effective_chat.id, workers)
+    return 0
+
+def worker_log_path(path: str) -> str:
+    """Give each worker its own copy of an append-only log; rotation is not safe across processes."""
+    if _worker_count == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.worker{_worker_index}{ext}"
+
+def worker_main(index: int, workers: int, inbox) -> None:
+    """Worker process entry point: run the bot on the updates the dispatcher routes here."""
+    global _worker_index, _worker_count
+    _worker_index, _worker_count = index, workers
+    # Ctrl+C reaches the whole process group; the dispatcher stops workers through their inbox
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if MEMORY_PROFILING:
+        tracemalloc.start()
+    asyncio.run(serve_inbox(inbox))
+
+async def serve_inbox(inbox) -> None:
+    """Run the application without polling, feeding it updates from inbox until None arrives."""
+    application = build_application()
+    async with application:
+        await application.post_init(application)
+        await application.start()
+        while True:
+            data = await asyncio.to_thread(inbox.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+        # Waits for running jobs, then writes sessions out
+        await application.stop()
+
+def stop_workers(processes: List[multiprocessing.Process]) -> None:
+    """Wait for workers to finish their jobs, terminating any still running after WORKER_STOP_TIMEOUT."""
+    deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            logger.warning(f"{process.name} did not stop in time; terminating it")
+            process.terminate()
+            process.join()
+
+async def run_dispatcher(workers: int) -> None:
+    """Poll for updates and hand each one to the worker process that owns its user.
+
+    Each worker runs the full application, so a user's conversation state,
+    album collection and running jobs stay in one process. Workers share
+    the user registry and sessions through SQLite, and job checkpoints and
+    seen corpora through the working directory.
+    """
+    # Workers only resume their own users' jobs; clear ownerless leftovers first
+    await asyncio.to_thread(load_jobs)
+    # A fresh interpreter per worker; forking a process with a running event loop is unsafe
+    spawn = multiprocessing.get_context("spawn")
+    inboxes = [spawn.Queue() for _ in range(workers)]
+    processes = [spawn.Process(target=worker_main, args=(i, workers, inbox), name=f"worker-{i}")
+                 for i, inbox in enumerate(inboxes)]
+    for process in processes:
+        process.start()
+    
+    bot = Bot(BOT_TOKEN, base_url=BOT_API_URL, base_file_url=BOT_API_FILE_URL,
+              request=KeepAliveHTTPXRequest(), get_updates_request=KeepAliveHTTPXRequest())
+    updates: asyncio.Queue = asyncio.Queue()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    def forward(update: Update) -> None:
+        inboxes[update_worker(update, workers)].put(update.to_dict())
+    
+    async def route() -> None:
+        while True:
+            forward(await updates.get())
+    
+    try:
+        async with Updater(bot, updates) as updater:
+            await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            router = asyncio.create_task(route())
+            await stop.wait()
+            await updater.stop()
+            router.cancel()
+            while not updates.empty():
+                forward(updates.get_nowait())
+    finally:
+        for inbox in inboxes:
+            inbox.put(None)
+        await asyncio.to_thread(stop_workers, processes)
+
+# ═══════════════════════════════════════════════════════════════════════════════
+#                              MAIN APPLICATION
+# ═══════════════════════════════════════════════════════════════════════════════
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle errors gracefully."""
+    logger.error(f"Exception: {context.error}", exc_info=context.error)
+    
+    if update and update.effective_message:
+        await update.effective_message.reply_text(
+            "⚠ An error occurred. Please try again or use /start to restart.",
+            reply_markup=back_keyboard()
+        )
+
+def build_application() -> Application:
+    """Create the application with all handlers registered."""
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(BOT_API_URL)
+        .base_file_url(BOT_API_FILE_URL)
+        .request(build_request())
+        .get_updates_request(KeepAliveHTTPXRequest())
+        .persistence(ReferencePersistence())
+        .post_init(resume_jobs)
+        .build()
+    )
+    
+    # Conversation handler for file operations
+    conv_handler = ConversationHandler(
+        entry_points=[
+            CommandHandler("start", start_command),
+            CallbackQueryHandler(button_callback),
+        ],
+        states={
+            COMBINE_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_combine_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            SPLIT_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_split_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            SPLIT_METHOD: [
+                CallbackQueryHandler(button_callback),
+            ],
+            SPLIT_VALUE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_split_value),
+                CallbackQueryHandler(button_callback),
+            ],
+            MAKETXT_WAITING: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_maketxt_text),
+                CallbackQueryHandler(button_callback),
+            ],
+            CSVTOTXT_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_csvtotxt_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            SETOP_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_combine_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            SAMPLE_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_sample_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            SAMPLE_METHOD: [
+                CallbackQueryHandler(button_callback),
+            ],
+            SAMPLE_VALUE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_sample_value),
+                CallbackQueryHandler(button_callback),
+            ],
+            FILTER_WAITING: [
+                MessageHandler(filters.Document.ALL, handle_filter_file),
+                CallbackQueryHandler(button_callback),
+            ],
+            FILTER_PATTERNS: [
+                # A message opening with a /regex/ pattern reads as a command; real commands are not patterns
+                MessageHandler(filters.TEXT & (~filters.COMMAND | filters.Regex(re.compile(r"\A/.+/[ \t]*$", re.M))),
+                               handle_filter_patterns),
+                CallbackQueryHandler(button_callback),
+            ],
+        },
+        fallbacks=[
+            CommandHandler("start", start_command),
+            CommandHandler("cancel", cancel),
+            CallbackQueryHandler(button_callback),
+        ],
+        per_user=True,
+        per_chat=True,
+        per_message=False,
+        name="file_ops",
+        persistent=True,
+    )
+    
+    application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("memory", memory_command))
+    application.add_handler(MessageHandler(filters.Document.ALL, unknown_file))
+    application.add_error_handler(error_handler)
+    return application
+
+def main() -> None:
+    """Run the bot, as one process or as a dispatcher with BOT_WORKERS workers."""
+    if BOT_WORKERS > 1:
+        print("═" * 50)
+        print(f"  FILE TOOLKIT BOT - RUNNING ({BOT_WORKERS} WORKERS)")
+        print("═" * 50)
+        asyncio.run(run_dispatcher(BOT_WORKERS))
+        return
+    
+    if MEMORY_PROFILING:
+        tracemalloc.start()
+    application = build_application()
+    
+    # Start polling
+    print("═" * 50)
+    print("  FILE TOOLKIT BOT - RUNNING")
+    print("═" * 50)
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""DuplicateSketch: top duplicates and the repeat histogram."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def feed(sketch, lines, modes=()):
+    return main.dedupe_lines(lines, sketch, modes)
+
+
+def test_top_lists_repeated_lines_most_frequent_first():
+    sketch = main.DuplicateSketch()
+    feed(sketch, ["a"] * 5 + ["b"] * 3 + ["c"] * 2 + ["d"])
+    assert sketch.top() == [("a", 5), ("b", 3), ("c", 2)]
+    assert sketch.total == 11
+
+
+def test_top_is_limited_to_k():
+    sketch = main.DuplicateSketch()
+    feed(sketch, [f"line{i}" for i in range(20) for _ in range(i + 2)])
+    top = sketch.top(3)
+    assert [line for line, _ in top] == ["line19", "line18", "line17"]
+
+
+def test_histogram_counts_distinct_lines_per_repeat_bucket():
+    # Buckets: 2x, 3-5x, 6-10x, 11-100x, 101x+
+    sketch = main.DuplicateSketch()
+    counts = {"two": 2, "four": 4, "five": 5, "seven": 7, "fifty": 50, "many": 150, "once": 1}
+    feed(sketch, [line for line, n in counts.items() for _ in range(n)])
+    assert sketch.histogram == [1, 2, 1, 1, 1]
+
+
+def test_heavy_hitters_survive_eviction():
+    sketch = main.DuplicateSketch(capacity=8)
+    lines = []
+    for i in range(2000):
+        lines.append(f"noise{i}")
+        if i % 4 == 0:
+            lines.append("hot")
+    feed(sketch, lines)
+    assert len(sketch.counts) <= 8
+    assert sketch.top(1)[0][0] == "hot"
+    assert sketch.top(1)[0][1] >= 500
+
+
+def test_report_shows_the_uploaded_line_under_normalize_modes():
+    sketch = main.DuplicateSketch()
+    unique = feed(sketch, ["  Alice ", "alice", "ALICE", "bob", "Bob"], modes=("case", "strip"))
+    assert unique == ["  Alice ", "bob"]
+    assert sketch.top() == [("  Alice ", 3), ("bob", 2)]
+    assert "  Alice " in main.duplicate_report_text(sketch)
+
+
+def test_evicted_keys_drop_their_original_line():
+    sketch = main.DuplicateSketch(capacity=2)
+    feed(sketch, [f"Key{i}" for i in range(50)], modes=("case",))
+    assert set(sketch.originals) <= set(sketch.counts)
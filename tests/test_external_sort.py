@@ -0,0 +1,83 @@
+"""External merge sort: same lines, same order as the in-memory sorted dedupe."""
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def small_runs(monkeypatch, tmp_path):
+    # Tiny chunks and ranges so short inputs make many runs and key ranges
+    monkeypatch.setattr(main, "SORT_CHUNK_CHARS", 256)
+    monkeypatch.setattr(main, "SORT_RANGE_CHARS", 1024)
+    monkeypatch.setattr(main, "CORPUS_DIR", str(tmp_path / "corpus"))
+
+
+def make_contents(files, lines, seed=4):
+    rng = random.Random(seed)
+    return ["\n".join(rng.choice(["", " ", "X"]) + f"user{rng.randrange(lines // 2)}é" for _ in range(lines)) + "\n"
+            for _ in range(files)]
+
+
+def in_memory(contents, modes=()):
+    return main.sort_dedupe(contents, modes=modes)
+
+
+def external(contents, workdir, workers=3, modes=()):
+    range_paths, unique, total = main.external_sort_unique(contents, str(workdir), workers, modes)
+    lines = [line for path in range_paths for line in main.read_range(path)]
+    assert unique == len(lines)
+    return lines, total
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("modes", [(), ("case", "strip")])
+def test_matches_in_memory_sort(tmp_path, workers, modes):
+    contents = make_contents(3, 1500)
+    assert external(contents, tmp_path, workers, modes) == in_memory(contents, modes)
+
+
+def test_keeps_the_first_line_per_key(tmp_path):
+    contents = ["B\nb \na\n", "A\n b\nc\n"]
+    assert external(contents, tmp_path, modes=("case", "strip")) == (["a", "B", "c"], 6)
+
+
+def test_only_range_files_are_left(tmp_path):
+    range_paths, _, _ = main.external_sort_unique(make_contents(2, 500), str(tmp_path), 2)
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(Path(path).name for path in range_paths)
+
+
+def test_empty_input(tmp_path):
+    assert external([], tmp_path) == ([], 0)
+    assert external(["", "\n\n"], tmp_path) == in_memory(["", "\n\n"])
+
+
+def test_sort_dedupe_takes_the_external_path(monkeypatch):
+    contents = make_contents(2, 800)
+    expected = in_memory(contents)
+    monkeypatch.setattr(main, "DEDUPE_WORKERS", 2)
+    monkeypatch.setattr(main, "PARALLEL_DEDUPE_MIN_CHARS", 1)
+    assert main.uses_external_sort(contents)
+    assert not main.uses_external_sort(contents, main.DuplicateSketch())
+    assert main.sort_dedupe(contents) == expected
+
+
+def test_write_sorted_unique_applies_the_seen_filter():
+    contents = make_contents(2, 600)
+    lines, total = in_memory(contents)
+    main.merge_corpus(7, main.hash_keys(lines[::2]))
+    settings = {**main.DEFAULT_SETTINGS, "seen_filter": True}
+    path, written_total, unique, seen_removed, hashes = main.write_sorted_unique(7, settings, contents, "txt", "out")
+    try:
+        with open(path, encoding="utf-8", newline="\n") as f:
+            assert f.read().splitlines() == lines[1::2]
+    finally:
+        os.unlink(path)
+    assert (written_total, unique, seen_removed) == (total, len(lines), len(lines[::2]))
+    assert hashes.tolist() == main.hash_keys(lines[1::2]).tolist()
@@ -0,0 +1,83 @@
+"""FILTER: pattern parsing, compiled matchers, the batch timeout and streaming uploads."""
+import re
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def spec_of(*lines):
+    return main.parse_filter_patterns(lines)
+
+
+def test_parse_sorts_patterns_into_groups():
+    spec = spec_of("keep", "+also", "-drop", "/^re$/", "-/x+/", "  ", "+", "keep", "/ab")
+    assert spec == (("keep", "also", "/ab"), ("^re$",), ("drop",), ("x+",))
+    assert main.filter_pattern_count(spec) == (4, 2)
+
+
+def test_short_slashes_are_literals():
+    assert spec_of("//", "/") == (("//", "/"), (), (), ())
+
+
+@pytest.mark.parametrize("pattern", ["/(unclosed/", "/a)|(b/", "-/[z-a]/"])
+def test_parse_rejects_regexes_that_do_not_compile(pattern):
+    with pytest.raises(ValueError, match="Invalid regex"):
+        spec_of(pattern)
+
+
+def test_parse_rejects_long_patterns():
+    with pytest.raises(ValueError, match="longer than"):
+        spec_of("x" * (main.MAX_FILTER_PATTERN_CHARS + 1))
+    assert spec_of("x" * main.MAX_FILTER_PATTERN_CHARS)[0] == ("x" * main.MAX_FILTER_PATTERN_CHARS,)
+
+
+@pytest.mark.parametrize("literals", [["a"], ["ab", "ac", "b"], ["ab", "abc", "a.c"], ["foo", "fo", "f(o)"]])
+def test_literal_trie_regex_matches_like_an_alternation(literals):
+    trie = re.compile(main.literal_trie_regex(literals))
+    for text in ["", "a", "xabx", "ac", "b", "a.c", "abc", "fo", "f(o)", "fxo", "zzz"]:
+        assert bool(trie.search(text)) == any(literal in text for literal in literals)
+
+
+def test_include_and_exclude():
+    lines = ["apple pie", "banana split", "cherry pie", "apple tart", "plum"]
+    assert main.filter_lines(lines, spec_of("pie")) == ["apple pie", "cherry pie"]
+    assert main.filter_lines(lines, spec_of("-pie")) == ["banana split", "apple tart", "plum"]
+    assert main.filter_lines(lines, spec_of("apple", "/^b/", "-tart")) == ["apple pie", "banana split"]
+    assert main.filter_lines(lines, spec_of()) == lines
+
+
+def test_backreferences_keep_their_own_groups():
+    spec = spec_of("zz", r"/(\w)\1/", r"/(a)(b)\2/")
+    assert main.filter_lines(["book", "abb", "abc", "zz", "xyz"], spec) == ["book", "abb", "zz"]
+
+
+def test_inline_flags_apply_only_to_their_own_pattern():
+    spec = spec_of("/(?i)apple/", "/Pear/")
+    assert main.filter_lines(["APPLE", "pear", "Pear"], spec) == ["APPLE", "Pear"]
+
+
+def test_filter_batch_times_out_on_catastrophic_backtracking():
+    spec = spec_of("/(a+)+$/")
+    started = time.monotonic()
+    with pytest.raises(main.FilterTimeout):
+        main.filter_batch(["a" * 40 + "b"], spec, timeout=0.2)
+    assert time.monotonic() - started < 5
+    assert main.filter_batch(["aaa", "b"], spec, timeout=0.2) == ["aaa"]
+
+
+def test_filter_upload_filters_and_dedupes(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "IO_CHUNK_BYTES", 16)  # Many batches in flight
+    path = tmp_path / "upload.txt"
+    lines = [f"{word}{i % 7}" for i in range(200) for word in ("keep", "drop", "Keep")]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    kept, read = main.filter_upload(str(path), "upload.txt", spec_of("/^keep/", "-keep3"))
+    assert read == len(lines)
+    assert kept == [f"keep{i}" for i in (0, 1, 2, 4, 5, 6)]
+    kept, _ = main.filter_upload(str(path), "upload.txt", spec_of("/(?i)^keep/"), modes=("case",))
+    assert kept == [f"keep{i}" for i in range(7)]
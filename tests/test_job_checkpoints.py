@@ -0,0 +1,115 @@
+"""Checkpointed delivery: crash mid-send, resume, and stale-job cleanup."""
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from telegram.error import BadRequest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+class FakeBot:
+    """Records sent filenames; fails once `fail_after` documents have gone out."""
+
+    def __init__(self, fail_after=None, reject_groups=False):
+        self.sent = []
+        self.messages = []
+        self.fail_after = fail_after
+        self.reject_groups = reject_groups
+
+    def _send(self, filename):
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            raise RuntimeError("connection lost")
+        self.sent.append(filename)
+
+    async def send_document(self, chat_id, document, filename, caption):
+        self._send(filename)
+
+    async def send_media_group(self, chat_id, media):
+        if self.reject_groups:
+            raise BadRequest("group rejected")
+        for item in media:
+            self._send(item.media.filename)
+
+    async def send_message(self, chat_id, text):
+        self.messages.append(text)
+
+
+@pytest.fixture(autouse=True)
+def job_dirs(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(main, "CORPUS_DIR", str(tmp_path / "corpus"))
+    monkeypatch.setattr(main, "PART_SEND_DELAY", 0)
+    return tmp_path
+
+
+def make_job(tmp_path, parts, kind="split"):
+    job = main.create_job(kind, chat_id=1, user_id=7, params={})
+    for n in range(parts):
+        path = tmp_path / f"out{n}.txt"
+        path.write_text(f"part {n}\n")
+        main.add_job_part(job, str(path), f"part{n}.txt", f"Part {n}")
+    main.save_job(job)
+    return job
+
+
+def test_parts_go_out_in_order_and_the_job_is_removed(job_dirs):
+    job = make_job(job_dirs, 13)
+    bot = FakeBot()
+    asyncio.run(main.deliver_job(bot, job))
+    assert bot.sent == [f"part{n}.txt" for n in range(13)]
+    assert not os.path.exists(main.job_dir(job))
+
+
+def test_rejected_media_group_is_sent_singly(job_dirs):
+    job = make_job(job_dirs, 4)
+    bot = FakeBot(reject_groups=True)
+    asyncio.run(main.deliver_job(bot, job))
+    assert bot.sent == [f"part{n}.txt" for n in range(4)]
+
+
+def test_crash_mid_delivery_resumes_from_the_first_unsent_part(job_dirs):
+    job = make_job(job_dirs, 5)
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.send_parts_singly(FakeBot(fail_after=2), job, job["parts"]))
+    with open(os.path.join(main.job_dir(job), "manifest.json"), encoding="utf-8") as f:
+        assert json.load(f)["delivered"] == 2
+
+    jobs = main.load_jobs()
+    assert [loaded["id"] for loaded in jobs] == [job["id"]]
+    bot = FakeBot()
+    asyncio.run(main.resume_job(bot, jobs[0]))
+    assert bot.sent == ["part2.txt", "part3.txt", "part4.txt"]
+    assert "3 of 5" in bot.messages[0]
+    assert main.load_jobs() == []
+
+
+def test_seen_hashes_are_merged_only_after_delivery(job_dirs):
+    job = make_job(job_dirs, 1)
+    main.save_job_hashes(job, np.array([3, 1, 2], dtype=np.uint64))
+    assert main.corpus_size(7) == 0
+    asyncio.run(main.deliver_job(FakeBot(), job))
+    assert main.open_corpus(7).tolist() == [1, 2, 3]
+
+
+def test_stale_and_broken_jobs_are_discarded(job_dirs):
+    exhausted = make_job(job_dirs, 1)
+    exhausted["resumes"] = main.JOB_MAX_RESUMES
+    main.save_job(exhausted)
+    expired = make_job(job_dirs, 1)
+    expired["created"] -= main.JOB_MAX_AGE + 1
+    main.save_job(expired)
+    missing_part = make_job(job_dirs, 2)
+    os.unlink(os.path.join(main.job_dir(missing_part), missing_part["parts"][1]["file"]))
+    no_manifest = main.create_job("combine", chat_id=1, user_id=7, params={})
+    good = make_job(job_dirs, 1)
+
+    assert [job["id"] for job in main.load_jobs()] == [good["id"]]
+    assert os.listdir(main.JOBS_DIR) == [good["id"]]
+    assert not os.path.exists(main.job_dir(no_manifest))
@@ -0,0 +1,47 @@
+"""Dedupe-key normalization modes."""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+@pytest.mark.parametrize("modes, line, key", [
+    (("nfc",), "e\u0301", "\u00e9"),
+    (("case",), "StraSSe", "strasse"),
+    (("case",), "Straße", "strasse"),
+    (("strip",), "   word\t ", "word"),
+    (("strip",), "a  b", "a  b"),
+    (("collapse",), "  a  \t b  ", "a b"),
+    (("delim",), "user@example.com,;|\t ", "user@example.com"),
+    (("delim",), ",lead", ",lead"),
+    ((), "zero\u200bwidth", "zero\u200bwidth"),
+    (("strip",), "zero\u200bwidth", "zerowidth"),
+])
+def test_single_mode(modes, line, key):
+    assert main.build_normalizer(modes)([line]) == [key]
+
+
+def test_modes_combine():
+    normalize = main.build_normalizer(("nfc", "case", "collapse", "delim"))
+    assert normalize(["  Cafe\u0301   AU   Lait ;", "caf\u00e9 au lait"]) == ["caf\u00e9 au lait"] * 2
+
+
+def test_normalize_modes_are_in_canonical_order():
+    assert main.normalize_modes({"normalize": ["delim", "case", "nfc"]}) == ("nfc", "case", "delim")
+    assert main.normalize_modes({}) == ()
+
+
+def test_dedupe_keeps_the_first_original_line_per_key():
+    lines = ["Alice", "alice ", "BOB", "ALICE", "bob", "carol"]
+    assert main.dedupe_lines(lines, modes=("case", "strip")) == ["Alice", "BOB", "carol"]
+    assert main.dedupe_lines(lines) == lines
+
+
+def test_dedupe_content_uses_the_settings_modes():
+    settings = {**main.DEFAULT_SETTINGS, "normalize": ["case"]}
+    unique, total = main.dedupe_content("A\na\nB\nb\nA\n", settings)
+    assert (unique, total) == (["A", "B"], 5)
@@ -0,0 +1,63 @@
+"""parallel_dedupe() must return exactly what the serial dedupe returns."""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def serial_dedupe(contents, modes=()):
+    lines = [line for content in contents for line in content.splitlines()]
+    return main.dedupe_lines(lines, modes=modes), len(lines)
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Tiny chunks so even short inputs spread over many chunks and shards
+    monkeypatch.setattr(main, "PARALLEL_CHUNK_CHARS", 64)
+
+
+def make_contents(files, lines, newline="\n", seed=1):
+    rng = random.Random(seed)
+    return [newline.join(f"user{rng.randrange(lines // 2)}@example.com" for _ in range(lines)) + newline
+            for _ in range(files)]
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3])
+def test_matches_serial(workers):
+    contents = make_contents(3, 2000)
+    result = main.parallel_dedupe(contents, workers)
+    assert result == serial_dedupe(contents)
+    assert "\n".join(result[0]).encode() == "\n".join(serial_dedupe(contents)[0]).encode()
+
+
+def test_crlf_input():
+    contents = make_contents(2, 1000, newline="\r\n") + ["a\r\nb\na\r\n", "b\r\nc"]
+    result = main.parallel_dedupe(contents, 2)
+    assert result == serial_dedupe(contents)
+    assert not any("\r" in line for line in result[0])
+
+
+def test_duplicates_spanning_shards_keep_first_occurrence():
+    # Every chunk repeats lines first seen in earlier chunks, in a different order
+    block = [f"line{i}" for i in range(40)]
+    contents = ["\n".join(block) + "\n", "\n".join(reversed(block)) + "\nnew\n" + "\n".join(block)]
+    result = main.parallel_dedupe(contents, 3)
+    assert result == serial_dedupe(contents)
+    assert result[0] == block + ["new"]
+
+
+def test_empty_input():
+    assert main.parallel_dedupe([], 2) == ([], 0)
+    assert main.parallel_dedupe(["", ""], 2) == ([], 0)
+    assert main.parallel_dedupe(["\n\n", "x"], 2) == serial_dedupe(["\n\n", "x"])
+
+
+def test_normalize_modes():
+    contents = ["Alice\n alice \nBOB\n", "bob\nalice\ncarol\n"]
+    modes = ("case", "strip")
+    assert main.parallel_dedupe(contents, 2, modes) == serial_dedupe(contents, modes)
@@ -0,0 +1,94 @@
+"""ReferencePersistence: stored references, conversations and per-worker loading."""
+import asyncio
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def upload(name):
+    return {"file_id": f"id-{name}", "file_unique_id": f"u-{name}", "name": name, "size": 3, "content": "abc"}
+
+
+def run(path, *steps):
+    """Run coroutine factories against one persistence instance, then flush it."""
+    async def scenario():
+        persistence = main.ReferencePersistence(str(path), update_interval=60)
+        try:
+            return [await step(persistence) for step in steps]
+        finally:
+            await persistence.flush()
+    return asyncio.run(scenario())
+
+
+def test_user_data_round_trip_without_contents(tmp_path):
+    db = tmp_path / "sessions.db"
+    data = {"mode": "combine", "combine_files": [upload("a.txt")], "progress_message": object()}
+    run(db, lambda p: p.update_user_data(7, data))
+    [loaded] = run(db, lambda p: p.get_user_data())
+    assert loaded == {7: {"mode": "combine", "combine_files": [main.file_reference(upload("a.txt"))]}}
+    assert "content" in data["combine_files"][0]
+
+
+def test_unchanged_snapshot_is_not_rewritten(tmp_path):
+    db = tmp_path / "sessions.db"
+    statements = []
+
+    async def track(p):
+        real = p._execute
+        p._execute = lambda sql, params=(): statements.append(sql) or real(sql, params)
+        await p.update_user_data(7, {"mode": "split"})
+        await p.update_user_data(7, {"mode": "split"})
+
+    run(db, track)
+    assert len(statements) == 1
+
+
+def test_empty_user_data_removes_the_row(tmp_path):
+    db = tmp_path / "sessions.db"
+    run(db, lambda p: p.update_user_data(7, {"mode": "split"}),
+        lambda p: p.update_user_data(7, {"progress_message": object()}))
+    assert run(db, lambda p: p.get_user_data()) == [{}]
+
+
+def test_conversations_are_updated_and_deleted(tmp_path):
+    db = tmp_path / "sessions.db"
+    run(db, lambda p: p.update_conversation("main", (1, 7), 3),
+        lambda p: p.update_conversation("main", (2, 8), 4),
+        lambda p: p.update_conversation("main", (1, 7), 5),
+        lambda p: p.update_conversation("main", (2, 8), None))
+    assert run(db, lambda p: p.get_conversations("main")) == [{(1, 7): 5}]
+    assert run(db, lambda p: p.get_conversations("other")) == [{}]
+
+
+def test_workers_load_only_their_own_users(tmp_path, monkeypatch):
+    db = tmp_path / "sessions.db"
+    users = range(1, 41)
+
+    async def store(p):
+        for user_id in users:
+            await p.update_user_data(user_id, {"mode": "split"})
+            await p.update_conversation("main", (user_id, user_id), 1)
+
+    run(db, store)
+    monkeypatch.setattr(main, "_worker_count", 3)
+    loaded = []
+    for index in range(3):
+        monkeypatch.setattr(main, "_worker_index", index)
+        user_data, conversations = run(db, lambda p: p.get_user_data(), lambda p: p.get_conversations("main"))
+        assert all(main.worker_for(user_id, 3) == index for user_id in user_data)
+        assert sorted(key[-1] for key in conversations) == sorted(user_data)
+        loaded.extend(user_data)
+    assert sorted(loaded) == list(users)
+
+
+def test_flush_closes_the_database(tmp_path):
+    db = tmp_path / "sessions.db"
+    [persistence] = run(db, lambda p: asyncio.sleep(0, p))
+    with pytest.raises(sqlite3.ProgrammingError):
+        persistence.db.execute("SELECT 1")
@@ -0,0 +1,83 @@
+"""Head, tail and reservoir samplers and streaming dedupe."""
+import gzip
+import random
+import sys
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def batched(lines, size):
+    return [lines[i:i + size] for i in range(0, len(lines), size)]
+
+
+LINES = [f"line{i}" for i in range(100)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 100])
+def test_head_and_tail(size):
+    assert main.head_sample(batched(LINES, size), 10) == LINES[:10]
+    assert main.tail_sample(batched(LINES, size), 10) == LINES[-10:]
+    assert main.head_sample(batched(LINES, size), 500) == LINES
+    assert main.tail_sample(batched(LINES, size), 500) == LINES
+
+
+def test_head_stops_reading_once_full():
+    def batches():
+        yield LINES[:6]
+        yield LINES[6:12]
+        raise AssertionError("read past the sample")
+
+    assert main.head_sample(batches(), 12) == LINES[:12]
+
+
+@pytest.mark.parametrize("size", [1, 3, 100])
+def test_reservoir_returns_distinct_lines_in_file_order(size):
+    sample = main.reservoir_sample(batched(LINES, size), 20, random.Random(size))
+    assert len(sample) == 20
+    assert sample == sorted(set(sample), key=LINES.index)
+
+
+def test_reservoir_smaller_input_returns_everything():
+    assert main.reservoir_sample(batched(LINES[:5], 2), 10, random.Random(0)) == LINES[:5]
+    assert main.reservoir_sample([], 10, random.Random(0)) == []
+
+
+def test_reservoir_is_uniform():
+    rng = random.Random(11)
+    lines = LINES[:20]
+    trials = 20000
+    counts = Counter()
+    for _ in range(trials):
+        counts.update(main.reservoir_sample(batched(lines, 3), 4, rng))
+    expected = trials * 4 / len(lines)
+    assert set(counts) == set(lines)
+    assert all(abs(count - expected) < 0.06 * expected for count in counts.values())
+
+
+def test_dedupe_batches_drops_lines_seen_in_earlier_batches():
+    batches = [["a", "b", "a"], ["b", "c"], ["A", "c "]]
+    assert list(main.dedupe_batches(batches)) == [["a", "b"], ["c"], ["A", "c "]]
+    assert list(main.dedupe_batches(batches, ("case", "strip"))) == [["a", "b"], ["c"], []]
+
+
+@pytest.mark.parametrize("method, expected", [("head", ["x0", "x1", "x2"]), ("tail", ["x7", "x8", "x9"])])
+def test_sample_upload_reads_gzip_and_counts_lines(tmp_path, method, expected):
+    path = tmp_path / "upload.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write("".join(f"x{i}\n" for i in range(10)))
+    assert main.sample_upload(str(path), "upload.txt.gz", method, 3) == (expected, 10)
+
+
+def test_sample_upload_dedupes_before_sampling(tmp_path):
+    path = tmp_path / "upload.txt"
+    path.write_text("a\na\nb\nA\nc\nb\n", encoding="utf-8")
+    assert main.sample_upload(str(path), "upload.txt", "tail", 2, dedupe=True) == (["A", "c"], 6)
+    assert main.sample_upload(str(path), "upload.txt", "tail", 2, dedupe=True, modes=("case",)) == (["b", "c"], 6)
+    sample, read = main.sample_upload(str(path), "upload.txt", "random", 10, dedupe=True)
+    assert (sample, read) == (["a", "b", "A", "c"], 6)
@@ -0,0 +1,126 @@
+"""JobScheduler: smallest-first admission, aging, per-user quotas and cancellation."""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+async def admission_order(scheduler, jobs, gap=0.0):
+    """Queue (name, user_id, cost) jobs behind a blocker; return the order they are admitted in."""
+    admitted = []
+    release = asyncio.Event()
+    blocker_in = asyncio.Event()
+
+    async def blocker():
+        async with scheduler.slot(0, 1):
+            blocker_in.set()
+            await release.wait()
+
+    async def job(name, user_id, cost):
+        async with scheduler.slot(user_id, cost):
+            admitted.append(name)
+
+    tasks = [asyncio.create_task(blocker())]
+    await blocker_in.wait()
+    for name, user_id, cost in jobs:
+        tasks.append(asyncio.create_task(job(name, user_id, cost)))
+        await asyncio.sleep(gap)
+    await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks)
+    return admitted
+
+
+def test_smallest_job_runs_first():
+    scheduler = main.JobScheduler(slots=1, aging_rate=0)
+    order = asyncio.run(admission_order(scheduler, [("big", 1, 300), ("small", 2, 100), ("mid", 3, 200)]))
+    assert order == ["small", "mid", "big"]
+
+
+def test_aging_lets_an_old_large_job_overtake():
+    scheduler = main.JobScheduler(slots=1, aging_rate=1e9)
+    order = asyncio.run(admission_order(scheduler, [("big", 1, 1_000_000), ("small", 2, 10)], gap=0.05))
+    assert order == ["big", "small"]
+
+
+def test_per_user_job_limit_lets_other_users_through():
+    async def scenario():
+        scheduler = main.JobScheduler(slots=3, user_jobs=1, aging_rate=0)
+        release = asyncio.Event()
+        admitted = []
+
+        async def job(name, user_id):
+            async with scheduler.slot(user_id, 1):
+                admitted.append(name)
+                await release.wait()
+
+        tasks = [asyncio.create_task(job(name, user)) for name, user in [("a1", 1), ("a2", 1), ("b1", 2)]]
+        await asyncio.sleep(0.01)
+        running = list(admitted)
+        release.set()
+        await asyncio.gather(*tasks)
+        return running, admitted
+
+    running, admitted = asyncio.run(scenario())
+    assert running == ["a1", "b1"]
+    assert admitted == ["a1", "b1", "a2"]
+
+
+def test_byte_quota_holds_back_a_users_extra_job():
+    async def scenario():
+        scheduler = main.JobScheduler(slots=4, user_jobs=4, user_bytes=100, aging_rate=0)
+        release = asyncio.Event()
+        admitted = []
+
+        async def job(name, cost):
+            async with scheduler.slot(1, cost):
+                admitted.append(name)
+                await release.wait()
+
+        first = asyncio.create_task(job("60", 60))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(job("50", 50))
+        await asyncio.sleep(0.01)
+        running = list(admitted)
+        release.set()
+        await asyncio.gather(first, second)
+        return running
+
+    assert asyncio.run(scenario()) == ["60"]
+
+
+def test_job_over_the_byte_quota_runs_alone():
+    async def scenario():
+        scheduler = main.JobScheduler(slots=2, user_bytes=100)
+        async with scheduler.slot(1, 1000):
+            return {user: list(costs) for user, costs in scheduler.running.items()}
+
+    assert asyncio.run(scenario()) == {1: [1000]}
+
+
+def test_cancelled_waiting_job_leaves_the_queue():
+    async def scenario():
+        scheduler = main.JobScheduler(slots=1)
+        positions = []
+
+        async def on_queued(position, length):
+            positions.append((position, length))
+
+        async with scheduler.slot(1, 1):
+            waiter = asyncio.create_task(scheduler.slot(2, 1, on_queued).__aenter__())
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+            waiting = len(scheduler.waiting)
+        return positions, waiting, scheduler.active
+
+    positions, waiting, active = asyncio.run(scenario())
+    assert positions == [(1, 1)]
+    assert waiting == 0
+    assert active == 0
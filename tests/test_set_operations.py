@@ -0,0 +1,68 @@
+"""Set operations across files, checked against plain Python sets."""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    # Tiny batches so the streamed side spans many of them
+    monkeypatch.setattr(main, "PARALLEL_CHUNK_CHARS", 64)
+
+
+def reference(op, contents):
+    result = list(dict.fromkeys(contents[0].splitlines()))
+    for content in contents[1:]:
+        other = set(content.splitlines())
+        if op == "intersect":
+            result = [line for line in result if line in other]
+        elif op == "subtract":
+            result = [line for line in result if line not in other]
+        else:
+            kept = set(result)
+            result = [line for line in result if line not in other]
+            result.extend(line for line in dict.fromkeys(content.splitlines()) if line not in kept)
+    return result
+
+
+def make_content(lines, pool, seed):
+    rng = random.Random(seed)
+    return "\n".join(f"item{rng.randrange(pool)}" for _ in range(lines)) + "\n"
+
+
+@pytest.mark.parametrize("op", ["intersect", "subtract", "xor"])
+@pytest.mark.parametrize("sizes", [(400, 400, 400), (50, 2000), (2000, 50, 300)])
+def test_matches_python_sets(op, sizes):
+    contents = [make_content(lines, 300, seed) for seed, lines in enumerate(sizes)]
+    assert main.set_operation(op, contents) == reference(op, contents)
+
+
+def test_xor_keeps_lines_in_an_odd_number_of_files():
+    contents = ["a\nb\nc\n", "b\nd\n", "c\nd\ne\n"]
+    assert main.set_operation("xor", contents) == ["a", "e"]
+    assert sorted(main.set_operation("xor", contents)) == sorted({"a", "b", "c"} ^ {"b", "d"} ^ {"c", "d", "e"})
+
+
+def test_result_keeps_first_file_order_and_is_unique():
+    contents = ["z\ny\nz\nx\nw\n", "w\ny\nq\n"]
+    assert main.set_operation("intersect", contents) == ["y", "w"]
+    assert main.set_operation("subtract", contents) == ["z", "x"]
+
+
+def test_normalize_modes_compare_by_key():
+    contents = ["Alice\nBob \ncarol\n", "alice\nBOB\n"]
+    assert main.set_operation("intersect", contents, modes=("case", "strip")) == ["Alice", "Bob "]
+    assert main.set_operation("subtract", contents, modes=("case", "strip")) == ["carol"]
+    assert main.set_operation("subtract", contents) == ["Alice", "Bob ", "carol"]
+
+
+def test_empty_files():
+    assert main.set_operation("intersect", ["", "a\n"]) == []
+    assert main.set_operation("subtract", ["a\nb\n", ""]) == ["a", "b"]
+    assert main.set_operation("xor", ["", "a\na\n"]) == ["a"]
@@ -0,0 +1,129 @@
+"""SPLIT methods: lines, count, size, bytes and key."""
+import gzip
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def make_lines(count, seed=3):
+    rng = random.Random(seed)
+    return [f"{rng.choice(['a', 'bb', 'é' * 5])},{i},{'x' * rng.randrange(60)}" for i in range(count)]
+
+
+def split(lines, method, value, key_func=None, output_format="txt"):
+    files = main.split_into_files(lines, method, value, key_func, output_format, "base")
+    try:
+        parts = []
+        for number, path in files:
+            opener = gzip.open if output_format == "gz" else open
+            with opener(path, "rt", encoding="utf-8", newline="\n") as f:
+                parts.append((number, f.read().splitlines()))
+        return parts
+    finally:
+        main.discard_part_files(files)
+
+
+def test_lines_method_caps_lines_per_part():
+    parts = split(make_lines(1050), "lines", 100)
+    assert [len(lines) for _, lines in parts] == [100] * 10 + [50]
+    assert [line for _, lines in parts for line in lines] == make_lines(1050)
+
+
+def test_count_method_makes_near_equal_parts():
+    parts = split(make_lines(1003), "count", 4)
+    assert [len(lines) for _, lines in parts] == [251, 251, 251, 250]
+
+
+def test_size_method_keeps_parts_under_the_limit():
+    lines = make_lines(2000)
+    parts = split(lines, "size", 4)
+    assert all(len(("\n".join(part) + "\n").encode()) <= 4 * 1024 for _, part in parts)
+    assert [line for _, part in parts for line in part] == lines
+
+
+def test_size_method_keeps_an_oversized_line_whole():
+    parts = split(["y" * 5000, "short"], "size", 1)
+    assert [part for _, part in parts] == [["y" * 5000], ["short"]]
+
+
+def test_byte_balanced_ranges_are_contiguous_and_balanced():
+    lines = make_lines(5000)
+    ranges = main.byte_balanced_ranges(lines, 7)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(lines)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    sizes = [sum(len(line.encode()) + 1 for line in lines[start:end]) for start, end in ranges]
+    longest = max(len(line.encode()) + 1 for line in lines)
+    assert max(sizes) - min(sizes) <= 2 * longest
+
+
+def test_byte_balanced_ranges_cap_parts_at_line_count():
+    assert main.byte_balanced_ranges([], 5) == []
+    assert main.byte_balanced_ranges(["a", "b", "c"], 10 ** 9) == [(0, 1), (1, 2), (2, 3)]
+
+
+def test_bytes_method_writes_every_line_once_in_order():
+    lines = make_lines(3000)
+    parts = split(lines, "bytes", 5, output_format="gz")
+    assert len(parts) == 5
+    assert [line for _, part in parts for line in part] == lines
+
+
+@pytest.mark.parametrize("spec, line, key", [
+    ("3", "a,2,c", "a"),
+    ("3 f2", "a,2,c", "2"),
+    ("3 f2 ;", "a;x;z", "x"),
+    ("3 f2 tab", "a\tb", "b"),
+    ("3 p2", "a,2,c", "a,"),
+    ("3 f9", "a,2,c", ""),
+])
+def test_parse_key_spec(spec, line, key):
+    parts, key_func = main.parse_key_spec(spec)
+    assert parts == 3
+    assert key_func(line) == key
+
+
+@pytest.mark.parametrize("spec", ["0 f1", "3 q1", "3 f0", "x"])
+def test_parse_key_spec_rejects_bad_specs(spec):
+    with pytest.raises((ValueError, IndexError)):
+        main.parse_key_spec(spec)
+
+
+def test_key_method_keeps_equal_keys_together():
+    lines = make_lines(4000)
+    _, key_func = main.parse_key_spec("5 f1")
+    parts = split(lines, "key", 5, key_func)
+    owners = {}
+    for number, part in parts:
+        for line in part:
+            assert owners.setdefault(key_func(line), number) == number
+    assert sorted(line for _, part in parts for line in part) == sorted(lines)
+
+
+def test_key_method_drops_empty_parts():
+    parts = split(["same,1", "same,2"], "key", 4, lambda line: line.split(",")[0])
+    assert len(parts) == 1
+
+
+def test_key_split_removes_open_parts_when_a_writer_fails(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.tempfile, "tempdir", str(tmp_path))
+    real_writer = main.PartWriter
+    opened = []
+
+    def failing_writer(*args):
+        if len(opened) == 3:
+            raise OSError(24, "Too many open files")
+        opened.append(real_writer(*args))
+        return opened[-1]
+
+    monkeypatch.setattr(main, "PartWriter", failing_writer)
+    with pytest.raises(OSError):
+        main.split_by_key(make_lines(10), 10, lambda line: line, "txt", "base")
+    assert len(opened) == 3
+    assert os.listdir(tmp_path) == []
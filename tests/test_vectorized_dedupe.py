@@ -0,0 +1,59 @@
+"""NumPy first-occurrence dedupe and its fallback on hash collisions."""
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+class Colliding(str):
+    """A str whose hash collides with every other Colliding value."""
+
+    def __hash__(self):
+        return 42
+
+
+@pytest.fixture(autouse=True)
+def vectorize_small_inputs(monkeypatch):
+    monkeypatch.setattr(main, "VECTORIZED_DEDUPE_MIN_LINES", 1)
+
+
+def test_first_occurrence_indices_match_dict_order():
+    rng = random.Random(5)
+    keys = [f"k{rng.randrange(500)}" for _ in range(5000)]
+    firsts = main.first_occurrence_indices(keys)
+    expected = list(dict.fromkeys(keys))
+    assert [keys[i] for i in firsts] == expected
+    assert list(firsts) == sorted(firsts)
+
+
+def test_collision_returns_none():
+    keys = [Colliding("a"), Colliding("b"), Colliding("a")]
+    assert main.first_occurrence_indices(keys) is None
+
+
+def test_equal_keys_sharing_a_hash_are_not_a_collision():
+    keys = [Colliding("a"), Colliding("a")]
+    assert list(main.first_occurrence_indices(keys)) == [0]
+
+
+def test_dedupe_lines_falls_back_on_collision():
+    lines = [Colliding(x) for x in "abacb"]
+    assert main.dedupe_lines(lines) == ["a", "b", "c"]
+
+
+@pytest.mark.parametrize("modes", [(), ("case", "strip")])
+def test_vectorized_dedupe_matches_dict_dedupe(modes, monkeypatch):
+    rng = random.Random(9)
+    lines = [rng.choice(["", " ", "X"]) + f"line{rng.randrange(300)}" for _ in range(3000)]
+    vectorized = main.dedupe_lines(lines, modes=modes)
+    monkeypatch.setattr(main, "VECTORIZED_DEDUPE_MIN_LINES", len(lines) + 1)
+    assert vectorized == main.dedupe_lines(lines, modes=modes)
+
+
+def test_empty_input():
+    assert main.dedupe_lines([]) == []
@@ -0,0 +1,65 @@
+"""Dispatcher routing: users hash to a stable worker that owns their state."""
+import os
+import subprocess
+import sys
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    def become(index, count):
+        monkeypatch.setattr(main, "_worker_index", index)
+        monkeypatch.setattr(main, "_worker_count", count)
+    return become
+
+
+def test_worker_for_is_stable_across_processes():
+    users = [1, 42, 123456789, 987654321012]
+    here = [main.worker_for(user_id, 4) for user_id in users]
+    code = f"import main; print([main.worker_for(u, 4) for u in {users}])"
+    other = subprocess.run([sys.executable, "-c", code], cwd=Path(main.__file__).parent,
+                           capture_output=True, text=True, check=True, env={**os.environ, "PYTHONHASHSEED": "123"})
+    assert other.stdout.strip() == str(here)
+
+
+def test_users_spread_evenly():
+    counts = Counter(main.worker_for(user_id, 4) for user_id in range(100_000, 120_000))
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert max(counts.values()) - min(counts.values()) < 0.1 * 5000
+
+
+def test_each_user_has_exactly_one_owner(worker):
+    for user_id in range(200):
+        owners = []
+        for index in range(3):
+            worker(index, 3)
+            if main.owns_user(user_id):
+                owners.append(index)
+        assert owners == [main.worker_for(user_id, 3)]
+
+
+def test_single_process_owns_everyone(worker):
+    worker(0, 1)
+    assert all(main.owns_user(user_id) for user_id in range(50))
+
+
+def test_update_worker_routes_by_user_then_chat():
+    user, chat = SimpleNamespace(id=1001), SimpleNamespace(id=-5002)
+    assert main.update_worker(SimpleNamespace(effective_user=user, effective_chat=chat), 5) == main.worker_for(1001, 5)
+    assert main.update_worker(SimpleNamespace(effective_user=None, effective_chat=chat), 5) == main.worker_for(-5002, 5)
+    assert main.update_worker(SimpleNamespace(effective_user=None, effective_chat=None), 5) == 0
+
+
+def test_worker_log_path(worker):
+    worker(0, 1)
+    assert main.worker_log_path("logs/bot.jsonl") == "logs/bot.jsonl"
+    worker(2, 3)
+    assert main.worker_log_path("logs/bot.jsonl") == "logs/bot.worker2.jsonl"